@@ -15,8 +15,11 @@ import numpy as np
 import typing
 import math
 from scipy.optimize import curve_fit
-import statistics
 import typing
+import collections.abc
+import concurrent.futures
+import pickle
+import custom_filehandler as cfile
 
 
 
@@ -47,8 +50,183 @@ def diode_fit(V, sig, mean, A, h):
     return y
 
 
+'''
+    this class bins all IV curves of a data slice onto one shared voltage grid and calculates all statistics
+    (count, mean, std, se, median, mode, min, max and quantiles) for every voltage in one vectorized pass.
+    x and y are the voltages and currents of all curves, concatenated.
+    voltages closer than resolution end up in the same bin, the grid keeps the voltages in the order they appear first.
+'''
+class SliceStatistics():
+
+    def __init__(self, *, x: np.ndarray, y: np.ndarray, 
+                 quantiles: typing.Sequence[float] = (0.25, 0.75), 
+                 resolution: float = 1e-9) -> None:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        keys = np.round(x / resolution).astype(np.int64)
+        _, first, bins = np.unique(keys, return_index=True, return_inverse=True)
+        # renumber the bins in order of appearance
+        appearance = np.argsort(first, kind="stable")
+        rank = np.empty_like(appearance)
+        rank[appearance] = np.arange(len(appearance))
+        bins = rank[bins.reshape(-1)]
+        self.grid = x[first[appearance]]
+        n_bins = len(self.grid)
+
+        self.count = np.bincount(bins, minlength=n_bins)
+        self.mean = np.bincount(bins, weights=y, minlength=n_bins) / np.maximum(self.count, 1)
+        squares = np.bincount(bins, weights=(y - self.mean[bins]) ** 2, minlength=n_bins)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.std = np.where(self.count > 1, np.sqrt(squares / (self.count - 1)), np.nan)
+            self.se = self.std / np.sqrt(self.count)
+
+        # sorting by bin and current once gives median, quantiles, min, max and mode
+        order = np.lexsort((y, bins))
+        y_sorted = y[order]
+        bins_sorted = bins[order]
+        starts = np.concatenate(([0], np.cumsum(self.count)[:-1]))
+        self.minimum = y_sorted[starts] if len(y) else np.zeros(0)
+        self.maximum = y_sorted[starts + self.count - 1] if len(y) else np.zeros(0)
+        self.median = self._quantile(y_sorted=y_sorted, starts=starts, q=0.5)
+        self.quantiles = {q: self._quantile(y_sorted=y_sorted, starts=starts, q=q) for q in quantiles}
+
+        # mode: the longest run of equal currents in every bin, ties go to the value that appears first (like statistics.mode)
+        if len(y):
+            run_starts = np.flatnonzero(np.concatenate(([True], (np.diff(bins_sorted) != 0) | (np.diff(y_sorted) != 0))))
+            run_lengths = np.diff(np.concatenate((run_starts, [len(y)])))
+            run_first = np.minimum.reduceat(order, run_starts)
+            run_bins = bins_sorted[run_starts]
+            best = np.lexsort((run_first, -run_lengths, run_bins))
+            best = best[np.concatenate(([True], np.diff(run_bins[best]) != 0))]
+            self.mode = y_sorted[run_starts[best]]
+        else:
+            self.mode = np.zeros(0)
+
+    # linear interpolation between the closest ranks, like np.quantile(...) and statistics.median(...)
+    def _quantile(self, *, y_sorted: np.ndarray, starts: np.ndarray, q: float) -> np.ndarray:
+        if len(y_sorted) == 0:
+            return np.zeros(0)
+        position = starts + q * (self.count - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        return y_sorted[lower] + (y_sorted[upper] - y_sorted[lower]) * (position - lower)
+
+    # returns one statistic as {voltage: value}, like Dataset.get_slice_mean(...)
+    # name is one of count, mean, std, se, median, mode, minimum, maximum or a quantile like 0.25
+    def to_dict(self, *, name: typing.Union[str, float]) -> typing.Dict[float, float]:
+        values = self.quantiles[name] if isinstance(name, float) else getattr(self, name)
+        return dict(zip(self.grid.tolist(), values.tolist()))
+
 
 
+# parses one JSON file, this runs in the worker processes of Dataset.load_files(...)
+def _parse_json_file(filepath: str) -> typing.Tuple[str, typing.Any, typing.Optional[str]]:
+    try:
+        with open(filepath, 'r', encoding='utf-8') as file:
+            return filepath, json.load(file), None
+    except Exception as e:
+        return filepath, None, str(e)
+
+
+'''
+    this class is the on-disk cache of Dataset.load_files(...).
+    every parsed file is stored together with its modification time and size, 
+    a file is only parsed again if one of them changed.
+    the parsed data is stored in shards (one pickle file per load_files call that parsed new files), 
+    index.pickle maps every path to (mtime, size, shard). 
+    when there are more than max_shards shards, all of them are merged into one.
+'''
+class ParseCache():
+    INDEX_FILE = "index.pickle"
+
+    def __init__(self, *, folder: str = ".analyzer_cache", max_shards: int = 16) -> None:
+        self.folder = folder
+        self.max_shards = max_shards
+        self.index: typing.Dict[str, typing.Tuple[int, int, str]] = {}
+        if os.path.isfile(os.path.join(folder, self.INDEX_FILE)):
+            try:
+                with open(os.path.join(folder, self.INDEX_FILE), 'rb') as file:
+                    self.index = pickle.load(file)
+            except Exception as e:
+                print(f"Warning: parse cache index in {folder} is unreadable and will be rebuilt: {e}")
+
+    # returns the cached data of all files that did not change and the list of files that have to be parsed
+    def lookup(self, *, files: typing.Dict[str, typing.Tuple[int, int]]) -> typing.Tuple[typing.Dict[str, typing.Any], typing.List[str]]:
+        needed: typing.Dict[str, typing.List[str]] = {}
+        missing = []
+        for path, (mtime, size) in files.items():
+            entry = self.index.get(path)
+            if entry is not None and entry[0] == mtime and entry[1] == size:
+                needed.setdefault(entry[2], []).append(path)
+            else:
+                missing.append(path)
+        cached = {}
+        for shard, paths in needed.items():
+            try:
+                content = self._read_shard(shard=shard)
+                for path in paths:
+                    cached[path] = content[path]
+            except Exception as e:
+                print(f"Warning: parse cache shard {shard} is unreadable, parsing its files again: {e}")
+                missing.extend(paths)
+        return cached, missing
+
+    # stores newly parsed files in a new shard
+    def store(self, *, parsed: typing.Dict[str, typing.Any], files: typing.Dict[str, typing.Tuple[int, int]]) -> None:
+        if not parsed:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        shard = f"shard_{time.strftime('%Y_%m_%d-%H_%M_%S')}_{os.getpid()}_{len(self._shards())}.pickle"
+        self._write(name=shard, content=parsed)
+        for path in parsed:
+            self.index[path] = (files[path][0], files[path][1], shard)
+        if len(self._shards()) > self.max_shards:
+            self.compact()
+        else:
+            self._write(name=self.INDEX_FILE, content=self.index)
+
+    # merges all shards into one and drops entries of outdated files:
+    # files that were deleted or changed since they were cached and files whose shard is unreadable
+    def compact(self) -> None:
+        current = {}
+        for path, entry in self.index.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_mtime_ns == entry[0] and stat.st_size == entry[1]:
+                current[path] = entry
+        merged = {}
+        for shard in set(entry[2] for entry in current.values()):
+            try:
+                content = self._read_shard(shard=shard)
+            except Exception as e:
+                print(f"Warning: parse cache shard {shard} is unreadable, its files are dropped from the cache: {e}")
+                continue
+            merged.update({path: content[path] for path, entry in current.items() if entry[2] == shard and path in content})
+        name = f"shard_{time.strftime('%Y_%m_%d-%H_%M_%S')}_{os.getpid()}_merged.pickle"
+        self._write(name=name, content=merged)
+        self.index = {path: (current[path][0], current[path][1], name) for path in merged}
+        self._write(name=self.INDEX_FILE, content=self.index)
+        for shard in self._shards():
+            if shard != name:
+                os.remove(os.path.join(self.folder, shard))
+
+    def _shards(self) -> typing.List[str]:
+        if not os.path.isdir(self.folder):
+            return []
+        return [i for i in os.listdir(self.folder) if i.startswith("shard_")]
+
+    def _read_shard(self, *, shard: str) -> typing.Dict[str, typing.Any]:
+        with open(os.path.join(self.folder, shard), 'rb') as file:
+            return pickle.load(file)
+
+    # writes to a temporary file first, so an interrupted write never leaves a broken cache behind
+    def _write(self, *, name: str, content: typing.Any) -> None:
+        tmp_path = os.path.join(self.folder, f".{name}.tmp")
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(content, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(self.folder, name))
 
 
 '''
@@ -62,6 +240,8 @@ class Dataset():
         self.data: typing.Dict[str, typing.Dict[str, typing.Any]] = {}  # the raw data from all selected json files. For more, conslt Dataset.add_files()
         self.slices: typing.Dict[str, typing.Dict[str, typing.Any]] = {}    # the data sliced by different parameters. For more, consult Dataset.filter()
         self.description = description
+        self._statistics: typing.Dict[str, typing.Any] = {}  # cached SliceStatistics per slice. For more, consult Dataset.get_slice_statistics()
+        self._query_index: typing.Optional[DatasetIndex] = None  # hash and sorted indexes for filtering. For more, consult Dataset.query()
 
 
     # In case, the dataset consists of only one slice, you dont have to specify the slicename, it will be picked automatically.
@@ -75,6 +255,7 @@ class Dataset():
             return str(slicename) 
 
     def add_files(self, *, files: typing.List[typing.Any] = [], only_measurements: bool = True) -> None:
+        self._query_index = None
         try:
             if only_measurements:
                 for i in files:
@@ -96,7 +277,111 @@ class Dataset():
         except Exception as e:
             print(f"Error loading files: {e}")
             return
-        
+
+    '''
+    this function does the same as Dataset.add_files(...), but faster:
+    - files are parsed in parallel by a pool of processes (None uses all cores, 1 parses in this process)
+    - parsed files are kept in an on-disk cache (see ParseCache), unchanged files are never parsed twice.
+      After a new run, only its new files are parsed. Set cache_folder to None to disable the cache.
+    it returns the load statistics (number of files, cache hits, files/s and MB/s) and prints them if verbose is True
+    '''
+    def load_files(self, *, 
+                   files: typing.List[typing.Any] = [], 
+                   only_measurements: bool = True, 
+                   processes: typing.Optional[int] = None, 
+                   cache_folder: typing.Optional[str] = ".analyzer_cache", 
+                   verbose: bool = True) -> typing.Dict[str, float]:
+        self._query_index = None
+        start = time.time()
+        stats = {}
+        for i in files:
+            if not (i.endswith(".json") and ("IV_" in i or not only_measurements)):
+                continue
+            try:
+                stat = os.stat(i)
+            except FileNotFoundError:
+                print(f"Error loading files: File {i} does not exist.")
+                continue
+            stats[i] = (stat.st_mtime_ns, stat.st_size)
+
+        cache = ParseCache(folder=cache_folder) if cache_folder is not None else None
+        if cache is not None:
+            cached, missing = cache.lookup(files=stats)
+        else:
+            cached, missing = {}, list(stats)
+
+        parsed = {}
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if missing:
+            if processes == 1 or len(missing) < 64:
+                results = map(_parse_json_file, missing)
+                parsed = self._collect_parsed(results=results)
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                    results = executor.map(_parse_json_file, missing, chunksize=max(1, len(missing) // (4 * processes)))
+                    parsed = self._collect_parsed(results=results)
+            if cache is not None:
+                cache.store(parsed=parsed, files=stats)
+
+        # keep the order of the given files, like Dataset.add_files(...)
+        for i in stats:
+            if i in cached:
+                self.data[i] = cached[i]
+            elif i in parsed:
+                self.data[i] = parsed[i]
+
+        elapsed = max(time.time() - start, 1e-9)
+        parsed_bytes = sum(stats[i][1] for i in parsed)
+        report = {"files": len(cached) + len(parsed),
+                  "cached": len(cached),
+                  "parsed": len(parsed),
+                  "seconds": elapsed,
+                  "files_per_s": (len(cached) + len(parsed)) / elapsed,
+                  "MB_per_s": sum(stats[i][1] for i in stats if i in cached or i in parsed) / 1e6 / elapsed,
+                  "parsed_MB": parsed_bytes / 1e6}
+        if verbose:
+            print(f"Loaded {report['files']} files ({report['cached']} from cache, {report['parsed']} parsed) "
+                  f"in {elapsed:.2f}s: {report['files_per_s']:.0f} files/s, {report['MB_per_s']:.1f} MB/s")
+        return report
+
+    @staticmethod
+    def _collect_parsed(*, results: typing.Iterable[typing.Tuple[str, typing.Any, typing.Optional[str]]]) -> typing.Dict[str, typing.Any]:
+        parsed = {}
+        for filepath, data, error in results:
+            if error is not None:
+                print(f"Error loading file {filepath}: {error}")
+            else:
+                parsed[filepath] = data
+        return parsed
+
+    '''
+    this function loads all measurements of a run from its columnar store (see custom_filehandler.ColumnarStore)
+    the measurements get the same keys and content as if they were loaded from their JSON files with Dataset.add_files(...)
+    '''
+    def add_store(self, *, folder: str) -> int:
+        content = cfile.ColumnarStore(folder=folder).load()
+        self._query_index = None
+        rbias = np.column_stack((content["rbias_v"], content["rbias_i"]))
+        fbias = np.column_stack((content["fbias_v"], content["fbias_i"]))
+        for n, filename in enumerate(content["files"]):
+            data = dict(content["settings"][n])
+            for bias, values in (("rbias", rbias), ("fbias", fbias)):
+                if content[f"{bias}_valid"][n]:
+                    offset = content[f"{bias}_offset"][n]
+                    data[f"iv_data_{bias}"] = values[offset:offset + content[f"{bias}_len"][n]].tolist()
+                else:
+                    data[f"iv_data_{bias}"] = None
+            self.data[filename] = data
+        return len(content["files"])
+
+    # loads every columnar store found in startdir and its subdirectories, e.g. data_storage/
+    def add_stores(self, *, startdir: str) -> int:
+        count = 0
+        for folder in cfile.get_all_store_folders(startdir=startdir):
+            count += self.add_store(folder=folder)
+        return count
+
     def get_times_at_start(self) -> typing.List[str]:
         starttimes: typing.List[str] = []
         for filename, data in self.data.items():
@@ -141,6 +426,57 @@ class Dataset():
                     print(f"Warning: '{key}' not found in {filename}")
         return output
     
+    # returns the index of all loaded measurements, it is rebuilt when measurements were added or removed
+    def _get_index(self) -> "DatasetIndex":
+        if self._query_index is None or self._query_index.size != len(self.data):
+            files = list(self.data)
+            self._query_index = DatasetIndex(files=files, records=[self.data[i] for i in files])
+        return self._query_index
+
+    # builds the hash and sorted indexes of the given keys right away instead of on their first use
+    def build_index(self, *, keys: typing.Sequence[str] = ()) -> None:
+        index = self._get_index()
+        for key in keys or DatasetIndex.INDEXED_KEYS:
+            index.build(key=key)
+
+    # the row numbers (see DatasetIndex) of all measurements in a slice
+    def _slice_rows(self, *, target_slice_name: str) -> np.ndarray:
+        target_slice = self.slices[target_slice_name]
+        if isinstance(target_slice, SliceView):
+            return target_slice.rows
+        row_of = self._get_index().row_of
+        return np.array(sorted(row_of[filename] for filename in target_slice if filename in row_of), dtype=np.int64)
+
+    # creates the slice that is stored in Dataset.slices for the given rows
+    def _make_slice(self, *, rows: np.ndarray) -> typing.Any:
+        files = self._get_index().files
+        return {files[row]: self.data[files[row]] for row in rows.tolist()}
+
+    # creates a SliceView that only holds the given rows
+    def _slice_view(self, *, rows: np.ndarray) -> "SliceView":
+        index = self._get_index()
+        return SliceView(data=self.data, files=index.files, row_of=index.row_of, rows=rows)
+
+    # returns the rows for which the parameter matches the range or value, limited to the given rows
+    def _match_rows(self, *, parameter: str,
+                    range: typing.Optional[typing.List[float]] = None,
+                    value: typing.Optional[typing.Union[float, str, int]] = None,
+                    rows: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        if range is not None and value is not None:
+            raise ValueError("You can only specify either 'range' or 'value', not both.")
+        if range is None and value is None:
+            raise ValueError("You must specify either 'range' or 'value'.")
+        index = self._get_index()
+        if range is not None:
+            if not isinstance(range, list) or len(range) != 2:
+                raise ValueError("Range must be a list with two elements.")
+            matches = index.between(key=parameter, min_val=range[0], max_val=range[1])
+        else:
+            matches = index.equal(key=parameter, value=value)
+        if rows is not None:
+            matches = np.intersect1d(matches, rows, assume_unique=True)
+        return matches
+
     '''
     this function filters the data based on a parameter and a range or value.
     the filtered data is stored in the slices dictionary
@@ -154,32 +490,12 @@ class Dataset():
                range: typing.Optional[typing.List[float]] = None, 
                value: typing.Optional[typing.Union[float, str, int]] = None, 
                slicename: typing.Optional[str] = None) -> typing.Tuple[str, typing.Dict[typing.Any, typing.Any]]:
-        if range is not None and value is not None:
-            raise ValueError("You can only specify either 'range' or 'value', not both.")
-        if range is None and value is None:
-            raise ValueError("You must specify either 'range' or 'value'.")
         if slicename is None:
             slicename = f"filter_{parameter}_range_{range}_value_{value}"
         else:
             slicename = str(slicename)
-        slice = {}
-        if range is not None:
-            if not isinstance(range, list) or len(range) != 2:
-                raise ValueError("Range must be a list with two elements.")
-            min_val, max_val = range
-            for filename, data in self.data.items():
-                if parameter in data and min_val <= data[parameter] <= max_val:
-                    slice[filename] = data
-            self.slices[slicename] = slice
-        elif value is not None:
-            for filename, data in self.data.items():
-                if parameter in data and data[parameter] == value:
-                    slice[filename] = data
-            self.slices[slicename] = slice
-
-        else:
-            raise ValueError("Either range or value must be provided.")
-
+        slice = self._make_slice(rows=self._match_rows(parameter=parameter, range=range, value=value))
+        self.slices[slicename] = slice
         return slicename, slice
 
     '''
@@ -198,36 +514,50 @@ class Dataset():
             name = target_slice_name
         if target_slice_name not in self.slices:
             raise ValueError(f"Slice '{target_slice_name}' does not exist.")
-        if range is not None and value is not None:
-            raise ValueError("You can only specify either 'range' or 'value', not both.")
-        if range is None and value is None:
-            raise ValueError("You must specify either 'range' or 'value'.")
-        target_slice = self.slices[target_slice_name]
-        new_slice = {}
-
-        if range is not None:
-            if not isinstance(range, list) or len(range) != 2:
-                raise ValueError("Range must be a list with two elements.")
-            min_val, max_val = range
-            for filename, data in target_slice.items():
-                
-                if parameter in data and min_val <= target_slice[filename][parameter] <= max_val:
-                    new_slice.update({filename: {parameter: data}})
-
-
-            self.slices[name] = new_slice
-
-        elif value is not None:
-            for filename, data in target_slice.items():
-                if parameter in data and target_slice[filename][parameter] == value:
-                    new_slice.update({filename: data})
-            self.slices[name] = new_slice
-
-        else:
-            raise ValueError("Either range or value must be provided.")
-        
+        rows = self._match_rows(parameter=parameter, range=range, value=value, 
+                                rows=self._slice_rows(target_slice_name=target_slice_name))
+        new_slice = self._make_slice(rows=rows)
+        self.slices[name] = new_slice
         return name, new_slice
 
+    '''
+    this function combines several filters in one call and stores the result as a SliceView (an index array, no copied data).
+    where maps parameters to conditions:
+        a list with two elements    inclusive range, like the range of Dataset.filter(...)
+        a tuple or set              the parameter has to be one of the values
+        anything else               the parameter has to be equal to the value
+    e.g. dataset.query(where={"identifier": "04E10", "diode_Nr": "1,1", "temp_at_end": [24.5, 25.5]})
+    if target_slice_name is given, only the measurements of that slice are queried.
+    '''
+    def query(self, *, 
+              where: typing.Dict[str, typing.Any], 
+              target_slice_name: typing.Optional[str] = None, 
+              slicename: typing.Optional[str] = None) -> typing.Tuple[str, "SliceView"]:
+        if slicename is None:
+            slicename = "query_" + "_".join(f"{key}_{condition}" for key, condition in where.items())
+        rows = None
+        if target_slice_name is not None:
+            if target_slice_name not in self.slices:
+                raise ValueError(f"Slice '{target_slice_name}' does not exist.")
+            rows = self._slice_rows(target_slice_name=target_slice_name)
+        index = self._get_index()
+        # the most selective conditions first, so the intersections stay small
+        for key, condition in sorted(where.items(), key=lambda item: index.estimate(key=item[0], condition=item[1])):
+            if isinstance(condition, list):
+                rows = self._match_rows(parameter=key, range=condition, rows=rows)
+            elif isinstance(condition, (tuple, set, frozenset)):
+                matches = np.unique(np.concatenate([index.equal(key=key, value=i) for i in condition] or [np.zeros(0, dtype=np.int64)]))
+                rows = matches if rows is None else np.intersect1d(matches, rows, assume_unique=True)
+            else:
+                rows = self._match_rows(parameter=key, value=condition, rows=rows)
+            if len(rows) == 0:
+                break
+        if rows is None:
+            rows = index.rows
+        slice = self._slice_view(rows=rows)
+        self.slices[slicename] = slice
+        return slicename, slice
+
     def get_slice(self, *, target_slice_name: typing.Optional[str] = None) -> dict:
         target_slice_name = self._slicename_provider(slicename=target_slice_name)
         if target_slice_name not in self.slices:
@@ -274,51 +604,74 @@ class Dataset():
         return vals
 
 
+    # returns the voltages and currents of all curves of a data slice as two flat arrays, fbias curves first (like Dataset.get_vals)
+    def _slice_xy(self, *, 
+                  target_slice_name: str, 
+                  rbias_only: bool = False, 
+                  fbias_only: bool = False) -> typing.Tuple[np.ndarray, np.ndarray]:
+        if rbias_only and fbias_only:
+            raise ValueError("You can only specify either 'rbias_only' or 'fbias_only', not both.")
+        target_slice = self.slices[target_slice_name]
+        pairs: typing.List[typing.Any] = []
+        for key in [k for k, skip in (("iv_data_fbias", rbias_only), ("iv_data_rbias", fbias_only)) if not skip]:
+            for measurement in target_slice:
+                data = target_slice[measurement]
+                if key in data and data[key] is not None:
+                    pairs.extend(data[key])
+        xy = np.array(pairs, dtype=np.float64).reshape(-1, 2)
+        return xy[:, 0], xy[:, 1]
+
+    # the number of measurements in a slice, without the results that are stored in it (e.g. slice["mean"])
+    @staticmethod
+    def _measurement_count(*, target_slice: typing.Any) -> int:
+        if isinstance(target_slice, SliceView):
+            return len(target_slice.rows)
+        return sum(1 for data in target_slice.values() 
+                   if isinstance(data, collections.abc.Mapping) and ("iv_data_rbias" in data or "iv_data_fbias" in data))
+
+    '''
+    this function calculates all statistics of a data slice at once (see SliceStatistics) and caches them.
+    the cache is used as long as the slice is not replaced or changed in size,
+    so calling get_slice_mean, get_slice_std, get_slice_se, ... after each other only bins the data once.
+    '''
+    def get_slice_statistics(self, *, 
+                             target_slice_name: typing.Optional[str] = None, 
+                             rbias_only: bool = False, 
+                             fbias_only: bool = False, 
+                             force_calculations: bool = False) -> SliceStatistics:
+        target_slice_name = self._slicename_provider(slicename=target_slice_name)
+        if target_slice_name not in self.slices:
+            raise ValueError(f"Slice '{target_slice_name}' does not exist.")
+        target_slice = self.slices[target_slice_name]
+        cache_key = f"{target_slice_name}_rbias_only_{rbias_only}_fbias_only_{fbias_only}"
+        cached = self._statistics.get(cache_key)
+        size = self._measurement_count(target_slice=target_slice)
+        if not force_calculations and cached is not None and cached[0] is target_slice and cached[1] == size:
+            return cached[2]
+        x, y = self._slice_xy(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
+        stats = SliceStatistics(x=x, y=y)
+        self._statistics[cache_key] = (target_slice, size, stats)
+        return stats
+
     # this function calculates the mean of y vales of a data slice
     def get_slice_mean(self, *, target_slice_name: typing.Optional[str] = None, rbias_only: bool = False, fbias_only: bool = False) -> typing.Dict[float, float]: 
         target_slice_name = self._slicename_provider(slicename=target_slice_name)
-        target_slice = self.slices[target_slice_name]
-        if hasattr(target_slice, "vals"):
-            vals = target_slice["vals"]
-        else:
-            vals = self.get_vals(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
-        mean = {}
-        for x, y in vals.items():
-            mean[x] = sum(y) / len(y)
-        target_slice["mean"] = mean
+        mean = self.get_slice_statistics(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only).to_dict(name="mean")
+        self.slices[target_slice_name]["mean"] = mean
         return mean
     
     # this function calculates the standard deviation of y vales of a data slice
     def get_slice_std(self, *, target_slice_name: typing.Optional[str] = None, rbias_only: bool = False, fbias_only: bool = False) -> typing.Dict[float, float]:
         target_slice_name = self._slicename_provider(slicename=target_slice_name)
-        target_slice = self.slices[target_slice_name]
-        if hasattr(target_slice, "vals"):
-            vals = target_slice["vals"]
-        else:
-            vals = self.get_vals(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
-        
-        std = {}
-        for x, y in vals.items():
-            mean = sum(y) / len(y)
-            variance = sum((i - mean) ** 2 for i in y) / (len(y) - 1)
-            std[x] = np.sqrt(variance)
-        target_slice["std"] = std
+        std = self.get_slice_statistics(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only).to_dict(name="std")
+        self.slices[target_slice_name]["std"] = std
         return std 
 
     # this function calculates the standard error of y vales of a data slice
     def get_slice_se(self, *, target_slice_name: typing.Optional[str] = None, rbias_only: bool = False, fbias_only: bool = False) -> typing.Dict[float, float]:
         target_slice_name = self._slicename_provider(slicename=target_slice_name)
-        target_slice = self.slices[target_slice_name]
-        if hasattr(target_slice, "vals"):
-            vals = target_slice["vals"]
-        else:
-            vals = self.get_vals(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
-        
-        std = self.get_slice_std(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
-        se = {}
-        for x, std in std.items():
-            se[x] = std / np.sqrt(len(vals[x]))
-        target_slice["se"] = se
+        se = self.get_slice_statistics(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only).to_dict(name="se")
+        self.slices[target_slice_name]["se"] = se
         return se
     
     def get_slice_median(self, *, 
@@ -326,16 +679,8 @@ class Dataset():
                        rbias_only: bool = False,
                        fbias_only: bool = False) -> typing.Dict[float, float]:
         target_slice_name = self._slicename_provider(slicename=target_slice_name)
-        target_slice = self.slices[target_slice_name]
-        if hasattr(target_slice, "vals"):
-            vals = target_slice["vals"]
-        else:
-            vals = self.get_vals(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
-
-        median = {}
-        for x, y in vals.items():
-            median[x] = statistics.median(y)
-        target_slice["median"] = median
+        median = self.get_slice_statistics(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only).to_dict(name="median")
+        self.slices[target_slice_name]["median"] = median
         return median
 
     def get_slice_mode(self, *,
@@ -343,16 +688,8 @@ class Dataset():
                        rbias_only: bool = False,
                        fbias_only: bool = False) -> typing.Dict[float, float]:
         target_slice_name = self._slicename_provider(slicename=target_slice_name)
-        target_slice = self.slices[target_slice_name]
-        if hasattr(target_slice, "vals"):
-            vals = target_slice["vals"]
-        else:
-            vals = self.get_vals(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
-
-        mode = {}
-        for x, y in vals.items():
-            mode[x] = statistics.mode(y)
-        target_slice["mode"] = mode
+        mode = self.get_slice_statistics(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only).to_dict(name="mode")
+        self.slices[target_slice_name]["mode"] = mode
         return mode
 
     def export_slice(self, *, 
@@ -367,7 +704,7 @@ class Dataset():
         if filename is None:
             filename = f"{target_slice_name}.json"
         with open(os.path.join(folder, filename), 'w', encoding='utf-8') as file:
-            json.dump(self.slices[target_slice_name], file, indent=4,sort_keys=True)
+            json.dump(self.slices[target_slice_name], file, indent=4,sort_keys=True, default=_json_default)
         return os.path.join(folder, filename)
     
 
@@ -582,6 +919,429 @@ class Dataset():
         return fitted_xy
 
 
+# json.dump(...) only knows dicts and lists, this converts the views of ArrayDataset and NumPy values
+def _json_default(obj: typing.Any) -> typing.Any:
+    if isinstance(obj, collections.abc.Mapping):
+        return dict(obj)
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+'''
+    this class is a read-only view on one IV curve of an ArrayDataset.
+    it behaves like the list of [x, y] pairs of the JSON files (iteration, len, indexing),
+    but the voltages and currents stay NumPy views on the memory-mapped arrays (IVCurve.v, IVCurve.i)
+'''
+class IVCurve(collections.abc.Sequence):
+    __slots__ = ("v", "i")
+
+    def __init__(self, *, v: np.ndarray, i: np.ndarray) -> None:
+        self.v = v
+        self.i = i
+
+    def __len__(self) -> int:
+        return len(self.v)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return IVCurve(v=self.v[n], i=self.i[n])
+        return (float(self.v[n]), float(self.i[n]))
+
+    def __iter__(self):
+        return zip(self.v.tolist(), self.i.tolist())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, IVCurve):
+            other = other.tolist()
+        return self.tolist() == [list(i) for i in other] if isinstance(other, (list, tuple)) else False
+
+    def tolist(self) -> typing.List[typing.List[float]]:
+        return [[x, y] for x, y in self]
+
+    def __repr__(self) -> str:
+        return f"IVCurve({len(self)} points)"
+
+
+# the dict-like compatibility view of one measurement in an ArrayDataset
+class MeasurementView(collections.abc.Mapping):
+    __slots__ = ("dataset", "row")
+
+    def __init__(self, *, dataset: "ArrayDataset", row: int) -> None:
+        self.dataset = dataset
+        self.row = row
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key == "iv_data_rbias":
+            return self.dataset.get_curve(row=self.row, bias="rbias")
+        if key == "iv_data_fbias":
+            return self.dataset.get_curve(row=self.row, bias="fbias")
+        return self.dataset._settings[self.row][key]
+
+    def __iter__(self):
+        yield from self.dataset._settings[self.row]
+        yield from ("iv_data_rbias", "iv_data_fbias")
+
+    def __len__(self) -> int:
+        return len(self.dataset._settings[self.row]) + 2
+
+    def __repr__(self) -> str:
+        return f"MeasurementView({self.dataset._files[self.row]})"
+
+
+# the dict-of-dicts compatibility view of all measurements in an ArrayDataset (ArrayDataset.data)
+class RecordsView(collections.abc.Mapping):
+    def __init__(self, *, dataset: "ArrayDataset") -> None:
+        self.dataset = dataset
+
+    def __getitem__(self, filename: str) -> MeasurementView:
+        return MeasurementView(dataset=self.dataset, row=self.dataset._row_of[filename])
+
+    def __iter__(self):
+        return iter(self.dataset._row_of)
+
+    def __len__(self) -> int:
+        return len(self.dataset._row_of)
+
+
+'''
+    a data slice that only holds the row numbers of its measurements instead of copies of them.
+    SliceView.rows is the index array, iterating the slice gives the filenames like the dict slices of Dataset.
+    Results that are stored in the slice (e.g. slice["mean"]) are kept apart from the measurements,
+    so they do not show up when iterating over the slice.
+'''
+class SliceView(collections.abc.MutableMapping):
+    def __init__(self, *, 
+                 data: typing.Mapping[str, typing.Any], 
+                 files: typing.Sequence[str], 
+                 row_of: typing.Mapping[str, int], 
+                 rows: typing.Any) -> None:
+        self.data = data        # all measurements of the dataset
+        self.files = files      # filename of every row
+        self.row_of = row_of    # row of every filename
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.results: typing.Dict[str, typing.Any] = {}
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key in self.results:
+            return self.results[key]
+        if key in self.row_of and self.row_of[key] in self.rows:
+            return self.data[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: typing.Any) -> None:
+        self.results[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self.results:
+            del self.results[key]
+        elif key in self.row_of:
+            self.rows = self.rows[self.rows != self.row_of[key]]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        files = self.files
+        return (files[row] for row in self.rows.tolist())
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __repr__(self) -> str:
+        return f"SliceView({len(self.rows)} measurements)"
+
+
+
+'''
+    this class holds hash and sorted indexes over the measurements of a Dataset, so filters do not have to scan all measurements.
+    every measurement has a row number, filters return sorted NumPy arrays of row numbers.
+    the indexes of a key are built on its first use, Dataset.build_index(...) builds them up front.
+        hash index      value -> rows, used for filters with a value
+        sorted index    all numeric values sorted, used for filters with a range
+'''
+class DatasetIndex():
+    # the keys that are filtered most often, built by Dataset.build_index()
+    INDEXED_KEYS = ("identifier", "diode_Nr", "die_nr", "subdie_nr", 
+                    "temp_at_start", "temp_at_end", 
+                    "tag_1", "tag_2", "tag_3", "hash")
+
+    def __init__(self, *, 
+                 files: typing.Sequence[str], 
+                 records: typing.Sequence[typing.Mapping[str, typing.Any]], 
+                 rows: typing.Optional[np.ndarray] = None) -> None:
+        self.files = files
+        self.records = records
+        self.rows = np.arange(len(records), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+        self.row_of = {files[row]: row for row in self.rows.tolist()}
+        self.size = len(records)
+        self.hash_index: typing.Dict[str, typing.Dict[typing.Any, np.ndarray]] = {}
+        self.sorted_index: typing.Dict[str, typing.Tuple[np.ndarray, np.ndarray]] = {}
+        self.unhashable: typing.Dict[str, typing.List[typing.Tuple[int, typing.Any]]] = {}     # values like lists that cannot go into a hash index
+
+    def build(self, *, key: str) -> None:
+        groups: typing.Dict[typing.Any, typing.List[int]] = {}
+        unhashable = []
+        numeric_values = []
+        numeric_rows = []
+        for row, record in zip(self.rows.tolist(), self.records):
+            if key not in record:
+                continue
+            value = record[key]
+            try:
+                groups.setdefault(value, []).append(row)
+            except TypeError:
+                unhashable.append((row, value))
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                numeric_values.append(value)
+                numeric_rows.append(row)
+        self.hash_index[key] = {value: np.array(group, dtype=np.int64) for value, group in groups.items()}
+        self.unhashable[key] = unhashable
+        order = np.argsort(np.array(numeric_values, dtype=np.float64), kind="stable")
+        self.sorted_index[key] = (np.array(numeric_values, dtype=np.float64)[order], np.array(numeric_rows, dtype=np.int64)[order])
+
+    def equal(self, *, key: str, value: typing.Any) -> np.ndarray:
+        if key not in self.hash_index:
+            self.build(key=key)
+        try:
+            matches = self.hash_index[key].get(value, np.zeros(0, dtype=np.int64))
+        except TypeError:
+            matches = np.zeros(0, dtype=np.int64)
+        if self.unhashable[key]:
+            extra = [row for row, i in self.unhashable[key] if i == value]
+            matches = np.union1d(matches, np.array(extra, dtype=np.int64))
+        return matches
+
+    # the sorted index only holds numbers, other ranges (e.g. of time_at_start strings) compare every distinct value
+    def between(self, *, key: str, min_val: typing.Any, max_val: typing.Any) -> np.ndarray:
+        if key not in self.sorted_index:
+            self.build(key=key)
+        if not all(isinstance(i, (int, float)) and not isinstance(i, bool) for i in (min_val, max_val)):
+            matches = [np.zeros(0, dtype=np.int64)]
+            candidates = list(self.hash_index[key].items())
+            candidates += [(value, np.array([row], dtype=np.int64)) for row, value in self.unhashable[key]]
+            for value, group in candidates:
+                try:
+                    if min_val <= value <= max_val:
+                        matches.append(group)
+                except TypeError:
+                    continue
+            return np.sort(np.concatenate(matches))
+        values, rows = self.sorted_index[key]
+        start = np.searchsorted(values, min_val, side="left")
+        stop = np.searchsorted(values, max_val, side="right")
+        return np.sort(rows[start:stop])
+
+    # roughly how many rows a condition of Dataset.query(...) will return
+    def estimate(self, *, key: str, condition: typing.Any) -> int:
+        if isinstance(condition, list) and len(condition) == 2:
+            return len(self.between(key=key, min_val=condition[0], max_val=condition[1]))
+        if isinstance(condition, (tuple, set, frozenset)):
+            return sum(len(self.equal(key=key, value=i)) for i in condition)
+        return len(self.equal(key=key, value=condition))
+
+
+'''
+    this class is an alternative backend for Dataset that is loaded from columnar stores (see custom_filehandler.ColumnarStore).
+    All IV curves stay in the memory-mapped float64 arrays of the stores, every measurement is only an offset and a length into them.
+    Dataset.get(...), Dataset.filter(...) and Dataset.get_vals(...) work on index arrays and views, nothing is copied.
+    ArrayDataset.data and the slices can still be used like the dicts of Dataset.
+'''
+class ArrayDataset(Dataset):
+
+    def __init__(self, *, description: typing.Optional[str] = None) -> None:
+        super().__init__(description=description)
+        self._files: typing.List[str] = []                      # filename of every row
+        self._settings: typing.List[typing.Dict[str, typing.Any]] = []     # settings dict of every row
+        self._row_of: typing.Dict[str, int] = {}                # filename -> row, a measurement that is stored twice uses the latest row
+        self._segments: typing.List[typing.Dict[str, np.ndarray]] = []     # the memory-mapped arrays of every store
+        self._index: typing.Dict[str, np.ndarray] = {name: np.zeros(0, dtype=np.int64) for name in 
+                                                     ("segment", "rbias_offset", "rbias_len", "fbias_offset", "fbias_len")}
+        self._valid: typing.Dict[str, np.ndarray] = {"rbias": np.zeros(0, dtype=bool), "fbias": np.zeros(0, dtype=bool)}
+        self.data = RecordsView(dataset=self)   # type: ignore
+
+    # the run folder of a measurement file is the first parent with a settings dump or a columnar store
+    @staticmethod
+    def _run_folder_of(*, filepath: str) -> typing.Optional[str]:
+        folder = os.path.dirname(filepath)
+        while folder and folder != os.path.dirname(folder):
+            if (os.path.isfile(os.path.join(folder, "settings_dump.json")) or 
+                    cfile.ColumnarStore(folder=folder).exists()):
+                return folder
+            folder = os.path.dirname(folder)
+        return None
+
+    '''
+    ArrayDataset only holds columnar stores, so add_files(...) loads the stores of the runs the files belong to.
+    Runs without a store are converted once with custom_filehandler.build_store_from_json(...).
+    Only the given files become part of the dataset, the other measurements of the stores are skipped.
+    Only IV measurements are stored in a columnar store, other JSON files are skipped even if only_measurements is False.
+    It returns the number of stores that had to be built.
+    '''
+    def add_files(self, *, files: typing.List[typing.Any] = [], only_measurements: bool = True) -> int:
+        wanted: typing.Dict[str, typing.Set[str]] = {}
+        for i in files:
+            if not os.path.isfile(i):
+                print(f"Error loading files: File {i} does not exist.")
+                continue
+            if not (i.endswith(".json") and os.path.basename(i).startswith("IV_")):
+                if not only_measurements:
+                    print(f"Warning: {i} is not an IV measurement, ArrayDataset skips it.")
+                continue
+            folder = self._run_folder_of(filepath=i)
+            if folder is None:
+                print(f"Error loading files: no run folder found for {i}")
+                continue
+            wanted.setdefault(folder, set()).add(os.path.normpath(i))
+        built = 0
+        for folder, wanted_files in wanted.items():
+            if not cfile.ColumnarStore(folder=folder).exists():
+                cfile.build_store_from_json(folder=folder)
+                built += 1
+            self.add_store(folder=folder, files=wanted_files)
+        return built
+
+    # same as ArrayDataset.add_files(...), with the statistics of Dataset.load_files(...)
+    # processes and cache_folder are accepted for compatibility, the stores need neither of them
+    def load_files(self, *, 
+                   files: typing.List[typing.Any] = [], 
+                   only_measurements: bool = True, 
+                   processes: typing.Optional[int] = None, 
+                   cache_folder: typing.Optional[str] = ".analyzer_cache", 
+                   verbose: bool = True) -> typing.Dict[str, float]:
+        start = time.time()
+        count = len(self._row_of)
+        built = self.add_files(files=files, only_measurements=only_measurements)
+        count = len(self._row_of) - count
+        elapsed = max(time.time() - start, 1e-9)
+        size = sum(os.path.getsize(i) for i in files if os.path.isfile(i))
+        report = {"files": count,
+                  "cached": count if built == 0 else 0,
+                  "parsed": count if built > 0 else 0,
+                  "seconds": elapsed,
+                  "files_per_s": count / elapsed,
+                  "MB_per_s": size / 1e6 / elapsed,
+                  "parsed_MB": size / 1e6 if built > 0 else 0.0}
+        if verbose:
+            print(f"Loaded {report['files']} files from columnar stores ({built} stores built) "
+                  f"in {elapsed:.2f}s: {report['files_per_s']:.0f} files/s, {report['MB_per_s']:.1f} MB/s")
+        return report
+
+    # files limits the measurements taken from the store to these JSON paths, None takes all of them
+    def add_store(self, *, folder: str, files: typing.Optional[typing.Set[str]] = None) -> int:
+        content = cfile.ColumnarStore(folder=folder).load(mmap=True)
+        self._query_index = None
+        first_row = len(self._files)
+        segment = len(self._segments)
+        self._segments.append({name: content[name] for name in cfile.ColumnarStore.ARRAYS})
+        self._files.extend(content["files"])
+        self._settings.extend(content["settings"])
+        count = 0
+        for n, filename in enumerate(content["files"]):
+            if files is None or os.path.normpath(filename) in files:
+                self._row_of[filename] = first_row + n
+                count += 1
+        self._index["segment"] = np.concatenate((self._index["segment"], np.full(len(content["files"]), segment, dtype=np.int64)))
+        for bias in ("rbias", "fbias"):
+            for name in (f"{bias}_offset", f"{bias}_len"):
+                self._index[name] = np.concatenate((self._index[name], content[name]))
+            self._valid[bias] = np.concatenate((self._valid[bias], content[f"{bias}_valid"]))
+        return count
+
+    # rows of all measurements that are not replaced by a later measurement with the same filename
+    def _active_rows(self) -> np.ndarray:
+        return np.fromiter(self._row_of.values(), dtype=np.int64, count=len(self._row_of))
+
+    # returns the IV curve of one row as views on the memory-mapped arrays, or None if the sweep did not return data
+    def get_curve(self, *, row: int, bias: str = "rbias") -> typing.Optional[IVCurve]:
+        if not self._valid[bias][row]:
+            return None
+        segment = self._segments[self._index["segment"][row]]
+        start = self._index[f"{bias}_offset"][row]
+        stop = start + self._index[f"{bias}_len"][row]
+        return IVCurve(v=segment[f"{bias}_v"][start:stop], i=segment[f"{bias}_i"][start:stop])
+
+    # returns the values of one key for the given rows as a NumPy array, missing keys are None
+    def get_column(self, *, key: str, rows: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        if rows is None:
+            rows = self._active_rows()
+        return np.array([self._settings[row].get(key) for row in rows.tolist()])
+
+    def get(self, *, key : str, pretty : bool = False) -> typing.List[typing.Tuple[str, typing.Any]]:
+        if key in ("iv_data_rbias", "iv_data_fbias"):
+            return super().get(key=key, pretty=pretty)
+        output: typing.List[typing.Any] = []
+        for row in self._active_rows().tolist():
+            if str(key) in self._settings[row]:
+                value = self._settings[row][str(key)]
+                output.append((self._files[row], value) if pretty else value)
+            else:
+                print(f"Warning: '{key}' not found in {self._files[row]}")
+        return output
+
+    def _get_index(self) -> DatasetIndex:
+        if self._query_index is None or self._query_index.size != len(self._row_of):
+            rows = self._active_rows()
+            self._query_index = DatasetIndex(files=self._files, records=[self._settings[row] for row in rows.tolist()], rows=rows)
+        return self._query_index
+
+    def _make_slice(self, *, rows: np.ndarray) -> SliceView:
+        return self._slice_view(rows=rows)
+
+    def _slice_view(self, *, rows: np.ndarray) -> SliceView:
+        return SliceView(data=self.data, files=self._files, row_of=self._row_of, rows=rows)
+
+    # returns the IV curves of a data slice as views, fbias curves first (the order of Dataset.get_vals)
+    def get_curves(self, *, 
+                   target_slice_name: typing.Optional[str] = None, 
+                   rbias_only: bool = False, 
+                   fbias_only: bool = False) -> typing.List[IVCurve]:
+        target_slice_name = self._slicename_provider(slicename=target_slice_name)
+        if rbias_only and fbias_only:
+            raise ValueError("You can only specify either 'rbias_only' or 'fbias_only', not both.")
+        rows = self._slice_rows(target_slice_name=target_slice_name).tolist()
+        curves = []
+        biases = []
+        if not rbias_only:
+            biases.append("fbias")
+        if not fbias_only:
+            biases.append("rbias")
+        for bias in biases:
+            for row in rows:
+                curve = self.get_curve(row=row, bias=bias)
+                if curve is not None:
+                    curves.append(curve)
+        return curves
+
+    def _slice_xy(self, *, 
+                  target_slice_name: str, 
+                  rbias_only: bool = False, 
+                  fbias_only: bool = False) -> typing.Tuple[np.ndarray, np.ndarray]:
+        curves = self.get_curves(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
+        if not curves:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate([curve.v for curve in curves]), np.concatenate([curve.i for curve in curves])
+
+    def get_vals(self, *, 
+                 target_slice_name: typing.Optional[str] = None, 
+                 rbias_only: bool = False, 
+                 fbias_only: bool = False) -> typing.Dict[float, typing.List[float]]:
+        target_slice_name = self._slicename_provider(slicename=target_slice_name)
+        curves = self.get_curves(target_slice_name=target_slice_name, rbias_only=rbias_only, fbias_only=fbias_only)
+        vals: typing.Dict[float, typing.List[float]] = {}
+        if curves:
+            x = np.concatenate([curve.v for curve in curves])
+            y = np.concatenate([curve.i for curve in curves])
+            # group the currents by voltage, the voltages keep the order in which they appear first (like Dataset.get_vals)
+            unique_x, first, inverse = np.unique(x, return_index=True, return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            groups = np.split(y[order], np.cumsum(np.bincount(inverse, minlength=len(unique_x)))[:-1])
+            for n in np.argsort(first).tolist():
+                vals[float(unique_x[n])] = groups[n].tolist()
+        self.slices[target_slice_name]["vals"] = vals
+        return vals
+
+
 
 def get_all_filenames(*, startdir: str) -> typing.List[str]:
     f = []
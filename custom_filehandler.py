@@ -15,6 +15,14 @@
 import time
 import os
 import json
+import typing
+import types
+import collections.abc
+import queue
+import threading
+import atexit
+import hashlib
+import numpy as np
 import custom_pathlibrary
 
 class bcolors:
@@ -22,7 +30,201 @@ class bcolors:
     ENDC = '\033[0m'
 
 
-#TODO: check if config file is valid
+'''
+    schema of the config file of a run (a task of task_list/): name -> SettingSpec.
+    types are the allowed JSON types (int is also accepted for float), a callable default is computed from the other settings.
+    reloadable settings are only used by measure() and can be changed during a run with "reload_settings": true,
+    all others are fixed at the start of the run.
+'''
+class SettingSpec(typing.NamedTuple):
+    types: typing.Tuple[type, ...]
+    default: typing.Any
+    choices: typing.Optional[typing.Tuple[typing.Any, ...]] = None
+    minimum: typing.Optional[float] = None
+    reloadable: bool = False
+
+
+_NUMBER = (int, float)
+_OPTIONAL_NUMBER = (int, float, type(None))
+
+SETTINGS_SCHEMA: typing.Dict[str, SettingSpec] = {
+    # connection
+    "waferprober_ip":           SettingSpec((str,), "192.168.255.1"),       # IP address of the wafer prober
+    "waferprober_port":         SettingSpec((int,), 1412, minimum=1),       # port of the Velox Message Server, only changed for the simulator
+    "device_port":              SettingSpec((str,), "/dev/ttyUSB0"),
+    "keithley_transfer":        SettingSpec((str,), "ascii", choices=("ascii", "binary")),
+    # run
+    "chuck_target_temperature": SettingSpec(_NUMBER, 25),                   # degrees Celsius, 25 for room temperature
+    "force_temperature":        SettingSpec((bool,), True),
+    "temperature_tolerance":    SettingSpec(_NUMBER, 0.1, minimum=0),       # K, the chuck temperature has settled when it stays within this tolerance
+    "temperature_max_slope":    SettingSpec(_NUMBER, 0.1, minimum=0),       # K/min, ... does not drift more than this
+    "temperature_hold_time":    SettingSpec(_NUMBER, 30, minimum=0),        # s, ... for this time
+    "extra":                    SettingSpec((str,), ""),
+    "measurements_per_diode":   SettingSpec((int,), 1, minimum=1),
+    "movement_time":            SettingSpec(_NUMBER, 0, minimum=0),
+    "plotting":                 SettingSpec((bool,), False),
+    "only_single_subdie":       SettingSpec((bool,), False),
+    "start_first_die":          SettingSpec((bool,), True),
+    "optimize_path":            SettingSpec((bool,), False),                # visit the pads in the order with the shortest travel
+    "path_keep_waypoints":      SettingSpec((bool,), True),                 # False: the optimized path also skips the waypoints between the pad groups
+    "wafer_plan":               SettingSpec((str,), "", choices=("", "map", "serpentine", "shortest")),    # "": StepNextDie in the order of the prober (see cpath.WaferPlan)
+    "wafer_plan_group":         SettingSpec((str, type(None)), "die", choices=(None, "die", "wafer")),    # group the subdies by their diode configuration
+    "contact_check":            SettingSpec((bool,), False),                # short sweep up to contact_check_voltage before every diode
+    "contact_check_voltage":    SettingSpec(_NUMBER, 5.0),
+    "contact_threshold":        SettingSpec(_NUMBER, 5e-12, minimum=0),     # A, currents up to this value are noise
+    "contact_retries":          SettingSpec((int,), 2, minimum=0),          # the probe is lifted and lowered again this often without contact
+    "max_contact_failures":     SettingSpec((int,), 8, minimum=1),          # diodes in a row without contact until a warning is sent
+    "reload_settings":          SettingSpec((bool,), False),                # reload the reloadable settings from the file after every subdie
+    # task list (custom_scheduler.py)
+    "priority":                 SettingSpec((int,), 0),
+    "after":                    SettingSpec((str, list), []),
+    # measurement (measure())
+    "tag_1":                    SettingSpec((str,), "", reloadable=True),
+    "tag_2":                    SettingSpec((str,), "", reloadable=True),
+    "tag_3":                    SettingSpec((str,), "", reloadable=True),
+    "start_rbias":              SettingSpec(_NUMBER, 0.0, reloadable=True),
+    "stop_rbias":               SettingSpec(_NUMBER, 50, reloadable=True),
+    "step_rbias":               SettingSpec(_NUMBER, 0.1, minimum=1e-6, reloadable=True),
+    "delay_rbias":              SettingSpec(_NUMBER, 1, minimum=0, reloadable=True),
+    "start_fbias":              SettingSpec(_NUMBER, 0.0, reloadable=True),
+    "stop_fbias":               SettingSpec(_NUMBER, -2.5, reloadable=True),
+    "step_fbias":               SettingSpec(_NUMBER, 0.2, minimum=1e-6, reloadable=True),
+    "delay_fbias":              SettingSpec(_NUMBER, 1, minimum=0, reloadable=True),
+    "sweep_mode":               SettingSpec((str,), "fixed", choices=("fixed", "adaptive"), reloadable=True),  # "adaptive": coarse sweep, refined where the current changes fast
+    "coarse_step_rbias":        SettingSpec(_NUMBER, lambda values: 10 * values["step_rbias"], minimum=1e-6, reloadable=True),
+    "coarse_step_fbias":        SettingSpec(_NUMBER, lambda values: 5 * values["step_fbias"], minimum=1e-6, reloadable=True),
+    "threshold_rbias":          SettingSpec(_OPTIONAL_NUMBER, 1e-6, reloadable=True),     # A, the adaptive sweep stops at this current
+    "threshold_fbias":          SettingSpec(_OPTIONAL_NUMBER, None, reloadable=True),     # None: only at the current limit
+    "refine_decades":           SettingSpec(_NUMBER, 0.3, minimum=0, reloadable=True),
+    "early_abort_points":       SettingSpec((int,), 0, minimum=0, reloadable=True),       # the sweep stops if its first points are only noise (0: never)
+}
+
+
+class RunSettingsError(ValueError):
+    pass
+
+
+def _check_setting(name: str, value: typing.Any, spec: SettingSpec) -> typing.Optional[str]:
+    # bool is an int in python, but true is no number of points
+    if not isinstance(value, spec.types) or (isinstance(value, bool) and bool not in spec.types):
+        return f"{name}: {value!r} is not of type {' or '.join('null' if t is type(None) else t.__name__ for t in spec.types)}"
+    if spec.choices is not None and value not in spec.choices:
+        return f"{name}: {value!r} is not one of {list(spec.choices)}"
+    if spec.minimum is not None and value is not None and value < spec.minimum:
+        return f"{name}: {value!r} is smaller than {spec.minimum}"
+    return None
+
+
+'''
+    this class holds the validated settings of a run, built once in main() and passed down instead of the config file.
+    Every setting of SETTINGS_SCHEMA is there (missing ones get their default): run_settings.step_rbias or run_settings["step_rbias"].
+    The object can not be changed, reload() returns a new one. Keys that are not in the schema are kept and listed in unknown.
+'''
+class RunSettings(collections.abc.Mapping):
+
+    def __init__(self, *, values: typing.Mapping[str, typing.Any], filepath: typing.Optional[str] = None,
+                 mtime: typing.Optional[float] = None, unknown: typing.Iterable[str] = ()) -> None:
+        object.__setattr__(self, "_values", types.MappingProxyType(dict(values)))
+        object.__setattr__(self, "filepath", filepath)
+        object.__setattr__(self, "mtime", mtime)
+        object.__setattr__(self, "unknown", tuple(unknown))
+
+    @classmethod
+    def from_dict(cls, data: typing.Mapping[str, typing.Any], *, filepath: typing.Optional[str] = None,
+                  mtime: typing.Optional[float] = None) -> "RunSettings":
+        """
+        This method validates data against SETTINGS_SCHEMA and fills in the defaults.
+        Raises RunSettingsError with all invalid settings.
+        """
+        if not isinstance(data, dict):
+            raise RunSettingsError(f"the config file has to contain a JSON object, not {type(data).__name__}")
+        values, errors = {}, []
+        for name, spec in SETTINGS_SCHEMA.items():
+            if name in data:
+                error = _check_setting(name, data[name], spec)
+                if error is not None:
+                    errors.append(error)
+                values[name] = data[name]
+        for name, spec in SETTINGS_SCHEMA.items():
+            if name not in values:
+                values[name] = spec.default(values) if callable(spec.default) else spec.default
+        if errors:
+            raise RunSettingsError(f"invalid settings in {filepath or 'config'}: " + "; ".join(errors))
+        unknown = [name for name in data if name not in SETTINGS_SCHEMA]
+        values.update({name: data[name] for name in unknown})
+        return cls(values=values, filepath=filepath, mtime=mtime, unknown=unknown)
+
+    @classmethod
+    def from_file(cls, *, filepath: str) -> "RunSettings":
+        """
+        This method reads and validates a config file.
+        Raises OSError if it can not be read and RunSettingsError (a ValueError) if it is no valid config.
+        """
+        mtime = os.stat(filepath).st_mtime_ns
+        with open(filepath, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                raise RunSettingsError(f"error decoding JSON from file {filepath}: {e}") from e
+        return cls.from_dict(data, filepath=filepath, mtime=mtime)
+
+    def __getitem__(self, name: str) -> typing.Any:
+        return self._values[name]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getattr__(self, name: str) -> typing.Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(f"unknown setting {name!r}") from None
+
+    def __setattr__(self, name: str, value: typing.Any) -> None:
+        raise AttributeError("RunSettings can not be changed, use reload()")
+
+    def __repr__(self) -> str:
+        return f"RunSettings({self.filepath!r}, {dict(self._values)})"
+
+    def hash(self) -> str:
+        return settings_hash(data=dict(self._values))
+
+    def changed(self) -> bool:
+        try:
+            return self.filepath is not None and os.stat(self.filepath).st_mtime_ns != self.mtime
+        except OSError:
+            return False
+
+    def reload(self, *, logger) -> "RunSettings":
+        """
+        This method reads the config file again if it was changed (one os.stat if not).
+        Returns new settings with the changed reloadable settings, the other changes are only logged.
+        An invalid file keeps the current settings.
+        """
+        if not self.changed():
+            return self
+        try:
+            new = RunSettings.from_file(filepath=self.filepath)
+        except (OSError, ValueError) as e:
+            logger.error(f"Keeping the current settings: {e}")
+            try:
+                mtime = os.stat(self.filepath).st_mtime_ns     # the invalid file is only reported once
+            except OSError:
+                mtime = self.mtime
+            return RunSettings(values=self._values, filepath=self.filepath, mtime=mtime, unknown=self.unknown)
+        changed = [name for name in new if new[name] != self.get(name)]
+        fixed = [name for name in changed if name not in SETTINGS_SCHEMA or not SETTINGS_SCHEMA[name].reloadable]
+        values = dict(self._values)
+        values.update({name: new[name] for name in changed if name not in fixed})
+        if fixed:
+            logger.warning(f"{', '.join(fixed)} changed in {self.filepath}, but can only be changed for the next run.")
+        if len(changed) > len(fixed):
+            logger.info(f"Reloaded settings from {self.filepath}: " + ", ".join(f"{name}={values[name]!r}" for name in changed if name not in fixed))
+        return RunSettings(values=values, filepath=self.filepath, mtime=new.mtime, unknown=self.unknown)
+
 
 def create_folder(*, path="", base_folder_name="Wafer", no_time=False, temperature=None):
     if not os.path.isdir(base_folder_name):
@@ -37,7 +239,8 @@ def create_folder(*, path="", base_folder_name="Wafer", no_time=False, temperatu
         print(f"{bcolors.HEADER}Folder {base_folder_name} already exists.{bcolors.ENDC}")
         return
 
-def save_IV(*, msgServer, store_data, iv_data_rbias, iv_data_fbias, folder, diode_Nr, logger, measurement_no=-1):
+# returns the path of the measurement file relative to folder
+def save_IV(*, msgServer, store_data, iv_data_rbias, iv_data_fbias, folder, diode_Nr, logger, measurement_no=-1, columnar=True, writer=None):
     store_data.add(name="diode_Nr", value=diode_Nr)
     if folder is None:
         logger.critical(f"Error:folder path is None. cannot save rsults.")
@@ -58,7 +261,7 @@ def save_IV(*, msgServer, store_data, iv_data_rbias, iv_data_fbias, folder, diod
 
     plib = custom_pathlibrary.PLib()
     a_DIODES = plib.get_diode_count(msgServer=msgServer, subdie_Nr=subdie_NR, logger=logger)
-    identifier, guardring_value, entrance_window =plib.get_identifier(msgServer=msgServer, logger=logger)
+    identifier, guardring_value, entrance_window =plib.get_identifier(msgServer=msgServer, subdie_Nr=subdie_NR, logger=logger)
     store_data.add(name="a_diodes", value=a_DIODES)
     store_data.add(name="identifier", value=identifier)
     store_data.add(name="guardring_value", value=guardring_value)
@@ -66,6 +269,17 @@ def save_IV(*, msgServer, store_data, iv_data_rbias, iv_data_fbias, folder, diod
     filename = f"IV_Die_{die_NR}_Subdie_{subdie_NR}_Diode_{diode_Nr}_measurement_{measurement_no}"
     filepath= f"{folder}/Die_{die_NR}/Subdie_{subdie_NR}_ADiodes_{a_DIODES}"
     filepath_with_filename = os.path.join(filepath, filename)
+
+    # with a BackgroundWriter, the file I/O is done off the measurement thread
+    if writer is not None:
+        store_data.add(name="iv_data_rbias", value=iv_data_rbias)
+        store_data.add(name="iv_data_fbias", value=iv_data_fbias)
+        store_data.chash()
+        writer.submit(record=dict(store_data.settings), folder=folder, 
+                      relative_path=f"Die_{die_NR}/Subdie_{subdie_NR}_ADiodes_{a_DIODES}/{filename}.json", 
+                      columnar=columnar)
+        logger.file(f"IV results queued for {filepath_with_filename}")
+        return f"Die_{die_NR}/Subdie_{subdie_NR}_ADiodes_{a_DIODES}/{filename}.json"
     logger.file(f"Saving IV results to {filepath_with_filename}")
 
     if not os.path.isdir(filepath):
@@ -77,6 +291,16 @@ def save_IV(*, msgServer, store_data, iv_data_rbias, iv_data_fbias, folder, diod
     store_data.save_for_data(folder=filepath, filename=filename)
     logger.file(f"IV results saved to {filepath_with_filename}")
 
+    # the columnar store of the run gets the same record, so the Dataset can load the whole run with one read
+    if columnar:
+        try:
+            store = ColumnarStore(folder=folder)
+            store.append(record=store_data.settings, file=f"Die_{die_NR}/Subdie_{subdie_NR}_ADiodes_{a_DIODES}/{filename}.json")
+            logger.file(f"IV results appended to columnar store {store.path}")
+        except Exception as e:
+            logger.error(f"Error appending IV results to columnar store: {e}")
+    return f"Die_{die_NR}/Subdie_{subdie_NR}_ADiodes_{a_DIODES}/{filename}.json"
+
 
 
 class save_to_json():
@@ -94,7 +318,7 @@ class save_to_json():
                             "diode_nr", "entrance_window", "guardring_value", 
                             "identifier", "iv_data_fbias", "iv_data_rbias", "row", 
                             "subdie_nr", "x_pos", "y_pos", "hash", "time_at_start", 
-                            "time_at_end", "time_elapsed"]
+                            "time_at_end", "time_elapsed", "aborted"]
         hashable_keys = set(self.settings.keys()) - set(nonhashable_keys)
         #print(f"Hashable keys: {hashable_keys}")
         for key in hashable_keys:
@@ -126,6 +350,305 @@ class save_to_json():
 
 
 
+'''
+    this class stores all IV measurements of one run in a few column files instead of one JSON file per diode.
+    The store lives in <run folder>/columnar/ and consists of:
+        meta.jsonl      one line per measurement with all settings and the position of its IV curves in the array files
+        rbias_v.f64     reverse bias voltages of all measurements, raw float64
+        rbias_i.f64     reverse bias currents of all measurements, raw float64
+        fbias_v.f64     forward bias voltages
+        fbias_i.f64     forward bias currents
+    The array files are written before the meta line, so a crash during append() leaves at most some unreferenced
+    values at the end of the array files, which are ignored when loading. The voltages and currents of one bias share
+    one offset: append() cuts both files to the shorter one first, so values that were left over in only one of them
+    can not shift the next curves.
+'''
+class ColumnarStore():
+    STORE_FOLDER = "columnar"
+    META_FILE = "meta.jsonl"
+    ARRAYS = ("rbias_v", "rbias_i", "fbias_v", "fbias_i")
+    # these keys are available as NumPy columns after ColumnarStore.load()
+    METADATA_COLUMNS = ("die_nr", "subdie_nr", "diode_Nr", "identifier", 
+                        "temp_at_start", "temp_at_end", "hash", 
+                        "tag_1", "tag_2", "tag_3")
+    # these keys are not stored in the meta line, because they end up in the array files
+    IV_KEYS = ("iv_data_rbias", "iv_data_fbias")
+
+    def __init__(self, *, folder: str) -> None:
+        if folder.endswith("/"):
+            folder = folder[0:-1]
+        self.folder = folder    # the run folder, e.g. data/Wafer_at_2025_06_16-18_35_06
+        self.path = os.path.join(folder, self.STORE_FOLDER)
+
+    def exists(self) -> bool:
+        return os.path.isfile(os.path.join(self.path, self.META_FILE))
+
+    # appends one measurement record (the settings dict of save_to_json) to the store
+    # file is the path of the corresponding JSON file, relative to the run folder
+    def append(self, *, record: typing.Dict[str, typing.Any], file: str = "", fsync: bool = False) -> None:
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        line = {"file": file, "settings": {k: v for k, v in record.items() if k not in self.IV_KEYS}}
+        for bias in ("rbias", "fbias"):
+            iv_data = record.get(f"iv_data_{bias}")
+            iv_array = np.asarray(iv_data if iv_data else [], dtype=np.float64).reshape(-1, 2)
+            paths = [os.path.join(self.path, f"{name}.f64") for name in (f"{bias}_v", f"{bias}_i")]
+            offset = min(os.path.getsize(path) if os.path.isfile(path) else 0 for path in paths) // 8
+            for column, path in enumerate(paths):
+                with open(path, mode="ab") as array_file:
+                    if array_file.tell() != offset * 8:
+                        array_file.truncate(offset * 8)     # unreferenced values of an interrupted append()
+                    np.ascontiguousarray(iv_array[:, column]).astype("<f8").tofile(array_file)
+                    if fsync:
+                        array_file.flush()
+                        os.fsync(array_file.fileno())
+            line[bias] = [offset, len(iv_array), iv_data is not None]
+        with open(os.path.join(self.path, self.META_FILE), mode="a", encoding="utf-8") as meta_file:
+            meta_file.write(json.dumps(line, sort_keys=True) + "\n")
+            if fsync:
+                meta_file.flush()
+                os.fsync(meta_file.fileno())
+
+    '''
+    this function reads the whole store at once.
+    it returns a dict with:
+        "files"         the JSON paths (joined with the run folder) of all measurements
+        "settings"      a list with the settings dict of every measurement
+        "columns"       the METADATA_COLUMNS as NumPy arrays
+        "rbias_v", ...  the ARRAYS, memory-mapped when mmap is True
+        "rbias_offset", "rbias_len", "fbias_offset", "fbias_len"    int64 arrays to index the ARRAYS per measurement
+        "rbias_valid", "fbias_valid"    False where the measurement returned None instead of a curve
+    '''
+    def load(self, *, mmap: bool = False) -> typing.Dict[str, typing.Any]:
+        if not self.exists():
+            raise FileNotFoundError(f"No columnar store found in {self.folder}")
+        lines = []
+        with open(os.path.join(self.path, self.META_FILE), mode="r", encoding="utf-8") as meta_file:
+            for line in meta_file:
+                try:
+                    lines.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Warning: skipping incomplete line in {self.path}/{self.META_FILE}")
+        output: typing.Dict[str, typing.Any] = {
+            "files": [f"{self.folder}/{line['file']}" for line in lines],
+            "settings": [line["settings"] for line in lines],
+        }
+        output["columns"] = {key: np.array([s.get(key) for s in output["settings"]]) for key in self.METADATA_COLUMNS}
+        for bias in ("rbias", "fbias"):
+            index = np.array([line[bias] for line in lines], dtype=np.int64).reshape(-1, 3)
+            output[f"{bias}_offset"] = index[:, 0]
+            output[f"{bias}_len"] = index[:, 1]
+            output[f"{bias}_valid"] = index[:, 2].astype(bool)
+        for name in self.ARRAYS:
+            array_path = os.path.join(self.path, f"{name}.f64")
+            if not os.path.isfile(array_path) or os.path.getsize(array_path) == 0:
+                output[name] = np.zeros(0, dtype=np.float64)
+            elif mmap:
+                output[name] = np.memmap(array_path, dtype="<f8", mode="r")
+            else:
+                output[name] = np.fromfile(array_path, dtype="<f8")
+        return output
+
+
+# This func converts all IV JSON files of an already finished run into a columnar store
+# existing stores are only rebuilt if overwrite is True
+def build_store_from_json(*, folder: str, overwrite: bool = False) -> typing.Optional[ColumnarStore]:
+    store = ColumnarStore(folder=folder)
+    if store.exists():
+        if not overwrite:
+            print(f"Columnar store in {store.folder} already exists.")
+            return store
+        for name in [store.META_FILE] + [f"{i}.f64" for i in store.ARRAYS]:
+            if os.path.isfile(os.path.join(store.path, name)):
+                os.remove(os.path.join(store.path, name))
+    files = sorted(i for i in get_all_filenames_in_folder(startdir=store.folder, file_extension=".json") 
+                   if os.path.basename(i).startswith("IV_") and f"/{store.STORE_FOLDER}/" not in i)
+    for i in files:
+        data = load_json_file(filepath=i)
+        if data is None:
+            continue
+        store.append(record=data, file=os.path.relpath(i, store.folder).replace(os.sep, "/"))
+    print(f"{bcolors.HEADER}Built columnar store with {len(files)} measurements in {store.path}{bcolors.ENDC}")
+    return store
+
+
+# This func outputs a List of all run folders with a columnar store in a given directory and its subdirectories
+def get_all_store_folders(*, startdir: str) -> typing.List[str]:
+    f = []
+    if startdir.endswith("/"):
+        startdir = startdir[0:-1]
+    for (dirpath, dirnames, filenames) in os.walk(startdir):
+        if os.path.basename(dirpath) == ColumnarStore.STORE_FOLDER and ColumnarStore.META_FILE in filenames:
+            f.append(os.path.dirname(dirpath))
+    return sorted(f)
+
+# writes a JSON file crash-safe: the content goes to a temporary file first, which replaces the target in one step
+def write_json_atomic(*, filepath: str, content: typing.Any, fsync: bool = True) -> None:
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, mode="w", encoding="utf-8") as write_file:
+        json.dump(content, write_file, sort_keys=True, indent=4)
+        if fsync:
+            write_file.flush()
+            os.fsync(write_file.fileno())
+    os.replace(tmp_path, filepath)
+
+
+'''
+    this class writes finished measurement records in a background thread, 
+    so serialization, folder creation and fsync do not add to the cycle time of a diode.
+    - the queue is bounded (max_queue), submit() blocks when the disk cannot keep up instead of filling the memory
+    - JSON files are written to a temporary file and renamed, a crash never leaves a half written measurement
+    - flush() waits until everything is on disk, close() also stops the thread.
+      close() is called automatically when the interpreter exits.
+    The records have to be complete when they are submitted, the writer never talks to the waferprober.
+'''
+class BackgroundWriter():
+
+    def __init__(self, *, logger, max_queue: int = 64, fsync: bool = True) -> None:
+        self.logger = logger
+        self.fsync = fsync
+        self.queue: "queue.Queue[typing.Optional[typing.Dict[str, typing.Any]]]" = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.failed = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="BackgroundWriter", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # queues one measurement record, relative_path is the path of the JSON file relative to the run folder
+    def submit(self, *, record: typing.Dict[str, typing.Any], folder: str, relative_path: str, columnar: bool = True) -> None:
+        if self.closed:
+            raise RuntimeError("BackgroundWriter is already closed.")
+        self.queue.put({"record": record, "folder": folder, "relative_path": relative_path, "columnar": columnar})
+
+    # blocks until all queued records are written
+    def flush(self) -> None:
+        self.queue.join()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.logger.file(f"BackgroundWriter closed: {self.written} records written, {self.failed} failed")
+
+    def _run(self) -> None:
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(job=job)
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                self.logger.critical(f"Error writing IV results to {job['folder']}/{job['relative_path']}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, *, job: typing.Dict[str, typing.Any]) -> None:
+        filepath_with_filename = os.path.join(job["folder"], job["relative_path"])
+        filepath = os.path.dirname(filepath_with_filename)
+        if not os.path.isdir(filepath):
+            os.makedirs(filepath, exist_ok=True)
+            self.logger.file(f"Created folder: {filepath}")
+        write_json_atomic(filepath=filepath_with_filename, content=job["record"], fsync=self.fsync)
+        self.logger.file(f"IV results saved to {filepath_with_filename}")
+        if job["columnar"]:
+            ColumnarStore(folder=job["folder"]).append(record=job["record"], file=job["relative_path"], fsync=self.fsync)
+
+
+
+'''
+    this class is the journal of a run (one JSON object per line), so an interrupted run can be resumed
+    without measuring anything twice (see custom_scheduler.py). Every line is appended and fsynced at once:
+        {"event": "start", "wafer_folder": ..., "settings_hash": ...}
+        {"event": "diode", "column": ..., "row": ..., "subdie": ..., "diode": ..., "measurement_no": ..., "file": ..., "hash": ...}
+        {"event": "subdie", "column": ..., "row": ..., "subdie": ...}      all diodes of the subdie are done
+    file is the measurement file relative to the run folder, hash the settings hash of the measurement (save_to_json.chash).
+    A diode only counts as measured if its file exists, the BackgroundWriter may not have written it before a crash.
+'''
+class RunJournal():
+
+    def __init__(self, *, filepath: str) -> None:
+        self.filepath = filepath
+        self.load()
+
+    def load(self) -> None:
+        self.wafer_folder: typing.Optional[str] = None
+        self.settings_hash: typing.Optional[str] = None
+        self.completed: typing.List[typing.Tuple[int, int, int]] = []
+        self.diodes: typing.Dict[typing.Tuple[int, int, int, str, int], str] = {}     # (column, row, subdie, diode, measurement_no) -> file
+        if not os.path.isfile(self.filepath):
+            return
+        with open(self.filepath, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue    # a line that was cut off by a crash
+                if record.get("event") == "start":
+                    self.wafer_folder, self.settings_hash = record.get("wafer_folder"), record.get("settings_hash")
+                elif record.get("event") == "diode":
+                    self.diodes[self._key(**{name: record[name] for name in ("column", "row", "subdie", "diode", "measurement_no")})] = record.get("file")
+                elif record.get("event") == "subdie":
+                    self.completed.append(self._position(column=record["column"], row=record["row"], subdie=record["subdie"]))
+
+    @staticmethod
+    def _position(*, column, row, subdie) -> typing.Tuple[int, int, int]:
+        return (int(column), int(row), int(subdie))
+
+    @classmethod
+    def _key(cls, *, column, row, subdie, diode, measurement_no) -> typing.Tuple[int, int, int, str, int]:
+        return cls._position(column=column, row=row, subdie=subdie) + (str(diode), int(measurement_no))
+
+    # the last completed subdie as (column, row, subdie), None if no subdie was completed yet
+    @property
+    def last(self) -> typing.Optional[typing.Tuple[int, int, int]]:
+        return self.completed[-1] if self.completed else None
+
+    def is_measured(self, *, column, row, subdie, diode, measurement_no) -> bool:
+        file = self.diodes.get(self._key(column=column, row=row, subdie=subdie, diode=diode, measurement_no=measurement_no))
+        return file is not None and self.wafer_folder is not None and os.path.isfile(os.path.join(self.wafer_folder, file))
+
+    def _append(self, record: typing.Dict[str, typing.Any]) -> None:
+        folder = os.path.dirname(self.filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        record["time"] = time.strftime("%Y_%m_%d-%H_%M_%S")
+        with open(self.filepath, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # starts a new journal, the old one is removed
+    def start(self, *, wafer_folder: str, settings_hash: str) -> None:
+        self.clear()
+        self.wafer_folder, self.settings_hash = wafer_folder, settings_hash
+        self._append({"event": "start", "wafer_folder": wafer_folder, "settings_hash": settings_hash})
+
+    def add_diode(self, *, column, row, subdie, diode, measurement_no, file, hash=None) -> None:
+        self.diodes[self._key(column=column, row=row, subdie=subdie, diode=diode, measurement_no=measurement_no)] = file
+        self._append({"event": "diode", "column": int(column), "row": int(row), "subdie": int(subdie), "diode": str(diode),
+                      "measurement_no": int(measurement_no), "file": file, "hash": hash})
+
+    def add_subdie(self, *, column, row, subdie) -> None:
+        self.completed.append(self._position(column=column, row=row, subdie=subdie))
+        self._append({"event": "subdie", "column": int(column), "row": int(row), "subdie": int(subdie)})
+
+    def clear(self) -> None:
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+        self.load()
+
+
+# hash of the settings of a config file, a run is only resumed with the same settings (the task order and connection do not count)
+def settings_hash(*, data: typing.Dict[str, typing.Any],
+                  ignore: typing.Iterable[str] = ("priority", "after", "waferprober_ip", "waferprober_port", "device_port")) -> str:
+    content = json.dumps({key: value for key, value in data.items() if key not in ignore}, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
 def get_all_filenames_in_folder(*, startdir, file_extension=""):
     # This func outputs a List of all Files in a given directory and its subdirectories
     f = []
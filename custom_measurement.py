@@ -17,28 +17,257 @@ import custom_filehandler as cfile
 import custom_waferprober as cwafer
 import time
 import matplotlib.pyplot as plt
-import os
-import json
 import typing
+import numpy as np
+import math
+
+
+'''
+    this class keeps one serial connection to the Keithley 6487 open for the whole run, 
+    instead of opening and closing the port for every sweep.
+    - setup commands with a value (e.g. "SOUR:VOLT:SWE:DEL 1") are only sent if the value changed since they were sent last.
+      Commands without a value (e.g. "INIT") and queries are always sent. "*RST" forgets all values.
+    - if the port fails, it is reopened (up to reconnect_attempts times) and all setup commands are sent again on next use
+    Use it as a context manager or call open() and close() yourself.
+'''
+class Keithley6487():
+
+    def __init__(self, *, dev, logger, baudrate=57600, timeout=400, reconnect_attempts=3):
+        self.dev = dev
+        self.logger = logger
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.ser = None
+        self.state = {}     # last value sent for every setup command
+        self.skipped = 0    # number of setup commands that were not sent again
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open(self):
+        if self.ser is None or not self.ser.is_open:
+            self.ser = serial.Serial(self.dev, baudrate=self.baudrate, timeout=self.timeout)
+            self.state = {}
+            self.logger.info(f"Opened serial connection to Keithley at {self.dev}")
+
+    def close(self):
+        if self.ser is not None and self.ser.is_open:
+            self.ser.close()
+            self.logger.info(f"Closed serial connection to Keithley at {self.dev}, {self.skipped} unchanged setup commands skipped")
+        self.ser = None
+
+    def reconnect(self):
+        for attempt in range(1, self.reconnect_attempts + 1):
+            try:
+                if self.ser is not None:
+                    self.ser.close()
+                self.ser = None
+                time.sleep(attempt)
+                self.open()
+                self.logger.warning(f"Reconnected to Keithley at {self.dev} (attempt {attempt})")
+                return
+            except Exception as e:
+                self.logger.error(f"Reconnecting to Keithley failed (attempt {attempt}): {e}")
+        raise ConnectionError(f"Could not reconnect to Keithley at {self.dev}")
+
+    # runs a serial operation, reconnects once if the port failed
+    def _io(self, operation):
+        try:
+            self.open()
+            return operation()
+        except (serial.SerialException, OSError) as e:
+            self.logger.error(f"Serial connection to Keithley failed: {e}")
+            self.reconnect()
+            return operation()
+
+    def write(self, command, *, force=False):
+        header, _, value = command.partition(" ")
+        if header == "*RST":
+            self.state = {}
+        elif value and not force:
+            if self.state.get(header) == value:
+                self.skipped += 1
+                return
+        self._io(lambda: self.ser.write(f"{command}\n".encode()))
+        if value:
+            self.state[header] = value
+
+    def flush(self):
+        self._io(lambda: self.ser.flush())
+
+    def readline(self):
+        return self._io(lambda: self.ser.readline())
+
+    # reads the answer to "TRAC:DATA?" into a TraceParser as the bytes arrive
+    # the first byte may take as long as the sweep (timeout), after it the answer ends if nothing arrives for idle_timeout seconds:
+    # a binary answer has no length, a trace with fewer points than expected would otherwise wait for the whole timeout
+    def read_trace(self, *, parser, idle_timeout=1.0):
+        try:
+            while not parser.done:
+                chunk = self._io(lambda: self.ser.read(self.ser.in_waiting or 1))
+                if not chunk:
+                    if parser.bytes_received:
+                        self.logger.warning(f"The trace data ended after {parser.count} of {parser.expected_values} values")
+                        parser.finish()
+                    else:
+                        self.logger.error(f"Timeout while reading the trace data, {parser.count} values received")
+                    break
+                if not parser.bytes_received:
+                    self.ser.timeout = idle_timeout
+                parser.feed(chunk)
+        finally:
+            if self.ser is not None:
+                self.ser.timeout = self.timeout
+        return parser
+
+    # waits until the Keithley has finished all pending operations
+    def wait_until_ready(self):
+        self.write("*OPC?")
+        return self.readline()
+
+
+'''
+    this class decodes the answer to "TRAC:DATA?" while it arrives, chunk by chunk, into a preallocated NumPy array.
+    The answer is either
+    - ASCII: comma separated values, terminated by a line feed
+    - binary (FORM:DATA SRE): the header "#0", 4 bytes IEEE-754 single precision per value, a line feed
+      (big endian for FORM:BORD NORM, little endian for FORM:BORD SWAP)
+    the format is detected from the first bytes, so a binary request that is answered in ASCII is still decoded.
+    With FORM:ELEM READ,VSO every point consists of the current (READ) followed by the voltage (VSO).
+    on_points(x, y) is called with the voltages and currents of every batch of newly completed points,
+    so checks can start before the whole sweep is transferred.
+'''
+class TraceParser():
+
+    def __init__(self, *, expected_points, elements=2, byte_order=">", on_points=None):
+        self.elements = elements
+        self.expected_values = expected_points * elements
+        self.values = np.empty(max(self.expected_values, elements), dtype=np.float64)
+        self.count = 0              # number of decoded values
+        self.byte_order = byte_order
+        self.on_points = on_points
+        self.binary = None          # None until the format is detected
+        self.done = False
+        self.bytes_received = 0
+        self.errors = []            # tokens that could not be decoded
+        self._pending = b""
+        self._reported_points = 0
+
+    def feed(self, chunk):
+        if self.done or not chunk:
+            return
+        self.bytes_received += len(chunk)
+        data = self._pending + chunk
+        if self.binary is None:
+            if len(data) < 2:
+                self._pending = data
+                return
+            self.binary = data[:2] == b"#0"
+            if self.binary:
+                data = data[2:]
+        if self.binary:
+            self._feed_binary(data=data)
+        else:
+            self._feed_ascii(data=data)
+        self._report()
+
+    def _feed_binary(self, *, data):
+        missing = self.expected_values - self.count
+        n = min(len(data) // 4, missing)
+        if n:
+            self._store(values=np.frombuffer(data[:n * 4], dtype=f"{self.byte_order}f4"))
+        data = data[n * 4:]
+        # the terminator follows the last value
+        if self.count >= self.expected_values and len(data) >= 1:
+            self.done = True
+            data = b""
+        self._pending = data
+
+    def _feed_ascii(self, *, data):
+        if b"\n" in data:
+            data = data.split(b"\n", 1)[0]
+            self.done = True
+            tokens, self._pending = data.split(b","), b""
+        else:
+            tokens = data.split(b",")
+            self._pending = tokens.pop()     # the last token may be incomplete
+        tokens = [i for i in tokens if i.strip()]
+        if not tokens:
+            return
+        try:
+            values = np.array(tokens, dtype=np.float64)
+        except ValueError:
+            values = []
+            for i in tokens:
+                try:
+                    values.append(float(i))
+                except ValueError:
+                    self.errors.append(i.decode(errors="replace"))
+                    values.append(np.nan)
+            values = np.array(values, dtype=np.float64)
+        self._store(values=values)
+
+    def _store(self, *, values):
+        end = self.count + len(values)
+        if end > len(self.values):
+            self.values = np.resize(self.values, max(end, 2 * len(self.values)))
+        self.values[self.count:end] = values
+        self.count = end
+
+    # ends an answer that stopped before all expected values arrived (see Keithley6487.read_trace):
+    # a pending ASCII value is still decoded, the incomplete bytes of a binary answer (e.g. its terminator) are dropped
+    def finish(self):
+        if self.done:
+            return
+        if not self.binary and self._pending:
+            self._feed_ascii(data=self._pending + b"\n")
+        self._pending = b""
+        self.done = True
+        self._report()
+
+    def _report(self):
+        complete = self.count // self.elements
+        if self.on_points is not None and complete > self._reported_points:
+            x, y = self.points(start=self._reported_points)
+            self._reported_points = complete
+            self.on_points(x, y)
+
+    # returns the voltages and currents of all complete points (from point number start on)
+    def points(self, *, start=0):
+        complete = self.count // self.elements
+        values = self.values[start * self.elements:complete * self.elements].reshape(-1, self.elements)
+        return values[:, 1], values[:, 0]
 
 
 # Initialize Keithley for IV scan using RS-232 communication
-def init_IV(*, dev, logger):
+# if a Keithley6487 object is given, its open connection is used
+def init_IV(*, dev, logger, keithley=None):
     try:
-        with serial.Serial(dev, baudrate=57600)  as ser:
-            ser.write(b"*RST\n")
-            ser.write(b"CURR:RANG 2E-9\n")
-            ser.write(b"SYST:ZCH ON\n")
-            ser.write(b"ARM:COUN 1\n")
-            ser.write(b"INIT\n")
-            ser.write(b"CURR:RANG:AUTO ON\n")
-            ser.write(b"SOUR:VOLT:RANG 500\n")
-            ser.write(b"SOUR:VOLT:ILIM 2.50e-3\n")
-            ser.write(b"FORM:ELEM READ,VSO\n")
-            ser.write(b"SYST:ZCOR:STAT OFF\n")
-            ser.write(b"SYST:ZCOR:ACQ\n")
-            ser.write(b"SYST:ZCOR:STAT ON\n")
+        own_keithley = keithley is None
+        if own_keithley:
+            keithley = Keithley6487(dev=dev, logger=logger)
+        try:
+            keithley.write("*RST")
+            keithley.write("CURR:RANG 2E-9")
+            keithley.write("SYST:ZCH ON")
+            keithley.write("ARM:COUN 1")
+            keithley.write("INIT")
+            keithley.write("CURR:RANG:AUTO ON")
+            keithley.write("SOUR:VOLT:RANG 500")
+            keithley.write("SOUR:VOLT:ILIM 2.50e-3")
+            keithley.write("FORM:ELEM READ,VSO")
+            keithley.write("SYST:ZCOR:STAT OFF")
+            keithley.write("SYST:ZCOR:ACQ")
+            keithley.write("SYST:ZCOR:STAT ON")
             logger.info("Keithley initialized successfully.")
+        finally:
+            if own_keithley:
+                keithley.close()
 
     except Exception as e:
         logger.critical(f"Error initializing Keithley: {e}")
@@ -46,63 +275,219 @@ def init_IV(*, dev, logger):
 
 
 # Perform IV measurement using Keithley and store results
-def do_IV(*, dev, graph = [], start, stop, step, delay, is_last=False, logger, failed_measurement_timestamps):
+# if a Keithley6487 object is given, its open connection is used, otherwise the port is opened for this sweep only
+# transfer="binary" requests the data in the binary format of the Keithley, which is shorter and faster to decode
+# on_points(x, y) is called with every batch of points that arrived (see TraceParser)
+def do_IV(*, dev, graph = [], start, stop, step, delay, is_last=False, logger, failed_measurement_timestamps, keithley=None, transfer="ascii", on_points=None):
     measurement_successful = False
     try:
-        n = int(abs(stop - start) / step +1)
+        n = int(round(abs(stop - start) / step, 6) + 1)    # rounded, so 0.8 / 0.1 gives 9 points and not 8
         max_expected_time = n * (delay+2) + 20
         
-        #with serial.Serial(dev, baudrate=57600, timeout=int(max_expected_time)) as ser:
-        with serial.Serial(dev, baudrate=57600, timeout=400) as ser:
-            
-            ser.write(f"TRAC:POIN {n}\n".encode())
-            ser.write(f"SOUR:VOLT:SWE:STAR {start}\n".encode())
-            ser.write(f"SOUR:VOLT:SWE:STOP {stop}\n".encode())
-            ser.write(f"SOUR:VOLT:SWE:STEP {step}\n".encode())
-            ser.write(f"SOUR:VOLT:SWE:DEL {delay}\n".encode())
-            ser.write(f"TRIG:COUN {n}\n".encode())
-            ser.write(b"SYST:ZCH OFF\n")
-            ser.write(b"SOUR:VOLT:SWE:INIT\n")
-            ser.flush()
-            ser.write(b"INIT\n")
-            ser.write(b"TRAC:DATA?\n")
+        own_keithley = keithley is None
+        if own_keithley:
+            #keithley = Keithley6487(dev=dev, logger=logger, timeout=int(max_expected_time))
+            keithley = Keithley6487(dev=dev, logger=logger, timeout=400)
+        try:
+            if transfer == "binary":
+                keithley.write("FORM:DATA SRE")
+                keithley.write("FORM:BORD SWAP")
+                parser = TraceParser(expected_points=n, byte_order="<", on_points=on_points)
+            else:
+                keithley.write("FORM:DATA ASC")
+                parser = TraceParser(expected_points=n, on_points=on_points)
+            keithley.write(f"TRAC:POIN {n}")
+            keithley.write(f"SOUR:VOLT:SWE:STAR {start}")
+            keithley.write(f"SOUR:VOLT:SWE:STOP {stop}")
+            keithley.write(f"SOUR:VOLT:SWE:STEP {step}")
+            keithley.write(f"SOUR:VOLT:SWE:DEL {delay}")
+            keithley.write(f"TRIG:COUN {n}")
+            keithley.write("SYST:ZCH OFF")
+            keithley.write("SOUR:VOLT:SWE:INIT")
+            keithley.flush()
+            keithley.write("INIT")
+            keithley.write("TRAC:DATA?")
             if is_last:
-                ser.write(b"SYST:ZCH ON\n")
-                ser.write(b"INIT\n")
+                keithley.write("SYST:ZCH ON")
+                keithley.write("INIT")
                 time.sleep(3)
-            ser.flush()
+            keithley.flush()
             
-            # Parse the IV data
-            line = ser.readline().decode()
-            print("readline, decode")
-            logger.info(f"line: {line}")
-            if line:
-                points = line.split(',')
-                n = len(points)
-                logger.info(f"adding {n//2} points")
-                for i in range(0, n - 1, 2):
-                    try:
-                        y = float(points[i])
-                        x = float(points[i + 1])
-                        if -500 < x < 500 and y < 500:
-                            graph.append((x, y))
-                            # check if that there is contact
-                            if y > 5e-12:
-                                measurement_successful = True
-
-                    except ValueError:
-                        logger.error(f"Error parsing data point: {points[i]}, {points[i + 1]}")
-                if measurement_successful == False:
-                    failed_measurement_timestamps.append(time.time())
-                    
-                return graph
-            else:
-                logger.error("No data returned by instrument")
-                return None
+            # Parse the IV data while it arrives
+            keithley.read_trace(parser=parser)
+        finally:
+            if own_keithley:
+                keithley.close()
+        logger.info(f"received {parser.bytes_received} bytes ({'binary' if parser.binary else 'ASCII'})")
+        for i in parser.errors:
+            logger.error(f"Error parsing data point: {i}")
+        x, y = parser.points()
+        if len(x):
+            logger.info(f"adding {len(x)} points")
+            if parser.binary:
+                x = np.round(x, 6)   # single precision voltages, e.g. 0.1 -> 0.10000000149
+            valid = (-500 < x) & (x < 500) & (y < 500)
+            graph.extend(zip(x[valid].tolist(), y[valid].tolist()))
+            # check if that there is contact
+            measurement_successful = bool(np.any(y[valid] > 5e-12))
+            if measurement_successful == False:
+                failed_measurement_timestamps.append(time.time())
+                
+            return graph
+        else:
+            logger.error("No data returned by instrument")
+            return None
     except Exception as e:
         logger.critical(f"Error performing IV scan: {e}")
 
 
+# switches on the zero check after the last sweep of a diode (like do_IV with is_last=True)
+def zero_check(*, dev, logger, keithley=None):
+    own_keithley = keithley is None
+    if own_keithley:
+        keithley = Keithley6487(dev=dev, logger=logger)
+    try:
+        keithley.write("SYST:ZCH ON")
+        keithley.write("INIT")
+        time.sleep(3)
+        keithley.flush()
+    finally:
+        if own_keithley:
+            keithley.close()
+
+
+# voltages from start to stop (both included) in steps of step, the last step is shorter if stop is not on the grid
+def _voltage_grid(*, start, stop, step):
+    direction = 1 if stop >= start else -1
+    count = int(math.floor(round(abs(stop - start) / step, 6)))
+    voltages = np.round(start + direction * step * np.arange(count + 1), 6)
+    if not math.isclose(voltages[-1], stop, abs_tol=1e-6):
+        voltages = np.append(voltages, round(stop, 6))
+    return voltages
+
+
+# IV sweep over voltages (a grid of _voltage_grid) in several sweeps, so the measurement can stop between two sweeps:
+# the first sweep measures first_points points (default segment_points), every further sweep segment_points points (None: the rest).
+# noise_threshold: stops after the first sweep if no current exceeds it (only noise, no contact)
+# limit: stops after the first point whose current reaches it, the later points of that sweep are dropped
+# Returns (graph, reason, sweeps), reason is None if all voltages were measured, otherwise "noise" or "limit".
+def segmented_IV(*, dev, voltages, step, delay, logger, failed_measurement_timestamps, keithley=None, transfer="ascii",
+                 first_points=None, segment_points=None, noise_threshold=None, limit=None, is_last=False):
+    graph, reason, sweeps = [], None, 0
+    failed = []         # do_IV marks every sweep without contact, the whole measurement is marked once
+
+    def run(part):
+        nonlocal sweeps
+        if len(part) >= 2 and not math.isclose(abs(part[-1] - part[-2]), step, abs_tol=1e-6):
+            return run(part[:-1]) + run(part[-1:])     # the shorter last step is a sweep of its own, also if the part only has two points
+        sweeps += 1
+        result = do_IV(dev=dev, graph=[], start=float(part[0]), stop=float(part[-1]), step=round(step, 6), delay=delay, logger=logger,
+                       failed_measurement_timestamps=failed, keithley=keithley, transfer=transfer)
+        return result or []
+
+    begin, size = 0, first_points or segment_points or len(voltages)
+    while begin < len(voltages) and reason is None:
+        result = run(voltages[begin:begin + size])
+        for voltage, current in result:
+            graph.append((voltage, current))
+            if limit is not None and abs(current) >= limit:
+                reason = "limit"
+                break
+        if reason is None and begin == 0 and noise_threshold is not None and not any(abs(current) > noise_threshold for _, current in result):
+            reason = "noise"
+        begin, size = begin + size, segment_points or len(voltages)
+    if reason is None and graph and not math.isclose(graph[-1][0], voltages[-1], abs_tol=1e-6):
+        logger.error(f"The sweep ended at {graph[-1][0]} V instead of {voltages[-1]} V")
+    if is_last:
+        zero_check(dev=dev, logger=logger, keithley=keithley)
+    if failed and not any(current > 5e-12 for _, current in graph):
+        failed_measurement_timestamps.append(time.time())
+    return graph, reason, sweeps
+
+
+# fast contact check before the measurement of a diode: a short sweep of points points up to voltage,
+# there is contact if one current exceeds threshold (the noise limit of do_IV).
+# The currents are checked batch by batch while the trace arrives (TraceParser.on_points)
+def check_contact(*, dev, logger, keithley=None, voltage=5.0, points=3, delay=0, threshold=5e-12, transfer="ascii"):
+    step = abs(voltage) / points
+    above = False
+
+    def on_points(x, y):
+        nonlocal above
+        valid = (-500 < x) & (x < 500) & (y < 500)      # the points that do_IV keeps
+        above = above or bool(np.any(np.abs(y[valid]) > threshold))
+
+    graph = do_IV(dev=dev, graph=[], start=voltage / points, stop=voltage, step=step, delay=delay, logger=logger,
+                  failed_measurement_timestamps=[], keithley=keithley, transfer=transfer, on_points=on_points)
+    contact = bool(graph) and above
+    logger.measurement(f"Contact check up to {voltage} V: {'contact' if contact else 'only noise'}") # type: ignore
+    return contact
+
+
+# checks the contact, without contact the probe is lifted and lowered again (cwafer.recontact_sequence) up to retries times
+# returns True as soon as there is contact
+def ensure_contact(*, msgServer, dev, logger, keithley=None, retries=2, voltage=5.0, points=3, threshold=5e-12, transfer="ascii",
+                   timings=None, settle_time=0.0):
+    for attempt in range(retries + 1):
+        if check_contact(dev=dev, logger=logger, keithley=keithley, voltage=voltage, points=points, threshold=threshold, transfer=transfer):
+            return True
+        if attempt < retries:
+            logger.measurement(f"No contact, lifting and lowering the probe again ({attempt + 1} of {retries})") # type: ignore
+            cwafer.recontact_sequence(logger=logger, timings=timings, settle_time=settle_time).run(msgServer=msgServer)
+    return False
+
+
+# Adaptive IV sweep: the range is first measured with coarse_step in sweeps of segment_points points,
+# the coarse pass stops after the first point whose current reaches threshold or the current limit (compliance),
+# and after the first sweep if it only measured noise (noise_threshold, None: never).
+# Between two coarse points whose currents differ by more than refine_decades (decades, currents below noise_floor count as noise_floor)
+# the range is measured again with fine_step, neighbouring ranges are measured in one sweep.
+# Returns the points of all sweeps in the order of the sweep like do_IV ([(voltage, current), ...]), None if no data was returned.
+def adaptive_IV(*, dev, start, stop, coarse_step, fine_step, delay, threshold=None, compliance=2.5e-3, refine_decades=0.3,
+                segment_points=10, noise_floor=1e-12, noise_threshold=None, is_last=False, logger, failed_measurement_timestamps,
+                keithley=None, transfer="ascii"):
+    limit = 0.99 * compliance if threshold is None else min(abs(threshold), 0.99 * compliance)
+    fine_step = abs(fine_step)
+    failed = []
+    coarse, reason, sweeps = segmented_IV(dev=dev, voltages=_voltage_grid(start=start, stop=stop, step=abs(coarse_step)), step=abs(coarse_step),
+                                          delay=delay, logger=logger, failed_measurement_timestamps=failed, keithley=keithley, transfer=transfer,
+                                          segment_points=segment_points, noise_threshold=noise_threshold, limit=limit)
+    if not coarse:
+        logger.error("No data returned by instrument")
+        return None
+    points = {round(voltage, 6): current for voltage, current in coarse}      # voltage -> current
+
+    # the ranges between the coarse points that are refined
+    direction = 1 if stop >= start else -1
+    measured = sorted(points, key=lambda voltage: direction * voltage)
+    currents = np.log10(np.maximum(np.abs([points[voltage] for voltage in measured]), noise_floor))
+    steep = np.abs(np.diff(currents)) > refine_decades
+    ranges = []
+    for i in np.flatnonzero(steep):
+        if ranges and ranges[-1][1] == measured[i]:
+            ranges[-1][1] = measured[i + 1]
+        else:
+            ranges.append([measured[i], measured[i + 1]])
+    if reason == "noise":
+        ranges = []
+    for low, high in ranges:
+        voltages = _voltage_grid(start=low, stop=high, step=fine_step)[1:-1]
+        if len(voltages):
+            fine, _, count = segmented_IV(dev=dev, voltages=voltages, step=fine_step, delay=delay, logger=logger,
+                                          failed_measurement_timestamps=failed, keithley=keithley, transfer=transfer)
+            sweeps += count
+            points.update((round(voltage, 6), current) for voltage, current in fine)
+    if is_last:
+        zero_check(dev=dev, logger=logger, keithley=keithley)
+
+    graph = [(voltage, points[voltage]) for voltage in sorted(points, key=lambda voltage: direction * voltage)]
+    stopped = {"limit": f", stopped at {measured[-1]} V", "noise": ", stopped: only noise"}.get(reason, "")
+    logger.measurement(f"Adaptive sweep: {len(coarse)} coarse and {len(graph) - len(coarse)} fine points in {sweeps} sweeps{stopped}") # type: ignore
+    if not any(current > 5e-12 for _, current in graph):
+        failed_measurement_timestamps.append(time.time())
+    return graph
+
+
 ## evtl. für auswertung
 def sweep(*, graph, logger):
     if graph:
@@ -116,7 +501,34 @@ def sweep(*, graph, logger):
         return[]
     
 
-def measure(*, msgServer, device_port, folder, diode_Nr, settings, logger, plotting=False, extra, measurements_per_diode, measurement_no, path_to_config_file, failed_measurement_timestamps):
+# rough duration in s of one measurement (reverse and forward sweep) with the sweep settings of the config file (data),
+# point_time is the integration time of one point, overhead the zero check and the data transfer of both sweeps
+# an adaptive sweep is counted as the coarse points plus two refined coarse steps
+def estimate_measurement_time(*, data, point_time=0.05, overhead=5.0):
+    duration = overhead
+    for bias, start, stop, step, factor in (("rbias", 0.0, 50, 0.1, 10), ("fbias", 0.0, -2.5, 0.2, 5)):
+        start = data.get(f"start_{bias}", start)
+        stop = data.get(f"stop_{bias}", stop)
+        step = data.get(f"step_{bias}", step)
+        n = int(abs(stop - start) / step + 1)
+        if data.get("sweep_mode", "fixed") == "adaptive":
+            coarse_step = data.get(f"coarse_step_{bias}", factor * step)
+            n = min(n, int(abs(stop - start) / coarse_step + 1) + int(2 * coarse_step / step))
+        duration += n * (data.get(f"delay_{bias}", 1) + point_time)
+    return duration
+
+
+# the sweep settings that are stored with every measurement and in the settings of the run
+def measurement_settings(*, run_settings):
+    names = ["start_rbias", "stop_rbias", "step_rbias", "delay_rbias", "start_fbias", "stop_fbias", "step_fbias", "delay_fbias",
+             "sweep_mode", "early_abort_points"]
+    if run_settings.sweep_mode == "adaptive":
+        names += ["coarse_step_rbias", "coarse_step_fbias", "threshold_rbias", "threshold_fbias", "refine_decades"]
+    return {name: run_settings[name] for name in names}
+
+
+# returns {"file": measurement file relative to folder, "hash": settings hash of the measurement}, None if nothing was saved
+def measure(*, msgServer, device_port, folder, diode_Nr, run_settings, logger, plotting=False, extra, measurements_per_diode, measurement_no, failed_measurement_timestamps, writer=None, keithley=None):
     try:
         store_data = cfile.save_to_json(folder="")
         die_pos, subdie_pos, x_position, y_position, column, row = cwafer.get_die_info(msgServer=msgServer, logger=logger)
@@ -127,56 +539,31 @@ def measure(*, msgServer, device_port, folder, diode_Nr, settings, logger, plott
         if temp is None:
             logger.critical("Error: temperature measurement failed")
             return
-        ### Import settings from file ###
-
-        if not os.path.isfile(path_to_config_file):
-                print(f"Error: File {path_to_config_file} does not exist.")
-        with open(path_to_config_file, 'r', encoding='utf-8') as file:
-            try:
-                data = json.load(file)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON from file {path_to_config_file}: {e}")
-                return None
-            except Exception as e:
-                print(f"An unexpected error occurred while loading JSON file {path_to_config_file}: {e}")
-                return None
-            finally:
-                file.close()
-            
-        delay_fbias = data.get("delay_fbias", 1)
-        delay_rbias = data.get("delay_rbias", 1)
-        start_fbias = data.get("start_fbias", 0.0)
-        start_rbias = data.get("start_rbias", 0.0)
-        step_fbias = data.get("step_fbias", 0.2)
-        step_rbias = data.get("step_rbias", 0.1)
-        stop_fbias = data.get("stop_fbias", -2.5)
-        stop_rbias = data.get("stop_rbias", 50)
-        tag_1 = data.get("tag_1", "")
-        tag_2 = data.get("tag_2", "")
-        tag_3 = data.get("tag_3", "")
+        ### settings of the run (cfile.RunSettings, read once in main) ###
+        delay_fbias = run_settings.delay_fbias
+        delay_rbias = run_settings.delay_rbias
+        start_fbias = run_settings.start_fbias
+        start_rbias = run_settings.start_rbias
+        step_fbias = run_settings.step_fbias
+        step_rbias = run_settings.step_rbias
+        stop_fbias = run_settings.stop_fbias
+        stop_rbias = run_settings.stop_rbias
+        keithley_transfer = run_settings.keithley_transfer
+        sweep_mode = run_settings.sweep_mode
+        coarse_step_rbias = run_settings.coarse_step_rbias
+        coarse_step_fbias = run_settings.coarse_step_fbias
+        threshold_rbias = run_settings.threshold_rbias
+        threshold_fbias = run_settings.threshold_fbias
+        refine_decades = run_settings.refine_decades
+        early_abort_points = run_settings.early_abort_points
+        contact_threshold = run_settings.contact_threshold
 
-        
-        settings.add(name="start_rbias", value=start_rbias)
-        settings.add(name="stop_rbias", value=stop_rbias)
-        settings.add(name="step_rbias", value=step_rbias)
-        settings.add(name="delay_rbias", value=delay_rbias)
-        store_data.add(name="start_rbias", value=start_rbias)
-        store_data.add(name="stop_rbias", value=stop_rbias)
-        store_data.add(name="step_rbias", value=step_rbias)
-        store_data.add(name="delay_rbias", value=delay_rbias)
-
-        settings.add(name="start_fbias", value=start_fbias)
-        settings.add(name="stop_fbias", value=stop_fbias)
-        settings.add(name="step_fbias", value=step_fbias)
-        settings.add(name="delay_fbias", value=delay_fbias)
-        store_data.add(name="start_fbias", value=start_fbias)
-        store_data.add(name="stop_fbias", value=stop_fbias)
-        store_data.add(name="step_fbias", value=step_fbias)
-        store_data.add(name="delay_fbias", value=delay_fbias)
+        for name, value in measurement_settings(run_settings=run_settings).items():
+            store_data.add(name=name, value=value)
         store_data.add(name="extra", value=extra)
-        store_data.add(name="tag_1", value=tag_1)
-        store_data.add(name="tag_2", value=tag_2)
-        store_data.add(name="tag_3", value=tag_3)
+        store_data.add(name="tag_1", value=run_settings.tag_1)
+        store_data.add(name="tag_2", value=run_settings.tag_2)
+        store_data.add(name="tag_3", value=run_settings.tag_3)
         store_data.add(name="measurements_per_diode", value=measurements_per_diode)
         store_data.add(name="measurement_no", value=measurement_no)
 
@@ -185,9 +572,31 @@ def measure(*, msgServer, device_port, folder, diode_Nr, settings, logger, plott
 
         iv_data_rbias = []
         iv_data_fbias = []
-        iv_data_rbias = do_IV(dev=device_port, graph=iv_data_rbias, start=start_rbias, stop=stop_rbias, step=step_rbias, delay=delay_rbias, is_last=False, logger=logger, failed_measurement_timestamps=failed_measurement_timestamps)
-        time.sleep(2)
-        iv_data_fbias = do_IV(dev=device_port, graph=iv_data_fbias, start=start_fbias, stop=stop_fbias, step=step_fbias, delay=delay_fbias, is_last=True, logger=logger, failed_measurement_timestamps=failed_measurement_timestamps)
+        noise_threshold = contact_threshold if early_abort_points else None
+        aborted = False
+        if sweep_mode == "adaptive":
+            iv_data_rbias = adaptive_IV(dev=device_port, start=start_rbias, stop=stop_rbias, coarse_step=coarse_step_rbias, fine_step=step_rbias, delay=delay_rbias, threshold=threshold_rbias, refine_decades=refine_decades, noise_threshold=noise_threshold, is_last=False, logger=logger, failed_measurement_timestamps=failed_measurement_timestamps, keithley=keithley, transfer=keithley_transfer)
+        elif early_abort_points:
+            # the first points are a sweep of their own, so a sweep without contact stops after them
+            iv_data_rbias, _, _ = segmented_IV(dev=device_port, voltages=_voltage_grid(start=start_rbias, stop=stop_rbias, step=step_rbias), step=step_rbias, delay=delay_rbias, first_points=early_abort_points, noise_threshold=noise_threshold, logger=logger, failed_measurement_timestamps=failed_measurement_timestamps, keithley=keithley, transfer=keithley_transfer)
+        else:
+            iv_data_rbias = do_IV(dev=device_port, graph=iv_data_rbias, start=start_rbias, stop=stop_rbias, step=step_rbias, delay=delay_rbias, is_last=False, logger=logger, failed_measurement_timestamps=failed_measurement_timestamps, keithley=keithley, transfer=keithley_transfer)
+        if noise_threshold is not None and iv_data_rbias is not None and not any(abs(current) > noise_threshold for _, current in iv_data_rbias):
+            # without contact the forward bias sweep is skipped as well
+            logger.measurement(f"Only noise in the reverse bias sweep of diode {diode_Nr}, the measurement is stopped") # type: ignore
+            store_data.add(name="aborted", value="noise")
+            aborted = True
+            zero_check(dev=device_port, logger=logger, keithley=keithley)
+        elif keithley is None:
+            time.sleep(2)
+        else:
+            keithley.wait_until_ready()     # the open connection can ask the Keithley instead of waiting a fixed time
+        if aborted:
+            iv_data_fbias = []
+        elif sweep_mode == "adaptive":
+            iv_data_fbias = adaptive_IV(dev=device_port, start=start_fbias, stop=stop_fbias, coarse_step=coarse_step_fbias, fine_step=step_fbias, delay=delay_fbias, threshold=threshold_fbias, refine_decades=refine_decades, is_last=True, logger=logger, failed_measurement_timestamps=failed_measurement_timestamps, keithley=keithley, transfer=keithley_transfer)
+        else:
+            iv_data_fbias = do_IV(dev=device_port, graph=iv_data_fbias, start=start_fbias, stop=stop_fbias, step=step_fbias, delay=delay_fbias, is_last=True, logger=logger, failed_measurement_timestamps=failed_measurement_timestamps, keithley=keithley, transfer=keithley_transfer)
         logger.measurement(str("Measurement data reverse Bias: " + str(iv_data_rbias)))
         logger.measurement(str("Measurement data forward Bias: " + str(iv_data_fbias)))
         if plotting and iv_data_rbias != None:
@@ -214,9 +623,10 @@ def measure(*, msgServer, device_port, folder, diode_Nr, settings, logger, plott
         store_data.add(name="time_at_end", value=timestr)
         #iv_data = sweep(iv_data)
         if iv_data_rbias or iv_data_fbias:
-            cfile.save_IV(msgServer=msgServer, store_data=store_data, iv_data_rbias=iv_data_rbias, iv_data_fbias=iv_data_fbias, folder=folder, diode_Nr=diode_Nr, logger=logger, measurement_no=measurement_no)
+            file = cfile.save_IV(msgServer=msgServer, store_data=store_data, iv_data_rbias=iv_data_rbias, iv_data_fbias=iv_data_fbias, folder=folder, diode_Nr=diode_Nr, logger=logger, measurement_no=measurement_no, writer=writer)
             logger.measurement(f"IV data saved for diode {diode_Nr} at die {die_pos} subdie {subdie_pos} x {x_position} y {y_position}")
             logger.measurement(f"Probed and measured sub die {x_position} {y_position}")
+            return {"file": file, "hash": store_data.settings.get("hash")}
         else:
             logger.measurement("No Data Returned from Measurement")
                 
@@ -10,6 +10,99 @@
 
 
 #import velox
+import math
+import itertools
+
+
+"""
+Travel time model of the probe: every point of a path costs move_overhead seconds (separation height, start and stop)
+plus distance / velocity, every PAD additionally contact_time seconds for lowering to contact height.
+Calibrate it with the timings of a run (cwafer.StepTimings) to compare paths in seconds.
+"""
+class TravelModel:
+
+    def __init__(self, *, velocity=1000.0, move_overhead=0.6, contact_time=0.3):
+        self.velocity = velocity            # um/s
+        self.move_overhead = move_overhead  # s per point
+        self.contact_time = contact_time    # s per PAD
+
+    def key(self):
+        return (self.velocity, self.move_overhead, self.contact_time)
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+# length of the path in um, start is the position before the first point (None: the path starts at its first point)
+def path_length(path, *, start=None):
+    points = ([start] if start is not None else []) + [point[:2] for point in path]
+    return sum(_distance(a, b) for a, b in zip(points, points[1:]))
+
+
+def estimate_travel_time(path, *, model=None, start=None):
+    model = model if model is not None else TravelModel()
+    pads = sum(1 for point in path if point[2] == "PAD")
+    return len(path) * model.move_overhead + pads * model.contact_time + path_length(path, start=start) / model.velocity
+
+
+# order of the points that visits all of them on the shortest way from start to end (both fixed, not part of the result)
+# end=None leaves the end of the way open
+# up to 7 points are solved exactly, more with nearest neighbour + 2-opt
+def _shortest_order(points, *, start, end):
+    def length(order):
+        route = [start] + [points[i][:2] for i in order] + ([end] if end is not None else [])
+        return sum(_distance(a, b) for a, b in zip(route, route[1:]))
+
+    if len(points) <= 7:
+        return list(min(itertools.permutations(range(len(points))), key=length))
+
+    order, remaining, position = [], set(range(len(points))), start
+    while remaining:
+        nearest = min(remaining, key=lambda i: _distance(position, points[i][:2]))
+        order.append(nearest)
+        remaining.remove(nearest)
+        position = points[nearest][:2]
+    best = length(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                candidate_length = length(candidate)
+                if candidate_length < best - 1e-9:
+                    order, best, improved = candidate, candidate_length, True
+    return order
+
+
+# returns the path with the PADs in the order with the shortest travel
+# keep_waypoints=True: the "PATH" waypoints stay where they are, only the PADs between two waypoints are reordered
+# keep_waypoints=False: only the first and the last waypoint are kept, all PADs are visited in one go
+# reach=((x_min, x_max), (y_min, y_max)): the positions the probe can reach, a ValueError is raised for points outside
+def optimize_path(path, *, keep_waypoints=True, reach=None):
+    if reach is not None:
+        for point in path:
+            if not (reach[0][0] <= point[0] <= reach[0][1] and reach[1][0] <= point[1] <= reach[1][1]):
+                raise ValueError(f"Point {point} is out of reach of the probe {reach}")
+    waypoints = [i for i, point in enumerate(path) if point[2] != "PAD"]
+    if not waypoints:
+        return tuple(path)
+    if not keep_waypoints:
+        first, last = waypoints[0], waypoints[-1]
+        pads = [point for point in path if point[2] == "PAD"]
+        order = _shortest_order(pads, start=path[first][:2], end=path[last][:2])
+        return tuple(path[:first + 1]) + tuple(pads[i] for i in order) + tuple(path[last:])
+    result = list(path[:waypoints[0] + 1])
+    for begin, end in zip(waypoints, waypoints[1:] + [len(path)]):
+        group = list(path[begin + 1:end])
+        exit_point = path[end][:2] if end < len(path) else path[begin][:2]
+        order = _shortest_order(group, start=path[begin][:2], end=exit_point)
+        result += [group[i] for i in order]
+        if end < len(path):
+            result.append(path[end])
+    return tuple(result)
+
 
 class PLib:
     """
@@ -79,14 +172,45 @@ class PLib:
             (150, 416, "PATH")
             )
 
+    # optimized paths of every diode configuration: (path name, keep_waypoints, reach) -> path
+    _optimized_paths = {}
+
     def __init__(self):
         pass
 
-    def find_path(self, *, msgServer, extra="", logger):
+    def path_names(self):
+        return [name for name in dir(self) if name.startswith("p_") and all(isinstance(point, tuple) for point in getattr(self, name))]
+
+    def optimized_path(self, *, path_name, keep_waypoints=True, reach=None):
+        """
+        This method returns the path with the shortest travel of the probe (see optimize_path).
+        The result is cached for every diode configuration.
+        """
+        key = (path_name, keep_waypoints, reach)
+        if key not in PLib._optimized_paths:
+            PLib._optimized_paths[key] = optimize_path(getattr(self, path_name), keep_waypoints=keep_waypoints, reach=reach)
+        return PLib._optimized_paths[key]
+
+    def compare_paths(self, *, model=None, keep_waypoints=True, reach=None):
+        """
+        This method compares the hand written and the optimized paths of all diode configurations.
+        Returns {path name: {"length": (hand written, optimized) in um, "time": (hand written, optimized) in s}}
+        """
+        comparison = {}
+        for name in self.path_names():
+            path = getattr(self, name)
+            optimized = self.optimized_path(path_name=name, keep_waypoints=keep_waypoints, reach=reach)
+            comparison[name] = {"length": (path_length(path), path_length(optimized)),
+                                "time": (estimate_travel_time(path, model=model), estimate_travel_time(optimized, model=model))}
+        return comparison
+
+    def find_path(self, *, msgServer, extra="", logger, optimized=False, keep_waypoints=True):
         """
         This method returns the path corresponding to the given path name.
         extra is a placeholder for future configurations where the static prober's positions 
         might change. It is currently not used.
+        With optimized=True the PADs are visited in the order with the shortest travel,
+        keep_waypoints=False also drops the waypoints between the groups of PADs (see optimize_path).
 
         """
         response = msgServer.sendSciCommand("ReadMapPosition2")
@@ -104,8 +228,9 @@ class PLib:
 
         path_name = f"p_{self.dieNr_to_type[int(current_subdie) - 1]}{extra}"
         if hasattr(self, path_name):
-            logger.path(f"Path found: {path_name}: {getattr(self, path_name)}")
-            return getattr(self, path_name)
+            path = self.optimized_path(path_name=path_name, keep_waypoints=keep_waypoints) if optimized else getattr(self, path_name)
+            logger.path(f"Path found: {path_name}{' (optimized)' if optimized else ''}: {path}")
+            return path
         else:
             raise ValueError(f"Path '{path_name}' not found in PathLibrary.")
     
@@ -146,3 +271,193 @@ class PLib:
 
 
         
+
+
+# "3 h 05 min" for a duration in seconds
+def format_duration(seconds):
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f"{max(seconds, 0):.0f} s" if seconds < 60 else f"{minutes} min"
+    return f"{minutes // 60} h {minutes % 60:02d} min"
+
+
+def _values(response):
+    return response.split() if isinstance(response, str) else response
+
+
+"""
+Order in which the chuck visits the dies and subdies of the wafer map, used instead of the sequential "StepNextDie".
+dies are the (column, row) of the selected dies in the order of the wafer map,
+sites the (subdie number, x, y) of the subdie table, x and y in um relative to the die,
+die_size the (width, height) of a die in um.
+mode:
+    "map"         keeps the order of the wafer map
+    "serpentine"  row by row, every other row from right to left
+    "shortest"    the order with the shortest chuck travel, starting at the first die of the map
+group_by:
+    None          the subdies of a die are visited in the order with the shortest chuck travel
+    "die"         the subdies of a die are grouped by their diode configuration (PLib.dieNr_to_type),
+                  every other die visits the groups in reverse order, so consecutive subdies share the configuration
+    "wafer"       all subdies of one configuration are measured on the whole wafer before the next configuration
+The subdie numbers are the ones reported by "ReadMapPosition2", so they index PLib.dieNr_to_type like in find_path.
+"""
+class WaferPlan:
+
+    MODES = ("map", "serpentine", "shortest")
+    GROUPS = (None, "die", "wafer")
+
+    def __init__(self, *, dies, sites, die_size=(10000.0, 10000.0), mode="serpentine", group_by="die"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown wafer plan mode '{mode}', expected one of {self.MODES}")
+        if group_by not in self.GROUPS:
+            raise ValueError(f"Unknown wafer plan grouping '{group_by}', expected one of {self.GROUPS}")
+        self.dies = [tuple(die) for die in dies]
+        self.sites = [tuple(site) for site in sites]
+        self.die_size = die_size
+        self.mode = mode
+        self.group_by = group_by
+        self.visits = self._plan()      # [(column, row, subdie), ...]
+        self.position = 0               # index of the next visit
+        self.finished = False           # set by step() at the end of the plan
+
+    @classmethod
+    def from_prober(cls, *, msgServer, logger, mode="serpentine", group_by="die"):
+        """
+        This method reads the selected dies, the subdie table and the die size from the wafer map of the prober.
+        Returns None if the wafer map cannot be read.
+        """
+        try:
+            count = int(_values(msgServer.sendSciCommand("GetNumSelectedDies"))[0])
+            dies = []
+            for die in range(1, count + 1):     # the selected dies are numbered from 1
+                response = _values(msgServer.sendSciCommand("GetSelectedDieCoords", die))
+                dies.append((int(response[0]), int(response[1])))
+            site_count = int(_values(msgServer.sendSciCommand("GetDieInfo", 1))[0])
+            sites = []
+            for site in range(site_count):      # the subdie table is numbered from 0
+                response = _values(msgServer.sendSciCommand("GetSubDieData", site))
+                sites.append((int(response[0]), float(response[1]), float(response[2])))
+            response = _values(msgServer.sendSciCommand("GetWaferMapParams"))
+            die_size = (float(response[1]), float(response[2]))
+        except Exception as e:
+            logger.error(f"Could not read the wafer map: {e}")
+            return None
+        plan = cls(dies=dies, sites=sites, die_size=die_size, mode=mode, group_by=group_by)
+        logger.waferprober(f"Wafer plan ({mode}, grouped by {group_by}): {len(dies)} dies with {len(sites)} subdies, {len(plan)} steps")
+        return plan
+
+    def __len__(self):
+        return len(self.visits)
+
+    def __iter__(self):
+        return iter(self.visits)
+
+    def _die_position(self, die):
+        return (die[0] * self.die_size[0], die[1] * self.die_size[1])
+
+    def _chuck_position(self, visit):
+        site = self._site_by_number[visit[2]]
+        die_x, die_y = self._die_position(visit)
+        return (die_x + site[1], die_y + site[2])
+
+    def _site_type(self, site):
+        index = site[0] - 1
+        return PLib.dieNr_to_type[index] if 0 <= index < len(PLib.dieNr_to_type) else None
+
+    def _order_dies(self, dies):
+        if self.mode == "serpentine":
+            rows = sorted({die[1] for die in dies})
+            ordered = []
+            for number, row in enumerate(rows):
+                ordered += sorted((die for die in dies if die[1] == row), key=lambda die: die[0], reverse=number % 2 == 1)
+            return ordered
+        if self.mode == "shortest" and dies:
+            points = [self._die_position(die) for die in dies]
+            return [dies[i] for i in _shortest_order(points, start=points[0], end=None)]
+        return list(dies)
+
+    # the subdies in the order with the shortest chuck travel inside the die, starting next to position
+    def _order_sites(self, sites, *, position):
+        points = [site[1:] for site in sites]
+        return [sites[i] for i in _shortest_order(points, start=position, end=None)]
+
+    def _groups(self):
+        groups = {}
+        for site in self.sites:
+            groups.setdefault(self._site_type(site), []).append(site)
+        return list(groups.values())
+
+    def _plan(self):
+        self._site_by_number = {site[0]: site for site in self.sites}
+        dies = self._order_dies(self.dies)
+        visits = []
+        if self.group_by == "wafer":
+            for number, group in enumerate(self._groups()):
+                position = (0.0, 0.0)
+                for die in (dies if number % 2 == 0 else dies[::-1]):
+                    for site in self._order_sites(group, position=position):
+                        visits.append((die[0], die[1], site[0]))
+                        position = site[1:]
+            return visits
+        groups = self._groups() if self.group_by == "die" else [self.sites]
+        position = (0.0, 0.0)
+        for number, die in enumerate(dies):
+            for group in (groups if number % 2 == 0 else groups[::-1]):
+                for site in self._order_sites(group, position=position):
+                    visits.append((die[0], die[1], site[0]))
+                    position = site[1:]
+        return visits
+
+    def chuck_distance(self):
+        points = [self._chuck_position(visit) for visit in self.visits]
+        return sum(_distance(a, b) for a, b in zip(points, points[1:]))
+
+    def estimate(self, *, measurement_time=0.0, measurements_per_diode=1, model=None, chuck_velocity=10000.0, step_overhead=1.0,
+                 extra="", optimized=False, keep_waypoints=True):
+        """
+        This method estimates the duration of the whole run in s.
+        Every step costs step_overhead s plus the chuck travel / chuck_velocity (um/s),
+        every subdie the probe path of its configuration (estimate_travel_time with model)
+        and every diode measurements_per_diode * measurement_time.
+        Returns {"steps", "chuck_distance", "chuck_time", "probe_time", "measurement_time", "total"}
+        """
+        library = PLib()
+        probe_time = diode_time = 0.0
+        for visit in self.visits:
+            path_name = f"p_{self._site_type(self._site_by_number[visit[2]])}{extra}"
+            if not hasattr(library, path_name):
+                continue
+            path = library.optimized_path(path_name=path_name, keep_waypoints=keep_waypoints) if optimized else getattr(library, path_name)
+            probe_time += estimate_travel_time(path, model=model)
+            diode_time += sum(1 for point in path if point[2] == "PAD") * measurements_per_diode * measurement_time
+        distance = self.chuck_distance()
+        chuck_time = len(self.visits) * step_overhead + distance / chuck_velocity
+        return {"steps": len(self.visits), "chuck_distance": distance, "chuck_time": chuck_time, "probe_time": probe_time,
+                "measurement_time": diode_time, "total": chuck_time + probe_time + diode_time}
+
+    def skip(self, positions):
+        """
+        This method removes the visits of positions [(column, row, subdie), ...] from the plan,
+        e.g. the subdies an interrupted run already measured.
+        """
+        done = {tuple(int(value) for value in position) for position in positions}
+        self.visits = [visit for visit in self.visits if visit not in done]
+
+    def step(self, *, msgServer, logger):
+        """
+        This method steps the chuck to the next die and subdie of the plan, it replaces cwafer.SubdieStepper.step.
+        Returns False at the end of the plan (finished is set) or if the step failed.
+        """
+        if self.position >= len(self.visits):
+            self.finished = True
+            logger.waferprober("End of wafer plan reached. Exiting....")
+            return False
+        column, row, site = self.visits[self.position]
+        self.position += 1
+        try:
+            response = msgServer.sendSciCommand("StepNextDie", column, row, site)
+        except Exception as e:
+            logger.critical(f"Error stepping to die {column} {row} subdie {site}: {e}")
+            return False
+        logger.waferprober(f"Stepped to die {column} {row} subdie {site} ({self.position} of {len(self.visits)}): {response}")
+        return True
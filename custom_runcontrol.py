@@ -0,0 +1,377 @@
+'''
+
+    Philipp Bartz 2025
+
+    This file is part of the Velox project.
+
+    Run control of the waferprober: the state of activate.txt (run, pause, stop) is kept in memory
+    and updated by a watcher thread, so the measurement loop does not read the file on every step.
+    The state can also be changed over a local socket:
+
+        python custom_runcontrol.py pause|resume|stop|status [--port 1420] [--file activate.txt]
+
+'''
+
+# #####       Version 1.0       #####
+
+
+import os
+import errno
+import select
+import socket
+import struct
+import logging
+import argparse
+import threading
+import time
+import ctypes
+import ctypes.util
+
+
+RUNNING = "running"
+PAUSED = "paused"
+STOPPED = "stopped"
+
+# first line written to the control file for every state, parse_state() reads them back
+STATE_LINES = {RUNNING: "True", PAUSED: "Pause", STOPPED: "False"}
+COMMANDS = {"pause": PAUSED, "resume": RUNNING, "run": RUNNING, "stop": STOPPED}
+DEFAULT_PORT = 1420
+
+# inotify events of a directory that can change a watched file (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+_EVENT = struct.Struct("iIII")
+
+
+# state of the contents of activate.txt, like the old is_running(): "True" runs, "Pause" pauses, everything else stops.
+# Empty contents return None: editors that save in place truncate the file first, that is no new state
+def parse_state(contents):
+    if not contents.strip():
+        return None
+    if "True" in contents:
+        return RUNNING
+    if "Pause" in contents:
+        return PAUSED
+    return STOPPED
+
+
+# replaces the first line of the control file with the line of state, the explanation below it stays
+def write_state(*, filepath, state):
+    try:
+        with open(filepath, "r") as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
+        lines = [""]
+    lines[0] = STATE_LINES[state]
+    temporary = f"{filepath}.tmp"
+    with open(temporary, "w") as f:
+        f.write("\n".join(lines))
+    os.replace(temporary, filepath)     # the watcher never sees a half written file
+
+
+'''
+    this class calls callback() after a file of a directory was written, moved or deleted.
+    names: only these file names are watched (None: every file of the directory).
+    On Linux inotify is used, otherwise (or with use_inotify=False) os.stat is compared every poll_interval seconds.
+    With inotify the callback waits until there was no event for debounce seconds, so a save is reported once, after it is complete.
+    ready is set as soon as changes are seen, mode is "inotify" or "polling".
+'''
+class DirectoryWatcher():
+
+    def __init__(self, *, directory, callback, names=None, poll_interval=0.2, use_inotify=True, debounce=0.05, logger=None):
+        self.directory = os.path.abspath(directory)
+        self.callback = callback
+        self.names = set(names) if names is not None else None
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.debounce = debounce
+        self.logger = logger if logger is not None else logging.getLogger("custom_runcontrol")
+        self.mode = None
+        self.ready = threading.Event()
+        self._closing = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch, name=f"watcher-{os.path.basename(self.directory)}", daemon=True)
+        self._thread.start()
+        self.ready.wait(timeout=2)
+        return self
+
+    def close(self):
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _watch(self):
+        if self.use_inotify:
+            try:
+                self.mode = "inotify"
+                self._watch_inotify()
+                return
+            except (OSError, AttributeError) as e:
+                self.logger.info(f"Watcher: inotify not available ({e}), polling {self.directory}")
+        self.mode = "polling"
+        self._watch_polling()
+
+    def _snapshot(self):
+        try:
+            names = self.names if self.names is not None else os.listdir(self.directory)
+        except OSError:
+            return None
+        snapshot = {}
+        for name in names:
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+                snapshot[name] = (status.st_ino, status.st_mtime_ns, status.st_size)
+            except OSError:
+                pass
+        return snapshot
+
+    def _watch_polling(self):
+        last = self._snapshot()
+        self.ready.set()
+        while not self._closing.wait(self.poll_interval):
+            current = self._snapshot()
+            if current != last:
+                last = current
+                self.callback()
+
+    def _watch_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            # no IN_MODIFY: a file that is saved in place is reported when it is closed, not when it is truncated
+            mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {self.directory}")
+            names = {os.fsencode(name) for name in self.names} if self.names is not None else None
+            self.ready.set()
+            pending = False
+            while not self._closing.is_set():
+                ready, _, _ = select.select([fd], [], [], self.debounce if pending else 0.5)
+                if not ready:
+                    if pending:
+                        pending = False
+                        self.callback()
+                    continue
+                try:
+                    data = os.read(fd, 4096)
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        continue
+                    raise
+                changed, offset = False, 0
+                while offset < len(data):
+                    _, _, _, length = _EVENT.unpack_from(data, offset)
+                    offset += _EVENT.size
+                    changed = changed or names is None or data[offset:offset + length].rstrip(b"\0") in names
+                    offset += length
+                pending = pending or changed
+        finally:
+            os.close(fd)
+
+
+'''
+    this class keeps the run state of activate.txt in memory.
+    - a DirectoryWatcher reloads the file when it changes: with inotify on Linux, otherwise by comparing os.stat every poll_interval seconds
+    - with a port, a server thread on 127.0.0.1 accepts the commands pause, resume, stop and status (one line per connection),
+      a command changes the state immediately and is written to the file, so it is kept after a restart
+    - running is the cheap check for the measurement loop, is_running() waits while paused
+      and returns as soon as the state changes (no sleeping in 60 s blocks)
+    Use get_run_control() for one started instance per file, so rerunning a notebook cell does not start a second watcher.
+'''
+class RunControl():
+
+    def __init__(self, *, filepath="activate.txt", port=None, poll_interval=0.2, use_inotify=True, logger=None):
+        self.filepath = os.path.abspath(filepath)
+        self.port = port
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.logger = logger if logger is not None else logging.getLogger("custom_runcontrol")
+        self.state = STOPPED
+        self.reason = "not started"
+        self.reloads = 0
+        self._condition = threading.Condition()
+        self._closing = threading.Event()
+        self._watcher = None
+        self._thread = None
+        self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def running(self):
+        return self.state == RUNNING
+
+    @property
+    def watch_mode(self):
+        return self._watcher.mode if self._watcher is not None else None
+
+    def start(self):
+        directory, name = os.path.split(self.filepath)
+        self._watcher = DirectoryWatcher(directory=directory, names=[name], callback=self.reload, poll_interval=self.poll_interval,
+                                         use_inotify=self.use_inotify, logger=self.logger).start()
+        self.reload()   # after the watcher started, so no change is missed
+        if self.port is not None:
+            try:
+                self._server = socket.create_server(("127.0.0.1", self.port))
+            except OSError as e:
+                self.logger.error(f"Run control: cannot listen on port {self.port}: {e}")
+            else:
+                self._server.settimeout(0.5)
+                self._thread = threading.Thread(target=self._serve, name="runcontrol-server", daemon=True)
+                self._thread.start()
+        return self
+
+    def close(self):
+        self._closing.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._watcher is not None:
+            self._watcher.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    def set_state(self, state, *, reason=""):
+        with self._condition:
+            changed = state != self.state
+            self.state, self.reason = state, reason
+            self._condition.notify_all()
+        if changed:
+            self.logger.warning(f"Run control: {state} ({reason})")
+        return changed
+
+    # reads the control file, a missing or unreadable file stops the program like before, an empty one keeps the state
+    def reload(self):
+        self.reloads += 1
+        try:
+            with open(self.filepath, "r") as f:
+                contents = f.read()
+            state = parse_state(contents)
+            reason = os.path.basename(self.filepath)
+        except FileNotFoundError:
+            state, reason = STOPPED, f"File not found: {self.filepath}"
+        except Exception as e:
+            state, reason = STOPPED, f"Error reading {self.filepath}: {e}"
+        if state is None:
+            return self.state
+        self.set_state(state, reason=reason)
+        return state
+
+    def command(self, name):
+        """
+        This method applies a command (pause, resume, stop, status) and returns the new state.
+        pause, resume and stop are also written to the control file.
+        """
+        if name == "status":
+            return self.state
+        state = COMMANDS[name]
+        self.set_state(state, reason=f"command {name}")
+        try:
+            write_state(filepath=self.filepath, state=state)
+        except OSError as e:
+            self.logger.error(f"Run control: cannot write {self.filepath}: {e}")
+        return state
+
+    def wait(self, *, timeout=None):
+        """
+        This method blocks while the program is paused.
+        Returns the state after the pause (or after timeout seconds).
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.state != PAUSED or self._closing.is_set(), timeout=timeout)
+            return self.state
+
+    def is_running(self, *, logger=None):
+        """
+        This method replaces the old is_running() of the notebook.
+        Returns True if the program should continue running, while paused it waits until it is resumed or stopped.
+        """
+        logger = logger if logger is not None else self.logger
+        state = self.state
+        if state == PAUSED:
+            logger.warning("activate.txt contains 'Pause'. Stopping the program temporarily.")
+            print("is_running: Pause")
+            state = self.wait()
+            if state != PAUSED and not self._closing.is_set():
+                # the state that ended the pause is read again, a save that was still in progress must not stop the run
+                time.sleep(0.05)
+                state = self.reload()
+        if state == RUNNING:
+            return True
+        logger.critical(f"activate.txt does not contain 'True'. Stopping the program. ({self.reason})")
+        print("is_running: False")
+        return False
+
+    ###     local socket     ###
+
+    def _serve(self):
+        while not self._closing.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with conn:
+                try:
+                    conn.settimeout(2)
+                    name = conn.recv(256).decode(errors="replace").strip().lower()
+                    answer = self.command(name) if name in COMMANDS or name == "status" else f"unknown command {name!r}"
+                    conn.sendall(f"{answer}\n".encode())
+                except OSError as e:
+                    self.logger.error(f"Run control: {e}")
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+# returns the started RunControl of filepath, the same one for every call
+def get_run_control(*, filepath="activate.txt", port=None, logger=None):
+    key = os.path.abspath(filepath)
+    with _instances_lock:
+        if key not in _instances:
+            _instances[key] = RunControl(filepath=filepath, port=port, logger=logger).start()
+        return _instances[key]
+
+
+# sends a command to a running RunControl, writes the control file directly if none is listening
+def send_command(name, *, port=DEFAULT_PORT, filepath="activate.txt", timeout=2.0):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=timeout) as conn:
+            conn.sendall(f"{name}\n".encode())
+            return conn.recv(256).decode().strip()
+    except OSError:
+        if name == "status":
+            try:
+                with open(filepath, "r") as f:
+                    return parse_state(f.read()) or STOPPED
+            except OSError:
+                return STOPPED
+        write_state(filepath=filepath, state=COMMANDS[name])
+        return COMMANDS[name]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pause, resume or stop the waferprober")
+    parser.add_argument("command", choices=sorted(COMMANDS) + ["status"])
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port of the run control of the notebook")
+    parser.add_argument("--file", default="activate.txt", help="control file, written if the notebook does not listen")
+    args = parser.parse_args()
+    print(send_command(args.command, port=args.port, filepath=args.file))
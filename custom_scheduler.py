@@ -0,0 +1,334 @@
+'''
+
+    Philipp Bartz 2025
+
+    This file is part of the Velox project.
+
+    Task scheduler of the waferprober: runs the tasks (config files) in task_list/ one after another.
+    Optional keys of a task:
+        "priority": tasks with a higher priority run first (default 0), tasks of the same priority run alphanumerically
+        "after":    names of tasks (file name without .json) that have to be finished first, e.g. ["002_60C_run"]
+    New and changed tasks are picked up as soon as they are saved (custom_runcontrol.DirectoryWatcher).
+    An interrupted task is resumed from its journal (cfile.RunJournal in task_list/progress/), measured diodes are skipped.
+    With temperature_order=True the tasks of the same priority run in the order with the shortest temperature changes
+    of the chuck ("chuck_target_temperature", see thermal_order()), and the chuck already ramps to the temperature
+    of the next task while a finished run writes its files.
+
+    In the notebook:   csched.Scheduler(run_task=main, is_running=is_running, logger=global_logger, temperature_order=True).run()
+    Show the queue:    python custom_scheduler.py [--task-dir task_list] [--temperature-order]
+
+'''
+
+# #####       Version 1.0       #####
+
+
+import os
+import re
+import json
+import time
+import heapq
+import logging
+import argparse
+import threading
+import custom_runcontrol as crun
+import custom_filehandler as cfile
+import custom_waferprober as cwafer
+
+
+FINISHED_FOLDER = "finished"
+PROGRESS_FOLDER = "progress"
+_TIMESTAMP = re.compile(r"^\d{4}_\d{2}_\d{2}-\d{2}_\d{2}_\d{2}_")     # prefix of finished tasks that ran more than once
+
+
+# name of a task file without the .json extension (and without the timestamp of the finished folder)
+def task_name(filename):
+    return _TIMESTAMP.sub("", os.path.basename(filename))[:-len(".json")]
+
+
+'''
+    this class is one config file of the task list.
+    Tasks are ordered by priority (higher first), then alphanumerically by name.
+    temperature is the chuck_target_temperature of the task, None if the config file can not be read.
+'''
+class Task():
+
+    def __init__(self, *, path, priority=0, after=(), temperature=None):
+        self.path = path
+        self.name = task_name(path)
+        self.priority = priority
+        self.after = tuple(after)
+        self.temperature = temperature
+
+    @classmethod
+    def from_file(cls, *, path, logger=None):
+        # an unreadable config file is still a task, main() reports the error when it is run
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            if logger is not None:
+                logger.warning(f"Could not read the priority of task {path}: {e}")
+            data = None
+        if isinstance(data, dict):
+            # a readable config without chuck_target_temperature runs at the default temperature of main()
+            temperature = data.get("chuck_target_temperature", cfile.SETTINGS_SCHEMA["chuck_target_temperature"].default)
+        else:
+            data = {}
+            temperature = None
+        after = data.get("after", [])
+        return cls(path=path, priority=data.get("priority", 0), after=[after] if isinstance(after, str) else after, temperature=temperature)
+
+    def key(self):
+        return (-self.priority, self.name)
+
+    def describe_temperature(self):
+        return f"{self.temperature}C" if self.temperature is not None else "unknown temperature"
+
+    def __lt__(self, other):
+        return self.key() < other.key()
+
+    def __repr__(self):
+        return f"Task({self.name!r}, priority={self.priority}, after={list(self.after)}, temperature={self.temperature})"
+
+
+# order of tasks with the shortest predicted temperature changes, starting at temperature (C, None: unknown).
+# On a line the shortest way is to go to one end first and then to the other end, both ways are predicted with
+# model (cwafer.SettleTimeModel, cooling is usually slower than heating). Tasks without a temperature come first.
+def thermal_order(tasks, *, temperature=None, model=None):
+    model = model if model is not None else cwafer.SettleTimeModel()
+    unknown = [task for task in tasks if task.temperature is None]
+    known = [task for task in tasks if task.temperature is not None]
+    ascending = lambda tasks: sorted(tasks, key=lambda task: (task.temperature, task.key()))
+    descending = lambda tasks: sorted(tasks, key=lambda task: (-task.temperature, task.key()))
+    if temperature is None:
+        routes = [ascending(known), descending(known)]
+    else:
+        # tasks at the current temperature come first in both ways
+        down = descending(task for task in known if task.temperature <= temperature) + ascending(task for task in known if task.temperature > temperature)
+        up = ascending(task for task in known if task.temperature >= temperature) + descending(task for task in known if task.temperature < temperature)
+        routes = [down, up]
+
+    def duration(route):
+        total, current = 0.0, temperature
+        for task in route:
+            if current is not None:
+                total += model.predict(start=current, target=task.temperature)
+            current = task.temperature
+        return total
+
+    return unknown + min(routes, key=duration)
+
+
+'''
+    this class is the priority queue (heapq) of the waiting tasks.
+    pop_ready() returns the first task whose dependencies are finished, the blocked ones stay in the queue.
+'''
+class TaskQueue():
+
+    def __init__(self, tasks=()):
+        self._heap = list(tasks)
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, task):
+        heapq.heappush(self._heap, task)
+
+    def ordered(self):
+        return sorted(self._heap)
+
+    # dependencies of task that are not finished, unknown ones are neither finished nor waiting
+    def missing(self, task, *, finished):
+        waiting = {other.name for other in self._heap}
+        return [name for name in task.after if name not in finished], [name for name in task.after if name not in finished and name not in waiting]
+
+    # order(tasks) chooses among the ready tasks of the highest priority (e.g. thermal_order), without it the first by name is used
+    def pop_ready(self, *, finished, order=None):
+        blocked, ready = [], []
+        while self._heap:
+            if ready and (order is None or self._heap[0].priority != ready[0].priority):
+                break
+            task = heapq.heappop(self._heap)
+            (ready if all(name in finished for name in task.after) else blocked).append(task)
+        if not ready:
+            chosen = None
+        else:
+            chosen = order(ready)[0] if order is not None else ready[0]
+            blocked += [task for task in ready if task is not chosen]
+        for task in blocked:
+            heapq.heappush(self._heap, task)
+        return chosen
+
+
+'''
+    this class runs the tasks of task_dir until is_running() returns False.
+    - run_task(path_to_config_file=..., journal_file=..., next_temperature=...) runs one task (main() of the notebook),
+      next_temperature() returns the chuck temperature of the task that would run next (None: no task)
+    - a task is finished when run_task returns True: its config file is moved to task_dir/finished (with a timestamp if the name exists).
+      Otherwise (stopped, lost connection, error or an exception of run_task) it stays in the task list with its journal and is resumed the next time,
+      while the scheduler keeps running the task is held back for retry_delay seconds (or until its file is saved)
+    - while there is no task to run, it waits for a change of task_dir instead of listing it every 20 s
+    - with temperature_order the ready tasks of the same priority are ordered by thermal_order(), starting at the
+      temperature of the last task, the predicted settle time of every change is logged (settle_model)
+'''
+class Scheduler():
+
+    def __init__(self, *, run_task, is_running, logger, task_dir="task_list", start_delay=3, use_inotify=True,
+                 temperature_order=False, settle_model=None, retry_delay=600):
+        self.run_task = run_task
+        self.is_running = is_running
+        self.logger = logger
+        self.task_dir = task_dir
+        self.start_delay = start_delay
+        self.use_inotify = use_inotify
+        self.temperature_order = temperature_order
+        self.settle_model = settle_model if settle_model is not None else cwafer.SettleTimeModel(filepath=cwafer.SETTLE_TIMES_FILE)
+        self.temperature = None     # chuck temperature of the last task
+        self.retry_delay = retry_delay
+        self._held = {}             # name of a task that did not complete -> (time until it is held back, mtime of its file)
+        self.changed = threading.Event()
+        self._reported = None       # the last "waiting" message, it is only logged when it changes
+
+    def tasks(self):
+        names = sorted(name for name in os.listdir(self.task_dir) if name.endswith(".json"))
+        return [Task.from_file(path=os.path.join(self.task_dir, name), logger=self.logger) for name in names]
+
+    def _mtime(self, task):
+        try:
+            return os.stat(task.path).st_mtime_ns
+        except OSError:
+            return None
+
+    # True if the task did not complete a short time ago and its file was not saved since
+    def held(self, task):
+        if task.name not in self._held:
+            return False
+        until, mtime = self._held[task.name]
+        if time.time() >= until or self._mtime(task) != mtime:
+            del self._held[task.name]
+            return False
+        return True
+
+    def hold(self, task):
+        self._held[task.name] = (time.time() + self.retry_delay, self._mtime(task))
+
+    def finished(self):
+        folder = os.path.join(self.task_dir, FINISHED_FOLDER)
+        return {task_name(name) for name in os.listdir(folder) if name.endswith(".json")} if os.path.isdir(folder) else set()
+
+    def journal_file(self, task):
+        return os.path.join(self.task_dir, PROGRESS_FOLDER, f"{task.name}.jsonl")
+
+    def _order(self, temperature):
+        if not self.temperature_order:
+            return None
+        return lambda tasks: thermal_order(tasks, temperature=temperature, model=self.settle_model)
+
+    # chuck temperature of the task that runs after task, None if there is none
+    def next_temperature(self, *, after):
+        tasks = [task for task in self.tasks() if task.name != after.name]
+        task = TaskQueue(tasks).pop_ready(finished=self.finished() | {after.name}, order=self._order(after.temperature))
+        return task.temperature if task is not None else None
+
+    def next_task(self):
+        tasks = self.tasks()
+        held = [task for task in tasks if self.held(task)]
+        queue = TaskQueue([task for task in tasks if task not in held])
+        finished = self.finished()
+        task = queue.pop_ready(finished=finished, order=self._order(self.temperature))
+        if task is None:
+            blocked = []
+            for waiting in queue.ordered():
+                missing, unknown = queue.missing(waiting, finished=finished)
+                blocked.append(f"{waiting.name} waits for {', '.join(missing)}{' (unknown)' if unknown else ''}")
+            blocked += [f"{task.name} is retried later" for task in held]
+            self._report("; ".join(blocked) if blocked else "No tasks found in task_list folder, waiting for new tasks.")
+        return task
+
+    def _report(self, message):
+        if message != self._reported:
+            self._reported = message
+            self.logger.info(message)
+
+    def finish(self, task):
+        folder = os.path.join(self.task_dir, FINISHED_FOLDER)
+        os.makedirs(folder, exist_ok=True)
+        filename = os.path.basename(task.path)
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path):
+            self.logger.warning(f"File {filename} already exists in finished folder, timestamping current file.")
+            path = os.path.join(folder, f"{time.strftime('%Y_%m_%d-%H_%M_%S')}_{filename}")
+        self.logger.info(f"Moving {task.path} to {path}")
+        os.rename(task.path, path)
+        cfile.RunJournal(filepath=self.journal_file(task)).clear()
+
+    def run(self):
+        os.makedirs(os.path.join(self.task_dir, FINISHED_FOLDER), exist_ok=True)
+        watcher = crun.DirectoryWatcher(directory=self.task_dir, callback=self.changed.set, use_inotify=self.use_inotify,
+                                        poll_interval=1.0, logger=self.logger).start()
+        try:
+            while self.is_running(logger=self.logger):
+                self.changed.clear()
+                task = self.next_task()
+                if task is None:
+                    # wakes up for a new task at once, and every second for the run control and the held back tasks
+                    while not self.changed.wait(timeout=1.0):
+                        if not self.is_running(logger=self.logger):
+                            return
+                        if any(time.time() >= until for until, _ in self._held.values()):
+                            break
+                    continue
+                self._reported = None
+                journal_file = self.journal_file(task)
+                resumed = " (resuming)" if os.path.isfile(journal_file) else ""
+                self.logger.info(f"Starting task {task.name} (priority {task.priority}, {task.describe_temperature()}){resumed}")
+                if self.temperature is not None and task.temperature is not None:
+                    predicted = self.settle_model.predict(start=self.temperature, target=task.temperature)
+                    self.logger.info(f"Temperature change {self.temperature}C -> {task.temperature}C, predicted {predicted / 60:.1f} min")
+                time.sleep(self.start_delay)
+                try:
+                    completed = self.run_task(path_to_config_file=task.path, journal_file=journal_file,
+                                              next_temperature=lambda: self.next_temperature(after=task))
+                except Exception as e:
+                    # one failing task must not stop the others, it keeps its journal and is resumed later
+                    self.logger.exception(f"Task {task.name} failed: {e!r}")
+                    completed = False
+                self.temperature = task.temperature if task.temperature is not None else self.temperature
+                if completed is True:
+                    self.finish(task)
+                elif self.is_running(logger=self.logger):
+                    self.logger.error(f"Task {task.name} did not complete, it stays in the task list and is resumed in {self.retry_delay} s.")
+                    self.hold(task)
+        finally:
+            watcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the order of the waferprober tasks")
+    parser.add_argument("--task-dir", default="task_list")
+    parser.add_argument("--temperature-order", action="store_true", help="order the tasks of the same priority by temperature")
+    parser.add_argument("--temperature", type=float, default=None, help="current chuck temperature in C")
+    args = parser.parse_args()
+    scheduler = Scheduler(run_task=None, is_running=None, logger=logging.getLogger("custom_scheduler"), task_dir=args.task_dir,
+                          temperature_order=args.temperature_order)
+    queue, finished = TaskQueue(scheduler.tasks()), scheduler.finished()
+    number, temperature, total = 1, args.temperature, 0.0
+    while True:
+        task = queue.pop_ready(finished=finished, order=scheduler._order(temperature))
+        if task is None:
+            break
+        resumed = " (resumes)" if os.path.isfile(scheduler.journal_file(task)) else ""
+        settle = ""
+        if temperature is not None and task.temperature is not None:
+            predicted = scheduler.settle_model.predict(start=temperature, target=task.temperature)
+            total += predicted
+            settle = f", settles in {predicted / 60:.1f} min"
+        print(f"{number:3d}. {task.name}  priority {task.priority}, {task.describe_temperature()}{settle}{resumed}")
+        temperature = task.temperature if task.temperature is not None else temperature
+        finished.add(task.name)
+        number += 1
+    print(f"predicted temperature changes: {total / 60:.1f} min")
+    for task in queue.ordered():
+        missing, unknown = queue.missing(task, finished=finished)
+        print(f"  -  {task.name} is blocked by {', '.join(missing)}{' (unknown)' if unknown else ''}")
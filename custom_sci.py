@@ -0,0 +1,641 @@
+'''
+
+    Philipp Bartz 2025
+
+    This file is part of the Velox project.
+
+    Clients for the Velox Message Server that do not use the module globals of velox.MessageServerInterface,
+    so several connections (and several commands per connection) are possible.
+
+'''
+
+# #####       Version 1.0       #####
+
+
+import os
+import re
+import sys
+import inspect
+import socket
+import asyncio
+import logging
+import collections
+from velox.vxmessageserver import SciException
+
+
+REGISTRATION_MESSAGE_TEMPLATE = "Fcn=1:RegisterProberApp:{0} {0} 0\n"
+GET_ALL_COMMANDS_MESSAGE = "Fcn=1:GetCommands:\n"
+MAX_COMMAND_ID = 999
+MAX_LINE_LENGTH = 1 << 20     # the answer to GetCommands is the longest message
+
+# timeouts in ms of the SCI commands used in this project (from "Command Timeout" in velox/sci35.py)
+COMMAND_TIMEOUTS = {"ReportKernelVersion": 5000,
+                    "RegisterProberAppChange": 5000,
+                    "ReadProberStatus": 5000,
+                    "SetHeaterTemp": 60000,
+                    "GetHeaterTemp": 60000,
+                    "EnableMotorQuiet": 10000,
+                    "SetCameraQuiet": 30000,
+                    "SetChuckMode": 5000,
+                    "SetProbeMode": 5000,
+                    "SetScopeMode": 5000,
+                    "SetMicroLight": 5000,
+                    "SetProbeHome": 5000,
+                    "ReadMapPosition2": 10000,
+                    "StepFirstDie": 6000000,
+                    "StepNextDie": 6000000,
+                    "MoveProbe": 30000,
+                    "MoveProbeContact": 30000,
+                    "MoveProbeSeparation": 30000,
+                    "ReadProbePosition": 5000,
+                    }
+
+
+_RESPONSE = re.compile(r"(?:Rsp|Cmd)=(\d+):(-?\d+):?(.*)", re.DOTALL)
+_VALUE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+# splits the return values of a response like velox does: separated by spaces, "quoted strings" stay together
+def parse_values(valueString):
+    if '"' not in valueString:
+        return valueString.split()
+    return [quoted.strip() if quoted or not plain else plain for quoted, plain in _VALUE.findall(valueString)]
+
+
+# splits a response line "Rsp=<ID>:<Return Code>:<Return Value>" into (ID, code, values)
+# for errors (code != 0) the values are the error description
+def parse_response(line):
+    match = _RESPONSE.match(line.rstrip("\r\n\0"))
+    if match is None:
+        raise ValueError(f"Not a response: {line!r}")
+    message_id, code, values = match.groups()
+    return int(message_id), int(code), parse_values(values)
+
+
+'''
+    this class is the base of the typed responses of the SCI commands (see RESPONSE_TYPES).
+    The fields are __slots__ and converted once when the response arrives, e.g. ReadMapPosition2(...).DieX is an int.
+    Indexing, len(), iteration, "in" and == work on the original strings like the list velox returns,
+    so code written for velox (e.g. int(response[4])) does not change.
+    Field types: int, float (velox uses Decimal), str, and "rest" for the remaining values joined by spaces.
+'''
+class SciResponse():
+
+    __slots__ = ("values",)
+    FIELDS = ()
+
+    def __init__(self, values):
+        self.values = values
+        for index, (name, convert) in enumerate(self.FIELDS):
+            if convert == "rest":
+                value = " ".join(values[index:])
+            elif index < len(values):
+                try:
+                    value = convert(values[index])
+                except ValueError:
+                    value = values[index]
+            else:
+                value = None
+            setattr(self, name, value)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __contains__(self, item):
+        return item in self.values
+
+    def __eq__(self, other):
+        if isinstance(other, SciResponse):
+            other = other.values
+        return self.values == other
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name, _ in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name, _ in self.FIELDS}
+
+
+# creates the response class of one SCI command
+def response_type(commandName, fields):
+    names = tuple(name for name, _ in fields)
+    return type(commandName, (SciResponse,), {"__slots__": names, "FIELDS": tuple(fields)})
+
+
+# typed responses of the SCI commands used in this project (fields from velox/sci35.py)
+RESPONSE_TYPES = {name: response_type(name, fields) for name, fields in {
+    "ReadMapPosition2": (("DieX", int), ("DieY", int), ("XFromHome", float), ("YFromHome", float), ("CurSite", int),
+                         ("LastSiteIndex", int), ("CurDie", int), ("DiesCount", int), ("CurCluster", int), ("ClustersCount", int)),
+    "GetHeaterTemp": (("RespTemperature", float), ("RespUnit", str), ("Status", "rest")),
+    "SetHeaterTemp": (("RespTemperature", float), ("RespUnit", "rest")),
+    "ReadProberStatus": (("FlagsBusy", int), ("FlagsContact", int), ("Mode", str), ("IsQuiet", int)),
+    "StepFirstDie": (("DieX", int), ("DieY", int), ("CurSite", int), ("LastSiteIndex", int)),
+    "StepNextDie": (("RDieX", int), ("RDieY", int), ("CurSite", int), ("LastSiteIndex", int)),
+    "ReadProbePosition": (("ProbeEcho", int), ("X", float), ("Y", float), ("Z", float)),
+    "ReportKernelVersion": (("Version", float), ("Description", "rest")),
+    "MoveProbe": (("ProbeEcho", int),),
+    "MoveProbeContact": (("ProbeEcho", int),),
+    "MoveProbeSeparation": (("ProbeEcho", int),),
+    }.items()}
+
+
+# returns the typed response if there is one for the command, otherwise the list of values
+def make_response(commandName, values):
+    response_class = RESPONSE_TYPES.get(commandName)
+    return values if response_class is None else response_class(values)
+
+
+COMMAND_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sci_commands.tsv")
+_TYPES = {"int": int, "Decimal": float, "str": str}
+_command_table = None
+
+
+'''
+    one row of the command table: the SCI command with its timeout (ms), arguments and return values.
+    args and returns are kept as the strings of the table ("Name:type,...") until the command is used.
+'''
+class SciCommandSpec():
+
+    __slots__ = ("name", "timeout", "args", "returns")
+
+    def __init__(self, name, timeout, args="", returns=""):
+        self.name = name
+        self.timeout = int(timeout)
+        self.args = args
+        self.returns = returns
+
+    @staticmethod
+    def split_fields(fields):
+        return [tuple(field.split(":", 1)) for field in fields.split(",") if field]
+
+    def row(self):
+        return f"{self.name}\t{self.timeout}\t{self.args}\t{self.returns}\n"
+
+
+# returns the command table {name: SciCommandSpec}, it is read from filepath on first use
+def command_table(*, filepath=None):
+    global _command_table
+    if filepath is None and _command_table is not None:
+        return _command_table
+    table = {}
+    with open(filepath or COMMAND_TABLE_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            spec = SciCommandSpec(*line.rstrip("\n").split("\t"))
+            table[spec.name] = spec
+    if filepath is None:
+        _command_table = table
+    return table
+
+
+def write_command_table(*, table, filepath=COMMAND_TABLE_FILE, source=""):
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write(f"# SCI commands: name, timeout [ms], arguments, return values (generated from {source})\n")
+        for name in sorted(table):
+            f.write(table[name].row())
+
+
+# creates the command table from the generated velox module (velox/sci35.py), without importing it
+def build_command_table(*, source, filepath=COMMAND_TABLE_FILE):
+    with open(source, "r", encoding="utf-8") as f:
+        text = f.read()
+    table = {}
+    for block in re.split(r"^def ", text, flags=re.MULTILINE)[1:]:
+        match = re.match(r"(\w+)\((.*?)\):", block)
+        if match is None:
+            continue
+        name, signature = match.groups()
+        args = ",".join(re.sub(r'=.*$', "", argument.strip()) for argument in signature.split(",") if argument.strip())
+        returns = re.search(r"^    Returns:\n((?:        \w+:\w+\n)+)", block, flags=re.MULTILINE)
+        returns = ",".join(line.strip() for line in returns.group(1).splitlines()) if returns else ""
+        timeout = re.search(r"Command Timeout: (\d+)", block)
+        table[name] = SciCommandSpec(name, timeout.group(1) if timeout else 60000, args, returns)
+    write_command_table(table=table, filepath=filepath, source=os.path.basename(source))
+    return table
+
+
+# updates the timeouts of the command table and adds new commands with the list of the Velox Message Server
+# (the arguments and return values of new commands are unknown, they are sent as given and return the list of strings)
+def update_command_table(*, msgServer, filepath=COMMAND_TABLE_FILE):
+    table = command_table(filepath=filepath) if os.path.isfile(filepath) else {}
+    for command in msgServer._getcommands():
+        spec = table.get(command.name)
+        if spec is None:
+            table[command.name] = SciCommandSpec(command.name, command.timeout)
+        else:
+            spec.timeout = command.timeout
+    write_command_table(table=table, filepath=filepath, source="GetCommands")
+    return table
+
+
+# True if the sendSciCommand of msgServer has a timeout parameter (MessageServer, AsyncMessageServerInterface).
+# velox.MessageServerInterface.sendSciCommand takes **kwargs and silently drops a timeout, it waits as long as its socket does.
+# Wrappers like cwafer.PositionContext are followed to the msgServer they wrap.
+def accepts_timeout(msgServer):
+    while hasattr(msgServer, "msgServer"):
+        msgServer = msgServer.msgServer
+    try:
+        return "timeout" in inspect.signature(msgServer.sendSciCommand).parameters
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+
+# builds the function of one SCI command, it behaves like the function in velox/sci35.py but sends with msgServer
+# the timeout of the table is only passed to clients that honour it (see accepts_timeout)
+def make_command(*, spec, msgServer):
+    arg_names = [name for name, _ in SciCommandSpec.split_fields(spec.args)]
+    returns = SciCommandSpec.split_fields(spec.returns)
+    options = {"timeout": spec.timeout / 1000} if accepts_timeout(msgServer) else {}
+    if len(returns) > 1:
+        fields = [(name, _TYPES.get(kind, str)) for name, kind in returns]
+        if returns[-1][1] == "str":
+            fields[-1] = (returns[-1][0], "rest")
+        response_class = RESPONSE_TYPES.get(spec.name) or response_type(spec.name, fields)
+    single = _TYPES.get(returns[0][1], str) if len(returns) == 1 else None
+
+    def command(*args, **kwargs):
+        values = list(args) + [""] * (len(arg_names) - len(args))
+        for name, value in kwargs.items():
+            values[arg_names.index(name)] = value
+        rsp = msgServer.sendSciCommand(spec.name, *values, **options)
+        rsp = getattr(rsp, "values", rsp)
+        if not returns:
+            return None
+        if single is str:
+            return " ".join(rsp)
+        if single is not None:
+            return single(rsp[0])
+        return response_class(rsp)
+
+    command.__name__ = command.__qualname__ = spec.name
+    command.__doc__ = f"{spec.name}({spec.args}) -> {spec.returns or 'None'}, timeout {spec.timeout} ms"
+    return command
+
+
+'''
+    this class gives access to all SCI commands like the velox module (velox.StepNextDie() -> commands.StepNextDie()),
+    but without executing the 737 function definitions of velox/sci35.py:
+    a command is built from the command table (sci_commands.tsv) when it is used for the first time.
+    The commands are sent with msgServer (MessageServer, velox.MessageServerInterface, PositionContext, ...).
+    Commands with several return values return a SciResponse, with one return value the converted value.
+    Regenerate the table with build_command_table(source=".../velox/sci35.py") or update_command_table(msgServer=...).
+    commands_of(msgServer) keeps one instance per connection, e.g. csci.commands_of(msgServer).StepFirstDie()
+'''
+class SciCommands():
+
+    def __init__(self, *, msgServer, filepath=None):
+        self._msgServer = msgServer
+        self._filepath = filepath
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        spec = command_table(filepath=self._filepath).get(name)
+        if spec is None:
+            raise AttributeError(f"Unknown SCI command: {name}")
+        command = make_command(spec=spec, msgServer=self._msgServer)
+        setattr(self, name, command)     # the next access does not call __getattr__
+        return command
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(command_table(filepath=self._filepath)))
+
+
+# returns the SciCommands of msgServer, it is created on first use and kept on msgServer,
+# so every command is built only once per connection (without msgServer: the connection of velox.MessageServerInterface)
+# only the own attributes are looked at, a wrapper like cwafer.PositionContext must not use the commands of the msgServer it wraps
+def commands_of(msgServer=None):
+    if msgServer is None:
+        from velox.vxmessageserver import MessageServerInterface
+        msgServer = MessageServerInterface
+    try:
+        commands = vars(msgServer).get("sci_commands")
+    except TypeError:   # no __dict__ to keep the commands in
+        return SciCommands(msgServer=msgServer)
+    if commands is None:
+        commands = SciCommands(msgServer=msgServer)
+        msgServer.sci_commands = commands
+    return commands
+
+
+# timeout in s of a command: timeouts (ms), otherwise the command table, otherwise default
+def timeout_of(commandName, *, timeouts=COMMAND_TIMEOUTS, default=60.0):
+    if commandName in timeouts:
+        return timeouts[commandName] / 1000
+    try:
+        spec = command_table().get(commandName)
+    except OSError:
+        spec = None
+    return spec.timeout / 1000 if spec is not None else default
+
+
+# builds the parameter string like velox.MessageServerInterface.sendSciCommand
+def format_command(message_id, commandName, args, rparams=None):
+    parameters = rparams if rparams is not None else " ".join(str(x) for x in args)
+    return f"Cmd={message_id}:{commandName}:{parameters}\n"
+
+
+'''
+    this class is an asyncio client for the Velox Message Server.
+    - every command gets its own ID, so several commands can be in flight at the same time,
+      the responses are matched by their ID (the Message Server handles commands in parallel)
+    - every command has its own timeout: COMMAND_TIMEOUTS (+ timeouts given to __init__) or default_timeout
+    - one instance is one connection, it can be used by several tasks
+    - error responses raise velox.SciException, timeouts raise asyncio.TimeoutError
+    - notifications (ID 0) are put into the queue notifications
+    - with typed=True the commands in RESPONSE_TYPES return a SciResponse instead of the list of strings
+    Example:
+        async with AsyncMessageServerInterface(ipaddr=ip) as msgServer:
+            move = asyncio.create_task(msgServer.sendSciCommand("MoveProbe", 1, 100, 200))
+            temperature = await msgServer.sendSciCommand("GetHeaterTemp")     # answered while the probe moves
+            await move
+'''
+class AsyncMessageServerInterface():
+
+    def __init__(self, *, ipaddr="localhost", targetSocket=1412, app_name=None, timeouts=None, default_timeout=60.0, typed=True, logger=None):
+        self.ipaddr = ipaddr
+        self.targetSocket = targetSocket
+        self.app_name = (app_name or os.path.basename(sys.argv[0]) or "python").replace(" ", "_")
+        self.timeouts = dict(COMMAND_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.default_timeout = default_timeout
+        self.typed = typed
+        self.logger = logger if logger is not None else logging.getLogger("custom_sci")
+        self.notifications = None
+        self.registration = None
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}       # command ID -> future of the response
+        self._last_id = 1        # ID 1 is used by the registration
+        self._write_lock = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    async def connect(self):
+        try:
+            self._reader, self._writer = await asyncio.open_connection(self.ipaddr, self.targetSocket, limit=MAX_LINE_LENGTH)
+        except ConnectionRefusedError:
+            raise Exception(f"Error: The connection to the Velox Message Server was refused. "
+                            f"It probably is not running on IP [{self.ipaddr}] on Socket [{self.targetSocket}].")
+        self._write_lock = asyncio.Lock()
+        self.notifications = asyncio.Queue()
+        self._writer.write(REGISTRATION_MESSAGE_TEMPLATE.format(self.app_name).encode())
+        await self._writer.drain()
+        self.registration = (await self._reader.readline()).decode(errors="replace").rstrip("\r\n\0")
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+        return self
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+        self._fail_pending(ConnectionError("Connection to the Velox Message Server closed"))
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def _next_id(self):
+        for _ in range(MAX_COMMAND_ID):
+            self._last_id = self._last_id % MAX_COMMAND_ID + 1
+            if self._last_id not in self._pending:
+                return self._last_id
+        raise RuntimeError(f"More than {MAX_COMMAND_ID} commands in flight")
+
+    def timeout_of(self, commandName):
+        return timeout_of(commandName, timeouts=self.timeouts, default=self.default_timeout)
+
+    async def sendSciCommand(self, commandName, *args, timeout=None, rparams=None):
+        if self._writer is None:
+            raise ConnectionError("Not connected to the Velox Message Server")
+        message_id = self._next_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            async with self._write_lock:
+                self._writer.write(format_command(message_id, commandName, args, rparams).encode())
+                await self._writer.drain()
+            code, values = await asyncio.wait_for(future, timeout if timeout is not None else self.timeout_of(commandName))
+        except asyncio.TimeoutError:
+            self.logger.error(f"Timeout of command {commandName} (ID {message_id})")
+            raise
+        finally:
+            self._pending.pop(message_id, None)
+        if code:
+            raise SciException(message_id, code, " ".join(values))
+        return make_response(commandName, values) if self.typed else values
+
+    # sends all commands at once and returns their responses in the same order
+    # commands: ("CommandName", arg1, arg2, ...) tuples
+    async def send_many(self, *commands, return_exceptions=False):
+        return await asyncio.gather(*(self.sendSciCommand(*command) for command in commands), return_exceptions=return_exceptions)
+
+    async def _read_responses(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                line = line.decode(errors="replace").strip("\r\n\0")
+                if not line:
+                    continue
+                try:
+                    message_id, code, values = parse_response(line)
+                except (ValueError, IndexError):
+                    self.logger.error(f"Cannot parse message from Velox Message Server: {line!r}")
+                    continue
+                if message_id == 0:
+                    self.notifications.put_nowait(line)
+                    continue
+                future = self._pending.get(message_id)
+                if future is None or future.done():
+                    self.logger.warning(f"Response without waiting command (timed out?): {line!r}")
+                    continue
+                future.set_result((code, values))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error reading from Velox Message Server: {e}")
+        self._fail_pending(ConnectionError("Connection to the Velox Message Server lost"))
+
+    def _fail_pending(self, exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exception)
+
+
+'''
+    this class reads the messages of the Velox Message Server line by line from a socket.
+    velox.MessageServerInterface expects every response in one recv(500), long responses are cut off
+    and the rest is read as the answer to the next command. Here the bytes are collected with recv_into
+    in one buffer (reused for all messages) until a complete line ("\n") is there.
+    "\r" and "\0" around the lines are removed.
+'''
+class ResponseReader():
+
+    def __init__(self, *, sock, buffer_size=4096, max_line_length=MAX_LINE_LENGTH):
+        self.sock = sock
+        self.max_line_length = max_line_length
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0     # first byte that was not returned yet
+        self._end = 0       # end of the received bytes
+
+    def readline(self):
+        while True:
+            newline = self._buffer.find(b"\n", self._start, self._end)
+            if newline >= 0:
+                line = bytes(self._view[self._start:newline]).strip(b"\r\0")
+                self._start = newline + 1
+                if line:
+                    return line
+                continue
+            self._make_room()
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                raise ConnectionError("Connection to the Velox Message Server closed")
+            self._end += received
+
+    def _make_room(self):
+        if self._start:
+            # move the incomplete line to the front of the buffer
+            length = self._end - self._start
+            self._view[:length] = self._view[self._start:self._end]
+            self._start, self._end = 0, length
+        if self._end == len(self._buffer):
+            if self._end >= self.max_line_length:
+                raise ValueError(f"Message from Velox Message Server longer than {self.max_line_length} bytes")
+            self._view.release()
+            self._buffer.extend(bytes(len(self._buffer)))
+            self._view = memoryview(self._buffer)
+
+    # returns (ID, code, values) of the next message
+    def read_message(self):
+        return parse_response(self.readline().decode(errors="replace"))
+
+
+'''
+    this class is a synchronous client for the Velox Message Server, compatible with velox.MessageServerInterface
+    (sendSciCommand(commandName, *args, rparams=...) returns the list of values or raises velox.SciException).
+    Differences:
+    - the connection belongs to the instance (no module globals), so several connections are possible
+    - the responses are read with ResponseReader, so long or split responses are read completely
+    - the response is matched by its ID: notifications (ID 0) are put into notifications,
+      late responses of commands that timed out are skipped instead of being taken as the answer to the next command
+    - every command has a timeout (COMMAND_TIMEOUTS, timeouts, default_timeout), socket.timeout is raised
+    - with typed=True the commands in RESPONSE_TYPES return a SciResponse (which can still be indexed like the list)
+    NOTE: the functions of the velox module (e.g. velox.StepNextDie()) still use the connection of velox.MessageServerInterface
+'''
+class MessageServer():
+
+    def __init__(self, *, ipaddr="localhost", targetSocket=1412, app_name=None, timeouts=None, default_timeout=60.0, typed=True, logger=None):
+        self.ipaddr = ipaddr
+        self.targetSocket = targetSocket
+        self.app_name = (app_name or os.path.basename(sys.argv[0]) or "python").replace(" ", "_")
+        self.timeouts = dict(COMMAND_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.default_timeout = default_timeout
+        self.typed = typed
+        self.logger = logger if logger is not None else logging.getLogger("custom_sci")
+        self.notifications = collections.deque(maxlen=1000)
+        self.skipped_responses = 0
+        self._last_id = 1
+        self.sock = None
+        self.reader = None
+        self.registration = None
+        self.connect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def connect(self):
+        try:
+            self.sock = socket.create_connection((self.ipaddr, self.targetSocket), timeout=self.default_timeout)
+        except ConnectionRefusedError:
+            raise Exception(f"Error: The connection to the Velox Message Server was refused. "
+                            f"It probably is not running on IP [{self.ipaddr}] on Socket [{self.targetSocket}].")
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = ResponseReader(sock=self.sock)
+        self.sock.sendall(REGISTRATION_MESSAGE_TEMPLATE.format(self.app_name).encode())
+        self.registration = self.reader.readline().decode(errors="replace")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+
+    def timeout_of(self, commandName):
+        return timeout_of(commandName, timeouts=self.timeouts, default=self.default_timeout)
+
+    def _next_id(self):
+        self._last_id = self._last_id % MAX_COMMAND_ID + 1
+        return self._last_id
+
+    # reads messages until the response with message_id arrives
+    def _wait_for(self, message_id):
+        while True:
+            response_id, code, values = self.reader.read_message()
+            if response_id == message_id:
+                return code, values
+            if response_id == 0:
+                self.notifications.append((code, values))
+            else:
+                self.skipped_responses += 1
+                self.logger.warning(f"Skipped response {response_id} while waiting for {message_id} (timed out before?)")
+
+    def sendSciCommand(self, commandName, *args, timeout=None, rparams=None):
+        if self.sock is None:
+            raise ConnectionError("Not connected to the Velox Message Server")
+        message_id = self._next_id()
+        self.sock.settimeout(timeout if timeout is not None else self.timeout_of(commandName))
+        self.sock.sendall(format_command(message_id, commandName, args, rparams).encode())
+        code, values = self._wait_for(message_id)
+        if code:
+            raise SciException(message_id, code, " ".join(values))
+        return make_response(commandName, values) if self.typed else values
+
+    # returns the list of all commands known to the Velox Message Server, like velox.MessageServerInterface._getcommands()
+    def _getcommands(self):
+        SimpleCommandTuple = collections.namedtuple("SimpleCommandTuple", "section, name, number, timeout")
+        self.sock.settimeout(self.default_timeout)
+        self.sock.sendall(GET_ALL_COMMANDS_MESSAGE.encode())
+        while True:
+            message = self.reader.readline().decode(errors="replace")
+            if message.startswith("Rsp=1:"):
+                break
+        scilist = []
+        for command in message.split(":", 2)[2].split(";"):
+            parts = command.split(" ")
+            if len(parts) >= 4:
+                scilist.append(SimpleCommandTuple(parts[0], parts[1], int(parts[2]), int(parts[3])))
+        return scilist
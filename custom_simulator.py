@@ -0,0 +1,554 @@
+'''
+
+    Philipp Bartz 2025
+
+    This file is part of the Velox project.
+
+    Simulators for the Velox Message Server and the Keithley 6487, so main() can be run,
+    timed and debugged without the waferprober:
+
+        python custom_simulator.py
+
+    starts both and prints the settings to put into the config file
+    ("waferprober_ip", "waferprober_port" and "device_port").
+
+'''
+
+# #####       Version 1.0       #####
+
+
+import os
+import re
+import time
+import math
+import random
+import socket
+import struct
+import logging
+import argparse
+import threading
+import collections
+import tty
+
+
+'''
+    this class is a TCP server that answers SCI commands like the Velox Message Server.
+    Protocol (see misc/VeloxIntegrationToolkitGuide.pdf):
+        "Fcn=<ID>:RegisterProberApp:<Name> <Group> <Flag>"   ->  "Rsp=<ID>:6:"
+        "Fcn=<ID>:GetCommands:"                              ->  "Rsp=<ID>:0:<Section> <Name> <Number> <Timeout>;..."
+        "Cmd=<ID>:<Command Name>:<Parameters>"                ->  "Rsp=<ID>:<Return Code>:<Return Value>"
+    every response is terminated by "\r\n" (the velox package strips the last two characters).
+    Only the commands used by main() are simulated (see HANDLERS), every other command is answered with an error.
+    Each command takes latencies[<command>] (or latencies["default"]) seconds, scaled by time_scale.
+    With concurrent=True every command is answered by its own thread, like the Message Server handles commands in parallel,
+    so the responses of pipelined commands can arrive in a different order than the commands were sent.
+    The wafer map consists of dies x subdies positions, after the last one StepNextDie answers with error 703 (EndOfWafer).
+    StepFirstDie stops before the first subdie (1), so the first StepNextDie of main() selects it.
+    "StepNextDie <column> <row> <subdie>" steps to the given position, the wafer map is read with
+    GetNumSelectedDies, GetSelectedDieCoords, GetDieInfo, GetSubDieData and GetWaferMapParams (dies in rows of 8).
+    The chuck temperature follows SetHeaterTemp with heating_rate K/s and reaches the target exactly.
+    After every movement "ReadProberStatus" reports the prober as busy for settle_time seconds (scaled by time_scale).
+'''
+class VeloxSimulator():
+
+    LATENCIES = {"default": 0.005,
+                 "StepFirstDie": 2.0,
+                 "StepNextDie": 1.0,
+                 "MoveProbe": 0.4,
+                 "MoveProbeContact": 0.3,
+                 "MoveProbeSeparation": 0.3,
+                 "EnableMotorQuiet": 0.1,
+                 "SetCameraQuiet": 0.1,
+                 "SetHeaterTemp": 0.05,
+                 "ReadMapPosition2": 0.02,
+                 }
+    END_OF_WAFER = (703, "EndOfWafer")
+    INVALID_POSITION = (705, "InvalidDieOrSite")
+    UNKNOWN_COMMAND = (2, "Unknown command")
+    TERMINATOR = "\r\n"
+    LINE = re.compile(r"^(Cmd|Fcn)=(\d+):([^:]*):?(.*)$", re.IGNORECASE)
+
+    def __init__(self, *, host="127.0.0.1", port=1412, dies=2, subdies=24, die_pitch=(10000.0, 10000.0),
+                 latencies=None, time_scale=1.0, temperature=25.0, heating_rate=0.5, settle_time=0.0, concurrent=True, logger=None):
+        self.host = host
+        self.port = port
+        self.dies = dies
+        self.subdies = subdies
+        self.die_pitch = die_pitch
+        self.latencies = dict(self.LATENCIES)
+        if latencies:
+            self.latencies.update(latencies)
+        self.time_scale = time_scale
+        self.heating_rate = heating_rate
+        self.concurrent = concurrent
+        self.settle_time = settle_time
+        self.busy_until = 0.0
+        self.logger = logger if logger is not None else logging.getLogger("custom_simulator")
+
+        self.lock = threading.Lock()     # several clients may be connected
+        self.die = 0
+        self.subdie = 0                  # 0 = no subdie selected yet, the subdies are numbered from 1
+        self.probe = [0.0, 0.0, 0.0]     # x, y, z of probe 1
+        self.contact = False
+        self.quiet = False
+        self.light = True
+        self.temperature = float(temperature)
+        self._temperature_start = (time.time(), float(temperature))
+        self.target_temperature = float(temperature)
+        self.command_counts = collections.Counter()
+        self.command_time = collections.Counter()    # simulated seconds per command
+
+        self._server = None
+        self._thread = None
+        self._clients = []
+        self._running = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def start(self):
+        self._server = socket.create_server((self.host, self.port))
+        self.port = self._server.getsockname()[1]    # port=0 picks a free port
+        self._running.set()
+        self._thread = threading.Thread(target=self._serve, name="VeloxSimulator", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Velox simulator listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        self._running.clear()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for conn in self._clients:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        self._clients = []
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _serve(self):
+        while self._running.is_set():
+            try:
+                conn, address = self._server.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._clients.append(conn)
+            threading.Thread(target=self._handle_client, args=(conn,), name=f"VeloxSimulator {address}", daemon=True).start()
+
+    def _handle_client(self, conn):
+        buffer = b""
+        send_lock = threading.Lock()
+        try:
+            while self._running.is_set():
+                data = conn.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    line = line.decode(errors="replace").strip("\r\0 ")
+                    if not line:
+                        continue
+                    if self.concurrent:
+                        threading.Thread(target=self._answer, args=(conn, send_lock, line), daemon=True).start()
+                    else:
+                        self._answer(conn, send_lock, line)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _answer(self, conn, send_lock, line):
+        response = self.respond(line=line).encode()
+        with send_lock:
+            try:
+                conn.sendall(response)
+            except OSError:
+                pass
+
+    # answers one message, returns the complete response line
+    def respond(self, *, line):
+        match = self.LINE.match(line)
+        if match is None:
+            self.logger.error(f"Velox simulator: cannot parse {line!r}")
+            return f"Rsp=0:{self.UNKNOWN_COMMAND[0]}:{self.UNKNOWN_COMMAND[1]}{self.TERMINATOR}"
+        kind, message_id, name, parameters = match.groups()
+        if kind.lower() == "fcn":
+            if name == "RegisterProberApp":
+                code, values = 6, ""
+            elif name == "GetCommands":
+                code, values = 0, ";".join(f"Simulator {command} {number} 5000" for number, command in enumerate(self.HANDLERS, 1))
+            else:
+                code, values = self.UNKNOWN_COMMAND
+        else:
+            latency = self.latencies.get(name, self.latencies["default"]) * self.time_scale
+            if latency > 0:
+                time.sleep(latency)
+            handler = self.HANDLERS.get(name)
+            with self.lock:
+                self.command_counts[name] += 1
+                self.command_time[name] += latency
+                if handler is None:
+                    code, values = self.UNKNOWN_COMMAND
+                else:
+                    code, values = handler(self, parameters.split())
+                if name.startswith(("Move", "Step")):
+                    self.busy_until = time.time() + self.settle_time * self.time_scale
+        self.logger.debug(f"Velox simulator: {line} -> {code} {values}")
+        return f"Rsp={message_id}:{code}:{values}{self.TERMINATOR}"
+
+    def _update_temperature(self):
+        start_time, start_temperature = self._temperature_start
+        difference = self.target_temperature - start_temperature
+        progress = (time.time() - start_time) * self.heating_rate / self.time_scale if self.time_scale > 0 else math.inf
+        if progress >= abs(difference):
+            self.temperature = self.target_temperature
+        else:
+            self.temperature = start_temperature + math.copysign(progress, difference)
+
+    # the dies are placed in rows of 8, the subdies in rows of 4 inside a die
+    def _die_coordinates(self, die):
+        return die % 8, die // 8
+
+    def _site_offset(self, subdie):
+        if not subdie:
+            return 0.0, 0.0
+        return (subdie - 1) % 4 * self.die_pitch[0] / 4, (subdie - 1) // 4 * self.die_pitch[1] / 8
+
+    def _map_position(self):
+        column, row = self._die_coordinates(self.die)
+        site_x, site_y = self._site_offset(self.subdie)
+        return column, row, column * self.die_pitch[0] + site_x, row * self.die_pitch[1] + site_y
+
+    def _step_answer(self):
+        column, row, _, _ = self._map_position()
+        return 0, f"{column} {row} {self.subdie} {self.subdies}"
+
+    ###     SCI command handlers: (self, parameters) -> (return code, return values)     ###
+
+    def _ok(self, parameters):
+        return 0, ""
+
+    def _report_kernel_version(self, parameters):
+        return 0, '1.0 "Velox simulator"'
+
+    def _read_prober_status(self, parameters):
+        return 0, f"{int(time.time() < self.busy_until)} {int(self.contact)} R {int(self.quiet)}"
+
+    def _set_heater_temp(self, parameters):
+        self._update_temperature()
+        self.target_temperature = float(parameters[0]) if parameters else 25.0
+        self._temperature_start = (time.time(), self.temperature)
+        return 0, f"{self.target_temperature:.1f} C"
+
+    def _get_heater_temp(self, parameters):
+        self._update_temperature()
+        status = "Soaking" if self.temperature == self.target_temperature else ("Heating" if self.temperature < self.target_temperature else "Cooling")
+        return 0, f"{self.temperature:.1f} C {status}"
+
+    def _enable_motor_quiet(self, parameters):
+        self.quiet = bool(int(parameters[0])) if parameters else False
+        return 0, ""
+
+    def _set_micro_light(self, parameters):
+        self.light = bool(int(parameters[0])) if parameters else True
+        return 0, ""
+
+    def _read_map_position2(self, parameters):
+        column, row, x, y = self._map_position()
+        return 0, f"{column} {row} {x:.1f} {y:.1f} {self.subdie} {self.subdies} {self.die} {self.dies} 0 1"
+
+    def _step_first_die(self, parameters):
+        self.die, self.subdie = 0, 0
+        self.contact = False
+        return self._step_answer()
+
+    def _step_next_die(self, parameters):
+        self.contact = False
+        if len(parameters) >= 3 and int(parameters[2]) != -1:
+            # step to the given die and subdie
+            column, row, subdie = (int(parameter) for parameter in parameters[:3])
+            dies = [die for die in range(self.dies) if self._die_coordinates(die) == (column, row)]
+            if not dies or not 1 <= subdie <= self.subdies:
+                return self.INVALID_POSITION
+            self.die, self.subdie = dies[0], subdie
+            return self._step_answer()
+        if len(parameters) >= 3:
+            # subdie -1: first subdie of the next die
+            self.subdie = self.subdies
+        if self.subdie < self.subdies:
+            self.subdie += 1
+        elif self.die + 1 < self.dies:
+            self.die, self.subdie = self.die + 1, 1
+        else:
+            return self.END_OF_WAFER
+        return self._step_answer()
+
+    def _get_num_selected_dies(self, parameters):
+        return 0, f"{self.dies}"
+
+    def _get_selected_die_coords(self, parameters):
+        die = int(parameters[0]) if parameters else 0     # numbered from 1
+        if not 1 <= die <= self.dies:
+            return self.INVALID_POSITION
+        column, row = self._die_coordinates(die - 1)
+        return 0, f"{column} {row}"
+
+    def _get_die_info(self, parameters):
+        return 0, f"{self.subdies}"
+
+    def _get_sub_die_data(self, parameters):
+        site = int(parameters[0]) if parameters else 0     # numbered from 0
+        if not 0 <= site < self.subdies:
+            return self.INVALID_POSITION
+        x, y = self._site_offset(site + 1)
+        return 0, f"{site + 1} {x:.1f} {y:.1f} Site{site + 1}"
+
+    def _get_wafer_map_params(self, parameters):
+        return 0, f"150000.0 {self.die_pitch[0]:.1f} {self.die_pitch[1]:.1f} 57500.0 90 0.0 0.0 3000.0"
+
+    def _move_probe(self, parameters):
+        if len(parameters) >= 3:
+            self.probe[0], self.probe[1] = float(parameters[1]), float(parameters[2])
+        self.quiet = False
+        return 0, parameters[0] if parameters else "1"
+
+    def _move_probe_contact(self, parameters):
+        self.probe[2], self.contact, self.quiet = 0.0, True, False
+        return 0, parameters[0] if parameters else "1"
+
+    def _move_probe_separation(self, parameters):
+        self.probe[2], self.contact, self.quiet = -50.0, False, False
+        return 0, parameters[0] if parameters else "1"
+
+    def _read_probe_position(self, parameters):
+        return 0, f"{parameters[0] if parameters else 1} {self.probe[0]:.1f} {self.probe[1]:.1f} {self.probe[2]:.1f}"
+
+    HANDLERS = {"ReportKernelVersion": _report_kernel_version,
+                "RegisterProberAppChange": _ok,
+                "ReadProberStatus": _read_prober_status,
+                "SetHeaterTemp": _set_heater_temp,
+                "GetHeaterTemp": _get_heater_temp,
+                "EnableMotorQuiet": _enable_motor_quiet,
+                "SetCameraQuiet": _ok,
+                "SetChuckMode": _ok,
+                "SetProbeMode": _ok,
+                "SetScopeMode": _ok,
+                "SetMicroLight": _set_micro_light,
+                "SetProbeHome": _ok,
+                "ReadMapPosition2": _read_map_position2,
+                "StepFirstDie": _step_first_die,
+                "StepNextDie": _step_next_die,
+                "GetNumSelectedDies": _get_num_selected_dies,
+                "GetSelectedDieCoords": _get_selected_die_coords,
+                "GetDieInfo": _get_die_info,
+                "GetSubDieData": _get_sub_die_data,
+                "GetWaferMapParams": _get_wafer_map_params,
+                "MoveProbe": _move_probe,
+                "MoveProbeContact": _move_probe_contact,
+                "MoveProbeSeparation": _move_probe_separation,
+                "ReadProbePosition": _read_probe_position,
+                }
+
+
+'''
+    this class simulates a Keithley 6487 behind a pseudo terminal, port is used like "/dev/ttyUSB0".
+    It understands the SCPI commands sent by custom_measurement (the rest is accepted and ignored):
+        *RST, *OPC?, *IDN?, TRAC:POIN, SOUR:VOLT:SWE:STAR/STOP/STEP/DEL, SOUR:VOLT:ILIM, SOUR:VOLT:SWE:INIT,
+        INIT, TRAC:DATA?, FORM:DATA ASC/SRE, FORM:BORD NORM/SWAP
+    A sweep returns the current of a diode with series and shunt resistance
+        I = saturation_current * (exp((V - I*R_s) / (ideality * V_T)) - 1) + V / shunt_resistance
+    limited to the current limit, plus relative and absolute gaussian noise.
+    With a breakdown_voltage the reverse current is multiplied by 1 / (1 - (|V| / breakdown_voltage)^breakdown_exponent)
+    and reaches the current limit at the breakdown voltage.
+    polarity=-1 (default) matches the settings of this project: positive voltages are reverse bias (rbias 0 -> 50 V),
+    negative voltages are forward bias (fbias 0 -> -2.5 V).
+    With contact=False only noise is returned. A sweep takes (delay + point_time) * time_scale seconds per point.
+'''
+class FakeKeithley():
+
+    THERMAL_VOLTAGE = 0.025852      # kT/q at 300 K
+
+    def __init__(self, *, saturation_current=1e-11, ideality=1.8, series_resistance=50.0, shunt_resistance=1e11,
+                 noise=0.01, noise_floor=2e-14, polarity=-1, point_time=0.02, time_scale=1.0, contact=True,
+                 breakdown_voltage=None, breakdown_exponent=4, seed=None, logger=None):
+        self.saturation_current = saturation_current
+        self.ideality = ideality
+        self.series_resistance = series_resistance
+        self.shunt_resistance = shunt_resistance
+        self.noise = noise
+        self.noise_floor = noise_floor
+        self.polarity = polarity
+        self.point_time = point_time
+        self.time_scale = time_scale
+        self.contact = contact
+        self.breakdown_voltage = breakdown_voltage
+        self.breakdown_exponent = breakdown_exponent
+        self.random = random.Random(seed)
+        self.logger = logger if logger is not None else logging.getLogger("custom_simulator")
+
+        self.sweeps = 0
+        self.commands = collections.Counter()
+        self._reset()
+        self._master = None
+        self._slave = None
+        self.port = None
+        self._thread = None
+        self._running = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def _reset(self):
+        self.settings = {"TRAC:POIN": "1", "SOUR:VOLT:SWE:STAR": "0", "SOUR:VOLT:SWE:STOP": "0",
+                         "SOUR:VOLT:SWE:STEP": "1", "SOUR:VOLT:SWE:DEL": "0", "SOUR:VOLT:ILIM": "2.5e-3",
+                         "FORM:DATA": "ASC", "FORM:BORD": "NORM"}
+        self.armed = False
+        self.trace = []
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)          # no echo or line editing, like a serial port
+        self.port = os.ttyname(self._slave)
+        self._running.set()
+        self._thread = threading.Thread(target=self._serve, name="FakeKeithley", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Keithley simulator on {self.port}")
+        return self
+
+    def stop(self):
+        self._running.clear()
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _serve(self):
+        buffer = b""
+        while self._running.is_set():
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                line = line.decode(errors="replace").strip()
+                if line:
+                    answer = self.execute(command=line)
+                    if answer:
+                        os.write(self._master, answer)
+
+    # executes one SCPI command, returns the bytes to send back (or None)
+    def execute(self, *, command):
+        header, _, value = command.partition(" ")
+        header = header.upper()
+        self.commands[header] += 1
+        if header == "*RST":
+            self._reset()
+        elif header == "*OPC?":
+            return b"1\n"
+        elif header == "*IDN?":
+            return b"KEITHLEY INSTRUMENTS INC.,MODEL 6487,0000000,A00 (simulated)\n"
+        elif header == "SOUR:VOLT:SWE:INIT":
+            self.armed = True
+        elif header == "INIT":
+            if self.armed:
+                self.trace = self.sweep()
+                self.armed = False
+        elif header == "TRAC:DATA?":
+            return self.format_trace(trace=self.trace)
+        elif value:
+            self.settings[header] = value.strip().upper()
+        return None
+
+    def current(self, *, voltage):
+        if not self.contact:
+            return 0.0
+        return self.polarity * self._diode_current(voltage=self.polarity * voltage)
+
+    def _diode_current(self, *, voltage):
+        n_vt = self.ideality * self.THERMAL_VOLTAGE
+        current = voltage / self.shunt_resistance
+        if voltage <= 0 and self.breakdown_voltage:
+            ratio = (-voltage / self.breakdown_voltage) ** self.breakdown_exponent
+            multiplication = 1 / (1 - ratio) if ratio < 1 else math.inf
+            return (current + self.saturation_current * math.expm1(min(voltage / n_vt, 700))) * multiplication
+        if voltage <= 0 or self.series_resistance <= 0:
+            return current + self.saturation_current * math.expm1(min(voltage / n_vt, 700))
+        # solve I = Is*(exp((V - I*Rs)/nVt) - 1) for I by bisection
+        low, high = 0.0, voltage / self.series_resistance
+        for _ in range(80):
+            middle = (low + high) / 2
+            if self.saturation_current * math.expm1(min((voltage - middle * self.series_resistance) / n_vt, 700)) > middle:
+                low = middle
+            else:
+                high = middle
+        return current + low
+
+    # measures all points of the armed sweep, returns [(current, voltage), ...]
+    def sweep(self):
+        start = float(self.settings["SOUR:VOLT:SWE:STAR"])
+        stop = float(self.settings["SOUR:VOLT:SWE:STOP"])
+        step = abs(float(self.settings["SOUR:VOLT:SWE:STEP"])) or 1.0
+        delay = float(self.settings["SOUR:VOLT:SWE:DEL"])
+        limit = float(self.settings["SOUR:VOLT:ILIM"])
+        points = int(float(self.settings["TRAC:POIN"]))
+        direction = 1 if stop >= start else -1
+        time.sleep(points * (delay + self.point_time) * self.time_scale)
+        trace = []
+        for k in range(points):
+            voltage = round(start + direction * k * step, 6)
+            current = self.current(voltage=voltage)
+            current = max(-limit, min(limit, current))
+            current += current * self.random.gauss(0, self.noise) + self.random.gauss(0, self.noise_floor)
+            trace.append((current, voltage))
+        self.sweeps += 1
+        return trace
+
+    def format_trace(self, *, trace):
+        if self.settings["FORM:DATA"].startswith("SRE") or self.settings["FORM:DATA"].startswith("REAL"):
+            order = "<" if self.settings["FORM:BORD"].startswith("SW") else ">"
+            return b"#0" + b"".join(struct.pack(f"{order}ff", current, voltage) for current, voltage in trace) + b"\n"
+        return (",".join(f"{current:+.6E},{voltage:+.6E}" for current, voltage in trace) + "\n").encode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Velox Message Server and Keithley 6487 simulator")
+    parser.add_argument("--port", type=int, default=1412, help="TCP port of the simulated Message Server")
+    parser.add_argument("--dies", type=int, default=2)
+    parser.add_argument("--subdies", type=int, default=24)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="factor for all simulated latencies, 0 = as fast as possible")
+    parser.add_argument("--no-contact", action="store_true", help="the Keithley only measures noise")
+    parser.add_argument("--breakdown", type=float, default=None, help="breakdown voltage of the simulated diode")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    with VeloxSimulator(port=args.port, dies=args.dies, subdies=args.subdies, time_scale=args.time_scale) as velox_simulator, \
+         FakeKeithley(time_scale=args.time_scale, contact=not args.no_contact, breakdown_voltage=args.breakdown) as keithley_simulator:
+        print(f'"waferprober_ip": "127.0.0.1", "waferprober_port": {velox_simulator.port}, "device_port": "{keithley_simulator.port}"')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(dict(velox_simulator.command_counts))
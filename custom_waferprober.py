@@ -13,13 +13,348 @@
 
 
 import velox
+import custom_sci as csci
+import time
+import os
+import json
+
+
+'''
+    this class caches the position of the wafer map ("ReadMapPosition2"), so it is read only once per position.
+    It wraps the msgServer and can be used everywhere instead of it:
+        msgServer = cwafer.PositionContext(msgServer=msgServer)
+    - "ReadMapPosition2" is answered from the cache if nothing moved since the last read
+    - every movement command (all commands starting with "Step" or "Move") clears the cache
+    - saved_round_trips counts how many requests to the message server were saved
+    NOTE: movements that are not sent through PositionContext.sendSciCommand(...) (e.g. the module functions of velox) 
+    are not noticed, call invalidate() after them.
+'''
+class PositionContext():
+    MOVEMENT_PREFIXES = ("Step", "Move")
+
+    def __init__(self, *, msgServer) -> None:
+        self.msgServer = msgServer
+        self.position = None
+        self.round_trips = 0
+        self.saved_round_trips = 0
+
+    def sendSciCommand(self, commandName, *args, **kwargs):
+        if commandName == "ReadMapPosition2" and not args and not kwargs:
+            return list(self.read())
+        if commandName.startswith(self.MOVEMENT_PREFIXES):
+            self.invalidate()
+        return self.msgServer.sendSciCommand(commandName, *args, **kwargs)
+
+    # returns the cached answer of "ReadMapPosition2", reads it from the prober if needed
+    def read(self):
+        if self.position is None:
+            self.round_trips += 1
+            response = self.msgServer.sendSciCommand("ReadMapPosition2")
+            if isinstance(response, str):
+                response = response.split()
+            self.position = list(response)
+        else:
+            self.saved_round_trips += 1
+        return self.position
+
+    def invalidate(self) -> None:
+        self.position = None
+
+    # everything else (e.g. _getcommands or the context manager) goes to the wrapped msgServer
+    def __getattr__(self, name):
+        return getattr(self.msgServer, name)
+
+
+# polls "ReadProberStatus" until the prober is not busy (FlagsBusy == 0) and, if contact is given, FlagsContact matches it
+# the polling interval starts at min_interval and grows by factor up to max_interval, so short movements are noticed fast
+# and long ones do not flood the Message Server. Returns True when the prober is idle, False after timeout seconds
+def wait_until_idle(*, msgServer, logger, contact=None, timeout=30.0, min_interval=0.02, max_interval=0.5, factor=1.5) -> bool:
+    deadline = time.monotonic() + timeout
+    interval = min_interval
+    polls = 0
+    while True:
+        response = msgServer.sendSciCommand("ReadProberStatus")
+        polls += 1
+        busy, in_contact = int(response[0]), int(response[1])
+        if not busy and (contact is None or bool(in_contact) == contact):
+            if polls > 1:
+                logger.waferprober(f"Prober idle after {polls} status polls")
+            return True
+        if time.monotonic() + interval > deadline:
+            logger.error(f"Prober still busy after {timeout} s (status {list(response)})")
+            return False
+        time.sleep(interval)
+        interval = min(interval * factor, max_interval)
+
+
+'''
+    this class decides when the chuck temperature has settled, instead of waiting for a reading that is exactly the target.
+    The temperature is settled when for hold_time seconds
+    - every reading is within tolerance (K) of the target and
+    - the slope of the readings (linear fit over the last window seconds, default hold_time) is at most max_slope (K/min)
+    The interval to the next reading adapts: while heating it is about half the expected time until the target is reached,
+    inside the tolerance about a fifth of hold_time (always between min_interval and max_interval).
+    Usage:
+        settler = TemperatureSettler(target=25)
+        settler.wait(read=lambda: get_chuck_temperature(msgServer=msgServer, logger=logger), logger=logger)
+    or call add(temperature) yourself, it returns True once settled.
+'''
+class TemperatureSettler():
+
+    def __init__(self, *, target, tolerance=0.1, max_slope=0.1, hold_time=30.0, window=None,
+                 min_interval=1.0, max_interval=30.0, timeout=None, clock=time.monotonic) -> None:
+        self.target = float(target)
+        self.tolerance = tolerance
+        self.max_slope = max_slope
+        self.hold_time = hold_time
+        self.window = hold_time if window is None else window
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.history = []           # [(time, temperature), ...] of the last window seconds
+        self.in_tolerance_since = None
+        self.started = None
+        self.start_temperature = None
+        self.settled_at = None
+
+    # slope of the readings in K/min, None if there are not enough readings
+    def slope(self):
+        if len(self.history) < 2 or self.history[-1][0] == self.history[0][0]:
+            return None
+        n = len(self.history)
+        mean_t = sum(t for t, _ in self.history) / n
+        mean_T = sum(T for _, T in self.history) / n
+        covariance = sum((t - mean_t) * (T - mean_T) for t, T in self.history)
+        variance = sum((t - mean_t) ** 2 for t, _ in self.history)
+        return covariance / variance * 60
+
+    def add(self, temperature, *, now=None) -> bool:
+        now = self.clock() if now is None else now
+        if self.started is None:
+            self.started = now
+        if temperature is None:
+            return False
+        if self.start_temperature is None:
+            self.start_temperature = float(temperature)
+        self.history.append((now, float(temperature)))
+        self.history = [(t, T) for t, T in self.history if t >= now - self.window]
+        if abs(float(temperature) - self.target) > self.tolerance + 1e-9:     # readings like 59.9 for 60 +- 0.1
+            self.in_tolerance_since = None
+            return False
+        if self.in_tolerance_since is None:
+            self.in_tolerance_since = now
+        if now - self.in_tolerance_since < self.hold_time:
+            return False
+        slope = self.slope()
+        if self.hold_time > 0 and (slope is None or abs(slope) > self.max_slope):
+            return False
+        self.settled_at = now
+        return True
+
+    @property
+    def settled(self) -> bool:
+        return self.settled_at is not None
+
+    # seconds from the first reading until the temperature settled, None if it did not settle
+    @property
+    def settle_time(self):
+        return self.settled_at - self.started if self.settled else None
+
+    def next_interval(self) -> float:
+        if not self.history:
+            return self.min_interval
+        distance = abs(self.history[-1][1] - self.target)
+        if distance <= self.tolerance + 1e-9:
+            interval = self.hold_time / 5
+        else:
+            slope = self.slope()
+            toward_target = slope is not None and slope != 0 and (slope > 0) == (self.target > self.history[-1][1])
+            interval = 0.5 * distance / (abs(slope) / 60) if toward_target else self.min_interval * 5
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    # reads the temperature until it is settled, returns False after timeout seconds
+    def wait(self, *, read, logger, sleep=time.sleep) -> bool:
+        while not self.add(read()):
+            if self.timeout is not None and self.clock() - self.started > self.timeout:
+                logger.error(f"Chuck temperature did not settle at {self.target}C within {self.timeout} s")
+                return False
+            sleep(self.next_interval())
+        logger.waferprober(f"Chuck temperature settled at {self.history[-1][1]}C (target {self.target}C) after {self.settled_at - self.started:.0f} s")
+        return True
+
+
+SETTLE_TIMES_FILE = "global_logs/settle_times.jsonl"
+
+
+'''
+    this class predicts how long the chuck needs to settle at a new temperature:
+        dead_time + |target - start| / rate + hold_time      (rate in K/min, heating_rate or cooling_rate)
+    The rates start with the defaults and follow the median of the last measured transitions (add()),
+    with a filepath the measurements are appended to a JSON lines file, so every run improves the prediction of the next one.
+'''
+class SettleTimeModel():
+    MIN_DIFFERENCE = 1.0    # K, smaller transitions say nothing about the rate
+    HISTORY = 20            # transitions per direction for the median
+
+    def __init__(self, *, filepath=None, heating_rate=5.0, cooling_rate=2.0, dead_time=30.0) -> None:
+        self.filepath = filepath
+        self.default_rates = {"heating": heating_rate, "cooling": cooling_rate}
+        self.dead_time = dead_time
+        self.records = []
+        if filepath is not None and os.path.isfile(filepath):
+            with open(filepath, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.records.append(json.loads(line))
+                    except ValueError:
+                        continue
+
+    def rate(self, direction) -> float:
+        records = [record for record in self.records if record.get("direction") == direction][-self.HISTORY:]
+        rates = sorted(record["rate"] for record in records)
+        return rates[len(rates) // 2] if rates else self.default_rates[direction]
+
+    # predicted seconds until the chuck settles at target, starting at start (C)
+    def predict(self, *, start, target, tolerance=0.1, hold_time=0.0) -> float:
+        difference = float(target) - float(start)
+        if abs(difference) <= tolerance:
+            return hold_time
+        rate = self.rate("heating" if difference > 0 else "cooling")
+        return self.dead_time + abs(difference) / rate * 60 + hold_time
+
+    # records a measured transition (duration in s including hold_time), returns the record or None if it was too small
+    def add(self, *, start, target, duration, hold_time=0.0):
+        difference = float(target) - float(start)
+        if abs(difference) < self.MIN_DIFFERENCE:
+            return None
+        ramp = max(duration - hold_time - self.dead_time, 1.0)
+        record = {"time": time.strftime("%Y_%m_%d-%H_%M_%S"), "start": float(start), "target": float(target), "duration": duration,
+                  "direction": "heating" if difference > 0 else "cooling", "rate": abs(difference) / ramp * 60}
+        self.records.append(record)
+        if self.filepath is not None:
+            folder = os.path.dirname(self.filepath)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(self.filepath, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+
+'''
+    this class collects the duration of every SCI command sent by a CommandSequence,
+    summary() returns {command: (count, mean, max)} in seconds.
+'''
+class StepTimings():
+
+    def __init__(self) -> None:
+        self.durations = {}
+
+    def add(self, command, seconds) -> None:
+        self.durations.setdefault(command, []).append(seconds)
+
+    def summary(self):
+        return {command: (len(times), sum(times) / len(times), max(times)) for command, times in self.durations.items()}
+
+    def __str__(self) -> str:
+        return ", ".join(f"{command}: {count}x mean {mean:.3f} s max {maximum:.3f} s" for command, (count, mean, maximum) in self.summary().items())
+
+
+'''
+    this class runs several SCI commands one after the other as one operation, e.g. for every pad:
+        MoveProbeSeparation -> MoveProbe -> MoveProbeContact -> EnableMotorQuiet
+    - every step waits for the response of its command, the Message Server answers movement commands
+      when the movement is finished. Steps with wait_idle=True then also wait until "ReadProberStatus" reports
+      the prober as idle (and in contact or not, see wait_until_idle), settle adds a fixed wait after a step if wanted
+    - the steps are NOT sent at once, because the Message Server may handle commands in parallel
+      and the probe must not be lowered before it arrived
+    - abort() is called before every step but the first, if it returns True the rest of the sequence is skipped
+    - if a step fails, the on_error steps (e.g. MoveProbeSeparation) are sent and the exception is raised again,
+      a failing optional step (e.g. EnableMotorQuiet) is only logged and the sequence goes on
+    - the duration of every step is written to timings (StepTimings) and to last_run
+'''
+class CommandSequence():
+
+    def __init__(self, *, name, logger, timings=None, on_error=()) -> None:
+        self.name = name
+        self.logger = logger
+        self.timings = timings if timings is not None else StepTimings()
+        self.on_error = on_error
+        self.steps = []
+        self.last_run = []      # [(command, seconds, response), ...]
+
+    # adds a step, level is the name of the logger method used for the step (e.g. "path", "lowering")
+    def add(self, commandName, *args, settle=0.0, level="path", wait_idle=False, contact=None, optional=False):
+        self.steps.append((commandName, args, settle, level, wait_idle, contact, optional))
+        return self
+
+    # returns True if all steps were sent, False if abort() stopped the sequence
+    def run(self, *, msgServer, abort=None) -> bool:
+        self.last_run = []
+        for number, (commandName, args, settle, level, wait_idle, contact, optional) in enumerate(self.steps):
+            if number and abort is not None and abort():
+                self.logger.path(f"{self.name}: aborted before {commandName}")
+                return False
+            start = time.perf_counter()
+            try:
+                response = msgServer.sendSciCommand(commandName, *args)
+                if wait_idle and not wait_until_idle(msgServer=msgServer, logger=self.logger, contact=contact):
+                    raise TimeoutError(f"prober did not finish {commandName}")
+            except Exception as e:
+                self.logger.error(f"{self.name}: {commandName} {args} failed: {e}")
+                if optional:
+                    continue
+                self._recover(msgServer=msgServer)
+                raise
+            if settle:
+                time.sleep(settle)
+            seconds = time.perf_counter() - start
+            self.timings.add(commandName, seconds)
+            self.last_run.append((commandName, seconds, response))
+            getattr(self.logger, level)(f"{self.name}: {commandName} {' '.join(str(i) for i in args)} -> {response} ({seconds:.3f} s)")
+        return True
+
+    def _recover(self, *, msgServer) -> None:
+        for commandName, *args in self.on_error:
+            try:
+                msgServer.sendSciCommand(commandName, *args)
+            except Exception as e:
+                self.logger.critical(f"{self.name}: {commandName} after error failed: {e}")
+
+
+# sequence for one point of a path: separation height -> move -> (for pads) contact height and motor quiet mode
+# with wait_idle every movement is confirmed with "ReadProberStatus" (FlagsBusy) before the next step.
+# FlagsContact is not checked here, because it also depends on the chuck height
+def probe_sequence(*, x, y, contact, logger, timings=None, settle_time=0.0, probe=1, wait_idle=True) -> CommandSequence:
+    sequence = CommandSequence(name=f"Probe to {x}, {y}", logger=logger, timings=timings, on_error=(("MoveProbeSeparation", probe),))
+    sequence.add("MoveProbeSeparation", probe, settle=settle_time, wait_idle=wait_idle)
+    sequence.add("MoveProbe", probe, x, y, settle=settle_time, wait_idle=wait_idle)
+    if contact:
+        sequence.add("MoveProbeContact", probe, level="lowering", wait_idle=wait_idle)
+        sequence.add("EnableMotorQuiet", 1, level="quiet", optional=True)     # the measurement works without quiet mode
+    return sequence
+
+
+# lifts the probe to separation height and lowers it to contact height again, e.g. after a failed contact check
+def recontact_sequence(*, logger, timings=None, settle_time=0.0, probe=1, wait_idle=True) -> CommandSequence:
+    sequence = CommandSequence(name="Re-contact", logger=logger, timings=timings, on_error=(("MoveProbeSeparation", probe),))
+    sequence.add("MoveProbeSeparation", probe, settle=settle_time, wait_idle=wait_idle)
+    sequence.add("MoveProbeContact", probe, settle=settle_time, level="lowering", wait_idle=wait_idle)
+    sequence.add("EnableMotorQuiet", 1, level="quiet", optional=True)
+    return sequence
 
 
 # Connect to Velox Message Server
-def connect_to_message_server(*, ip, logger):
+# port is only changed for the simulator (see custom_simulator.py)
+# framed=True uses custom_sci.MessageServer, which reads every response completely and matches it by its ID,
+# framed=False uses velox.MessageServerInterface
+def connect_to_message_server(*, ip, logger, port=1412, framed=True):
     try:
-        msgServer = velox.MessageServerInterface(ipaddr = ip, targetSocket = 1412)
-        logger.waferprober(f"Connected to Velox Message Server at {ip}.")
+        if framed:
+            msgServer = csci.MessageServer(ipaddr = ip, targetSocket = port, logger = logger)
+        else:
+            msgServer = velox.MessageServerInterface(ipaddr = ip, targetSocket = port)
+        logger.waferprober(f"Connected to Velox Message Server at {ip}:{port}.")
         return msgServer
     except Exception as e:
         logger.waferprober(f"Error connecting to Velox Message Server: {e}")
@@ -28,10 +363,11 @@ def connect_to_message_server(*, ip, logger):
     
 
 # Register applications with Velox Message Server
-def register_applications(*, logger):
+# without msgServer the connection of velox.MessageServerInterface is used
+def register_applications(*, logger, msgServer=None):
     try:
         # Register Wafer Map Application
-        velox.RegisterProberAppChange("WaferMap", "WaferMapLoader", "0")
+        csci.commands_of(msgServer).RegisterProberAppChange("WaferMap", "WaferMapLoader", "0")
         logger.waferprober("WaferMap application registered successfully.")
     except Exception as e:
         logger.critical(f"Error registering WaferMap application: {e}")
@@ -50,7 +386,7 @@ def read_prober_status(*, msgServer, logger):
 def set_heater_temp(*, msgServer, temperature, logger):
     try:
         command=f"SetHeaterTemp {temperature}"
-        response=msgServer.sendSciCommand("SetHeaterTemp", str(temperature) , "C")
+        response=csci.commands_of(msgServer).SetHeaterTemp(temperature, "C")
         logger.waferprober(f"Set heater temperature to {temperature}C")
 
 
@@ -110,7 +446,7 @@ def set_quiet_mode_scope(*, msgServer, quiet_mode=True, logger):
 # Read temperature from the chuck
 def read_temperature_from_chuck(*, msgServer, logger):
     try:
-        response=msgServer.sendSciCommand("GetHeaterTemp")
+        response=csci.commands_of(msgServer).GetHeaterTemp()
         if isinstance(response,str):
             parts=response.split()
         else:
@@ -158,18 +494,43 @@ def get_die_info(*, msgServer, logger):
 
 
 #Step to next sub die
-def step_to_next_subdie(*, msgServer, logger):
-    try:
-        response=msgServer.sendSciCommand("StepNextDie")
+# True if the answer (or error) of StepNextDie says that there is no next subdie
+def is_end_of_wafer(response):
+    return "EndOfWafer" in str(response) or "EndOfSubDieTable" in str(response)
+
+
+'''
+    this class steps the chuck to the next subdie with StepNextDie (in the order of the prober).
+    finished is only set when the end of the wafer or of the sub die table was reached,
+    a step that fails for another reason (e.g. a lost connection) returns False as well, but leaves it unset.
+    cpath.WaferPlan has the same step() and finished.
+'''
+class SubdieStepper():
+
+    def __init__(self) -> None:
+        self.finished = False
+
+    def step(self, *, msgServer, logger) -> bool:
+        try:
+            response = msgServer.sendSciCommand("StepNextDie")
+        except Exception as e:
+            if is_end_of_wafer(e):
+                self.finished = True
+                logger.waferprober(f"End of wafer or sub die table reached: {e}")
+            else:
+                logger.critical(f"Error stepping to next subdie: {e}")
+            return False
         logger.waferprober(f"Stepped to next subdie: {response}")
-        if "EndOfWafer" in response or "EndOfSubDieTable" in response:
+        if is_end_of_wafer(response):
+            self.finished = True
             logger.waferprober("End of wafer or sub die table reached. Exiting....")
             return False
         return True
-    except Exception as e:
-        logger.critical(f"Error stepping to next subdie: {e}")
-        return False
-    
+
+
+def step_to_next_subdie(*, msgServer, logger):
+    return SubdieStepper().step(msgServer=msgServer, logger=logger)
+
 def set_home(*, msgServer, logger, offset = False):
     logger.critical(f"Setting new Home Position")
     if offset == False:
@@ -181,7 +542,7 @@ def set_home(*, msgServer, logger, offset = False):
 
 def get_chuck_temperature(*, msgServer, logger):
     try:
-        response = msgServer.sendSciCommand("GetHeaterTemp")
+        response = csci.commands_of(msgServer).GetHeaterTemp()
         if isinstance(response, str):
             parts = response.split()
         else:
@@ -199,10 +560,10 @@ def get_chuck_temperature(*, msgServer, logger):
 def set_scope_light(*, msgServer, light_on=True, logger):
     try:
         if light_on:
-            response = msgServer.sendSciCommand("SetMicroLight", 1)
+            response = csci.commands_of(msgServer).SetMicroLight(1)
             logger.waferprober("Scope light turned ON")
         else:
-            response = msgServer.sendSciCommand("SetMicroLight", 0)
+            response = csci.commands_of(msgServer).SetMicroLight(0)
             logger.waferprober("Scope light turned OFF")
         return response
     except Exception as e:
@@ -3,7 +3,23 @@
 from sys import version_info
 from velox.vxmessageserver import *
 
-if (version_info[0] > 2 and version_info[1] >= 5):
+if version_info >= (3, 7):
+    from importlib import import_module
+
+    # The SCI command functions are only imported when the first one is used
+    # (module __getattr__, PEP 562). "from velox import *" asks for __all__ and loads them, too.
+    def __getattr__(name):
+        if name.startswith("__") and name != "__all__":
+            raise AttributeError(name)
+        sci35 = import_module("velox.sci35")
+        public = [key for key in vars(sci35) if not key.startswith("_")]
+        globals().update((key, getattr(sci35, key)) for key in public)
+        if name == "__all__":
+            return public
+        if name in globals():
+            return globals()[name]
+        raise AttributeError("module 'velox' has no attribute '{}'".format(name))
+elif version_info >= (3, 5):
     from velox.sci35 import *
 else:
     from velox.sci27 import *